@@ -15,6 +15,8 @@
 # main file with cli commands using python click library
 # include two click commands: 1. data ingestion (using the data loader), 2. query (using the agent)
 import json
+import time
+import uuid
 from typing import Optional
 
 import click
@@ -27,6 +29,7 @@ from controller.db import client
 from genai_factory.schemas import (
     DataSource,
     Document,
+    IngestionJob,
     Project,
     QueryItem,
     User,
@@ -116,9 +119,17 @@ def print_config():
 @click.option(
     "-f", "--from-file", is_flag=True, help="Take the document paths from the file"
 )
-def ingest(path, project, name, loader, metadata, version, data_source, from_file):
+@click.option(
+    "-w",
+    "--wait",
+    is_flag=True,
+    help="Wait for the ingestion job and show its progress",
+)
+def ingest(
+    path, project, name, loader, metadata, version, data_source, from_file, wait
+):
     """
-    Ingest data into the data source.
+    Ingest data into the data source. The ingestion runs as a background job in the application.
 
     :param path:        Path to the document
     :param project:     The project name to which the document belongs.
@@ -128,6 +139,7 @@ def ingest(path, project, name, loader, metadata, version, data_source, from_fil
     :param version:     Version of the document
     :param data_source: Data source name
     :param from_file:   Take the document paths from the file
+    :param wait:        Wait for the ingestion job to finish, showing its progress
     """
     db_session = client.get_db_session()
     project = client.get_project(name=project, db_session=db_session)
@@ -150,11 +162,35 @@ def ingest(path, project, name, loader, metadata, version, data_source, from_fil
         db_session=db_session,
     )
     document = response.to_dict(to_datestr=True)
+    # Record the document as ingested into the data source (it is kept as deleted in the data source when the document
+    # is deleted, so its chunks are garbage collected):
+    client.add_document_to_data_source(
+        document_id=response.uid,
+        document_version=response.version,
+        data_source_id=data_source.uid,
+        data_source_version=data_source.version,
+        db_session=db_session,
+    )
+
+    # Create the ingestion job to track the ingestion:
+    job = client.create_ingestion_job(
+        job=IngestionJob(
+            name=f"ingest-{data_source.name}-{uuid.uuid4().hex[:8]}",
+            owner_id=data_source.owner_id,
+            project_id=project.uid,
+            data_source_id=data_source.uid,
+            loader=loader,
+            paths=[path],
+            document_ids=[response.uid],
+        ),
+        db_session=db_session,
+    )
 
     # Send ingest to application:
     params = {
         "loader": loader,
         "from_file": from_file,
+        "job_id": job.uid,
     }
 
     data = {
@@ -172,10 +208,30 @@ def ingest(path, project, name, loader, metadata, version, data_source, from_fil
         data=json.dumps(data),
         params=params,
     )
-    if response["status"] == "ok":
-        click.echo("Ingestion completed successfully")
-    else:
+    if response["status"] != "accepted":
         click.echo("Ingestion failed")
+        return
+    click.echo(f"Ingestion job {job.uid} was submitted")
+    if not wait:
+        return
+
+    # Follow the job's progress (a new DB session every time to read the job's latest state):
+    last_progress = None
+    while True:
+        job = client.get_ingestion_job(uid=job.uid)
+        progress = (
+            f"{job.status.value}: {job.processed_files}/{job.total_files} files,"
+            f" {job.failed_files} failed, {job.chunks} chunks"
+            f" ({job.chunks_per_second or 0} chunks/s)"
+        )
+        if progress != last_progress:
+            click.echo(progress)
+            last_progress = progress
+        if job.status.is_terminal():
+            break
+        time.sleep(2)
+    for error in job.errors:
+        click.echo(f"Error: {error}")
 
 
 @click.command()
@@ -371,6 +427,148 @@ def list_sessions(user, last, created):
     click.echo(table)
 
 
+@click.command("jobs")
+@click.option("-p", "--project", type=str, help="project name", default="default")
+@click.option("-d", "--data-source", type=str, help="data source name filter")
+@click.option("-s", "--status", type=str, help="job status filter")
+@click.option("-l", "--last", type=int, default=0, help="last n jobs")
+def list_jobs(project, data_source, status, last):
+    """
+    List ingestion jobs
+
+    :param project:     Project name
+    :param data_source: Data source name filter
+    :param status:      Job status filter
+    :param last:        Last n jobs
+    """
+    click.echo("Running List Jobs")
+    db_session = client.get_db_session()
+    project = client.get_project(name=project, db_session=db_session)
+    data_source_id = None
+    if data_source:
+        data_source_id = client.get_data_source(
+            project_id=project.uid, name=data_source, db_session=db_session
+        ).uid
+    client.fail_stale_ingestion_jobs(
+        timeout=config.ingestion_job_timeout,
+        project_id=project.uid,
+        db_session=db_session,
+    )
+    jobs = client.list_ingestion_jobs(
+        project_id=project.uid,
+        data_source_id=data_source_id,
+        status=status,
+        last=last,
+        db_session=db_session,
+    )
+    data = [
+        {
+            "uid": job.uid,
+            "status": job.status.value,
+            "files": f"{job.processed_files}/{job.total_files}",
+            "failed": job.failed_files,
+            "chunks": job.chunks,
+            "chunks/s": job.chunks_per_second,
+            "created": job.created,
+        }
+        for job in jobs
+    ]
+    table = format_table_results(data)
+    click.echo(table)
+
+
+@click.command("cancel-job")
+@click.argument("uid", type=str)
+def cancel_job(uid):
+    """
+    Cancel an ingestion job. The application stops the job after the chunks batch it is writing.
+
+    :param uid: The ingestion job UID
+    """
+    db_session = client.get_db_session()
+    job = client.cancel_ingestion_job(uid=uid, db_session=db_session)
+    if job is None:
+        raise click.ClickException(f"Job {uid} not found")
+    if job.status.is_terminal():
+        raise click.ClickException(f"Job {uid} already finished ({job.status.value})")
+    click.echo(f"Cancellation of job {uid} was requested")
+
+
+@click.command("gc")
+@click.argument("data_source", type=str)
+@click.option("-p", "--project", type=str, help="project name", default="default")
+@click.option("-c", "--compact", is_flag=True, help="Compact the vector store after")
+@click.option(
+    "--dry-run", is_flag=True, help="Only count the orphaned chunks, delete nothing"
+)
+@click.option(
+    "--include-untracked",
+    is_flag=True,
+    help="Also delete the chunks of untracked documents",
+)
+@click.option(
+    "-b", "--batch-size", type=int, default=1000, help="Chunks per delete request"
+)
+def collect_garbage(
+    data_source, project, compact, dry_run, include_untracked, batch_size
+):
+    """
+    Delete the chunks of deleted documents and replaced document versions from a data source's vector store. The
+    chunks of documents that are not recorded in the data source (chunks ingested before documents were recorded) are
+    only deleted with --include-untracked, run with --dry-run first to count them.
+
+    :param data_source:       The data source name
+    :param project:           The project name
+    :param compact:           Compact the vector store after the deletion
+    :param dry_run:           Only count the orphaned chunks without deleting them
+    :param include_untracked: Delete the chunks of untracked documents as well
+    :param batch_size:        The number of chunks to read and delete per request
+    """
+    db_session = client.get_db_session()
+    project = client.get_project(name=project, db_session=db_session)
+    data_source = client.get_data_source(
+        project_id=project.uid, name=data_source, db_session=db_session
+    )
+    live_documents = [
+        [association["document_id"], association["document_version"] or ""]
+        for association in client.list_data_source_documents(
+            data_source_id=data_source.uid, db_session=db_session
+        )
+    ]
+    deleted_documents = list(
+        {
+            deleted["document_id"]
+            for deleted in client.list_deleted_documents(
+                data_source_id=data_source.uid, db_session=db_session
+            )
+        }
+    )
+    stats = _send_to_application(
+        path=f"data_sources/{data_source.name}/gc",
+        method="POST",
+        data=json.dumps(
+            {
+                "database_kwargs": data_source.database_kwargs,
+                "live_documents": live_documents,
+                "deleted_documents": deleted_documents,
+            }
+        ),
+        params={
+            "compact": compact,
+            "dry_run": dry_run,
+            "include_untracked": include_untracked,
+            "batch_size": batch_size,
+        },
+    )
+    if not dry_run and deleted_documents:
+        client.purge_deleted_documents(
+            data_source_id=data_source.uid,
+            document_ids=deleted_documents,
+            db_session=db_session,
+        )
+    click.echo(format_table_results([stats]))
+
+
 def sources_to_text(sources) -> str:
     """
     Convert a list of sources to a text string.
@@ -457,11 +655,14 @@ cli.add_command(ingest)
 cli.add_command(infer)
 cli.add_command(initdb)
 cli.add_command(print_config)
+cli.add_command(cancel_job)
+cli.add_command(collect_garbage)
 
 cli.add_command(list)
 list.add_command(list_users)
 list.add_command(list_data_sources)
 list.add_command(list_sessions)
+list.add_command(list_jobs)
 
 cli.add_command(update)
 update.add_command(update_data_source)
@@ -19,6 +19,7 @@ from controller.api.endpoints import (
     data_sources,
     datasets,
     documents,
+    jobs,
     models,
     projects,
     prompt_templates,
@@ -80,6 +81,10 @@ api_router.include_router(
     sessions.router,
     tags=["sessions"],
 )
+api_router.include_router(
+    jobs.router,
+    tags=["jobs"],
+)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -13,6 +13,7 @@
 # limitations under the License.
 import json
 import os
+import uuid
 from typing import List, Optional, Tuple, Union
 
 from fastapi import APIRouter, Depends
@@ -30,6 +31,8 @@ from genai_factory.schemas import (
     DataSource,
     DataSourceType,
     Document,
+    IngestionJob,
+    JobStatus,
     OutputMode,
 )
 
@@ -230,7 +233,8 @@ def ingest(
     auth=Depends(get_auth_user),
 ):
     """
-    Ingest document into the vector database.
+    Ingest document into the vector database. The ingestion runs in the background in the application, the response
+    holds the ingestion job to follow with `GET /projects/{project_name}/jobs/{uid}`.
 
     :param project_name: The name of the project to ingest the documents into.
     :param name:         The name of the data source to ingest the documents into.
@@ -243,7 +247,7 @@ def ingest(
     :param db_session:   The database session.
     :param auth:         The authentication information.
 
-    :return: The response from the application.
+    :return: The ingestion job.
     """
     project_id = client.get_project(name=project_name, db_session=db_session).uid
     uid, ds_version = parse_version(uid, version)
@@ -266,11 +270,35 @@ def ingest(
 
     # Add document to the database:
     document = client.create_document(document=document, db_session=db_session)
+    # Record the document as ingested into the data source (it is kept as deleted in the data source when the document
+    # is deleted, so its chunks are garbage collected):
+    client.add_document_to_data_source(
+        document_id=document.uid,
+        document_version=document.version,
+        data_source_id=data_source.uid,
+        data_source_version=data_source.version,
+        db_session=db_session,
+    )
+
+    # Create the ingestion job to track the ingestion:
+    job = client.create_ingestion_job(
+        job=IngestionJob(
+            name=f"ingest-{data_source.name}-{uuid.uuid4().hex[:8]}",
+            owner_id=data_source.owner_id,
+            project_id=project_id,
+            data_source_id=data_source.uid,
+            loader=loader,
+            paths=[path],
+            document_ids=[document.uid],
+        ),
+        db_session=db_session,
+    )
 
     # Send ingest to application:
     params = {
         "loader": loader,
         "from_file": from_file,
+        "job_id": job.uid,
     }
 
     data = {
@@ -281,16 +309,177 @@ def ingest(
         params["metadata"] = json.dumps(metadata)
 
     try:
-        data = _send_to_application(
+        _send_to_application(
             path=f"data_sources/{data_source.name}/ingest",
             method="POST",
             data=json.dumps(data),
             params=params,
             auth=auth,
         )
-        return APIResponse(success=True, data=data)
+        return APIResponse(success=True, data=job)
     except Exception as e:
+        job.status = JobStatus.FAILED
+        job.errors = [f"Failed to submit the job to the application: {e}"]
+        client.update_ingestion_job(uid=job.uid, job=job, db_session=db_session)
         return APIResponse(
             success=False,
             error=f"Failed to ingest document into data source {data_source.name}: {e}",
         )
+
+
+@router.post("/data_sources/{name}/documents")
+def update_data_source_documents(
+    project_name: str,
+    name: str,
+    documents: List[dict],
+    uid: str = None,
+    db_session=Depends(get_db),
+):
+    """
+    Update the extra data (for example, the chunk statistics the application records after ingesting a document) of
+    documents ingested into a data source, in bulk.
+
+    :param project_name: The name of the project the data source belongs to.
+    :param name:         The name of the data source.
+    :param documents:    Dictionaries with the "document_id", "document_version" and "extra_data" (merged into the
+                         existing extra data) of each document.
+    :param uid:          The UID of the data source.
+    :param db_session:   The database session.
+
+    :return: The data source's documents associations.
+    """
+    project_id = client.get_project(name=project_name, db_session=db_session).uid
+    try:
+        data_source = client.get_data_source(
+            name=name, project_id=project_id, uid=uid, db_session=db_session
+        )
+        client.update_data_source_documents(
+            data_source_id=data_source.uid,
+            data_source_version=data_source.version,
+            documents=documents,
+            db_session=db_session,
+        )
+        data = client.list_data_source_documents(
+            data_source_id=data_source.uid, db_session=db_session
+        )
+        return APIResponse(success=True, data=data)
+    except Exception as e:
+        return APIResponse(
+            success=False,
+            error=f"Failed to update the documents of data source {name}: {e}",
+        )
+
+
+@router.get("/data_sources/{name}/documents")
+def list_data_source_documents(
+    project_name: str,
+    name: str,
+    uid: str = None,
+    db_session=Depends(get_db),
+):
+    """
+    List the documents ingested into a data source with their extra data (chunk counts, tokens, embedding time and
+    content hash).
+
+    :param project_name: The name of the project the data source belongs to.
+    :param name:         The name of the data source.
+    :param uid:          The UID of the data source.
+    :param db_session:   The database session.
+
+    :return: The data source's documents associations.
+    """
+    project_id = client.get_project(name=project_name, db_session=db_session).uid
+    try:
+        data_source = client.get_data_source(
+            name=name, project_id=project_id, uid=uid, db_session=db_session
+        )
+        data = client.list_data_source_documents(
+            data_source_id=data_source.uid, db_session=db_session
+        )
+        return APIResponse(success=True, data=data)
+    except Exception as e:
+        return APIResponse(
+            success=False,
+            error=f"Failed to list the documents of data source {name}: {e}",
+        )
+
+
+@router.post("/data_sources/{name}/gc")
+def collect_garbage(
+    project_name: str,
+    name: str,
+    uid: str = None,
+    compact: bool = False,
+    dry_run: bool = False,
+    include_untracked: bool = False,
+    batch_size: int = 1000,
+    db_session=Depends(get_db),
+    auth=Depends(get_auth_user),
+):
+    """
+    Delete the chunks of documents that are no longer ingested into a data source (replaced versions and deleted
+    documents) from its vector store. The deleted documents are forgotten once their chunks are collected.
+
+    :param project_name:      The name of the project the data source belongs to.
+    :param name:              The name of the data source.
+    :param uid:               The UID of the data source.
+    :param compact:           Whether to compact the vector store after the deletion.
+    :param dry_run:           Only count the orphaned chunks without deleting them.
+    :param include_untracked: Whether to delete the chunks of documents that are not recorded in the data source
+                              (chunks ingested before documents were recorded).
+    :param batch_size:        The number of chunks to read and delete per request.
+    :param db_session:        The database session.
+    :param auth:              The authentication information.
+
+    :return: The garbage collection statistics.
+    """
+    project_id = client.get_project(name=project_name, db_session=db_session).uid
+    data_source = client.get_data_source(
+        name=name, project_id=project_id, uid=uid, db_session=db_session
+    )
+    # All the versions of the data source share its collection:
+    live_documents = [
+        [association["document_id"], association["document_version"] or ""]
+        for association in client.list_data_source_documents(
+            data_source_id=data_source.uid, db_session=db_session
+        )
+    ]
+    deleted_documents = list(
+        {
+            deleted["document_id"]
+            for deleted in client.list_deleted_documents(
+                data_source_id=data_source.uid, db_session=db_session
+            )
+        }
+    )
+    try:
+        stats = _send_to_application(
+            path=f"data_sources/{data_source.name}/gc",
+            method="POST",
+            data=json.dumps(
+                {
+                    "database_kwargs": data_source.database_kwargs,
+                    "live_documents": live_documents,
+                    "deleted_documents": deleted_documents,
+                }
+            ),
+            params={
+                "compact": compact,
+                "dry_run": dry_run,
+                "include_untracked": include_untracked,
+                "batch_size": batch_size,
+            },
+            auth=auth,
+        )
+        if not dry_run and deleted_documents:
+            client.purge_deleted_documents(
+                data_source_id=data_source.uid,
+                document_ids=deleted_documents,
+                db_session=db_session,
+            )
+        return APIResponse(success=True, data=stats)
+    except Exception as e:
+        return APIResponse(
+            success=False,
+            error=f"Failed to collect garbage of data source {data_source.name}: {e}",
+        )
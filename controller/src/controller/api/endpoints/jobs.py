@@ -0,0 +1,176 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from fastapi import APIRouter, Depends
+from genai_factory.schemas import APIResponse, IngestionJob, JobStatus, OutputMode
+
+from controller.api.utils import get_db
+from controller.config import config
+from controller.db import client
+
+router = APIRouter(prefix="/projects/{project_name}")
+
+
+@router.get("/jobs/{uid}")
+def get_job(
+    project_name: str,
+    uid: str,
+    db_session=Depends(get_db),
+) -> APIResponse:
+    """
+    Get an ingestion job (status and progress) from the database. A running job that did not report progress for
+    `ingestion_job_timeout` seconds (its application is gone) is marked as failed first.
+
+    :param project_name: The name of the project of the job.
+    :param uid:          The UID of the job to get.
+    :param db_session:   The database session.
+
+    :return: The job from the database.
+    """
+    project_id = client.get_project(name=project_name, db_session=db_session).uid
+    try:
+        client.fail_stale_ingestion_jobs(
+            timeout=config.ingestion_job_timeout,
+            project_id=project_id,
+            db_session=db_session,
+        )
+        data = client.get_ingestion_job(
+            uid=uid, project_id=project_id, db_session=db_session
+        )
+        if data is None:
+            return APIResponse(success=False, error=f"Job with uid = {uid} not found")
+        return APIResponse(success=True, data=data)
+    except Exception as e:
+        return APIResponse(
+            success=False,
+            error=f"Failed to get job {uid} in project {project_name}: {e}",
+        )
+
+
+@router.put("/jobs/{uid}")
+def update_job(
+    project_name: str,
+    uid: str,
+    job: IngestionJob,
+    db_session=Depends(get_db),
+) -> APIResponse:
+    """
+    Update an ingestion job in the database. Used by the application to report the job's progress. A cancellation
+    request is kept until the job reaches a final status, so the application sees it in the response and stops.
+
+    :param project_name: The name of the project of the job.
+    :param uid:          The UID of the job to update.
+    :param job:          The job to update.
+    :param db_session:   The database session.
+
+    :return: The updated job from the database.
+    """
+    project_id = client.get_project(name=project_name, db_session=db_session).uid
+    try:
+        data = client.update_ingestion_job(
+            uid=uid, job=job, project_id=project_id, db_session=db_session
+        )
+        if data is None:
+            return APIResponse(success=False, error=f"Job with uid = {uid} not found")
+        return APIResponse(success=True, data=data)
+    except Exception as e:
+        return APIResponse(
+            success=False,
+            error=f"Failed to update job {uid} in project {project_name}: {e}",
+        )
+
+
+@router.post("/jobs/{uid}/cancel")
+def cancel_job(
+    project_name: str,
+    uid: str,
+    db_session=Depends(get_db),
+) -> APIResponse:
+    """
+    Request to cancel an ingestion job. The application stops the job after the chunks batch it is writing, and marks
+    it as cancelled.
+
+    :param project_name: The name of the project of the job.
+    :param uid:          The UID of the job to cancel.
+    :param db_session:   The database session.
+
+    :return: The job from the database.
+    """
+    project_id = client.get_project(name=project_name, db_session=db_session).uid
+    try:
+        job = client.cancel_ingestion_job(
+            uid=uid, project_id=project_id, db_session=db_session
+        )
+        if job is None:
+            return APIResponse(success=False, error=f"Job with uid = {uid} not found")
+        if job.status.is_terminal():
+            return APIResponse(
+                success=False, error=f"Job {uid} already finished ({job.status.value})"
+            )
+        return APIResponse(success=True, data=job)
+    except Exception as e:
+        return APIResponse(
+            success=False,
+            error=f"Failed to cancel job {uid} in project {project_name}: {e}",
+        )
+
+
+@router.get("/jobs")
+def list_jobs(
+    project_name: str,
+    data_source: str = None,
+    status: JobStatus = None,
+    last: int = 0,
+    mode: OutputMode = OutputMode.DETAILS,
+    db_session=Depends(get_db),
+) -> APIResponse:
+    """
+    List the ingestion jobs of a project, latest first. Running jobs that did not report progress for
+    `ingestion_job_timeout` seconds (their application is gone) are marked as failed first.
+
+    :param project_name: The name of the project to list the jobs of.
+    :param data_source:  The name of the data source to filter the jobs by.
+    :param status:       The status to filter the jobs by.
+    :param last:         The number of last jobs to return, 0 for all of them.
+    :param mode:         The output mode.
+    :param db_session:   The database session.
+
+    :return: The jobs from the database.
+    """
+    project_id = client.get_project(name=project_name, db_session=db_session).uid
+    try:
+        client.fail_stale_ingestion_jobs(
+            timeout=config.ingestion_job_timeout,
+            project_id=project_id,
+            db_session=db_session,
+        )
+        data_source_id = None
+        if data_source:
+            data_source_id = client.get_data_source(
+                project_id=project_id, name=data_source, db_session=db_session
+            ).uid
+        data = client.list_ingestion_jobs(
+            project_id=project_id,
+            data_source_id=data_source_id,
+            status=status,
+            last=last,
+            output_mode=mode,
+            db_session=db_session,
+        )
+        return APIResponse(success=True, data=data)
+    except Exception as e:
+        return APIResponse(
+            success=False,
+            error=f"Failed to list jobs in project {project_name}: {e}",
+        )
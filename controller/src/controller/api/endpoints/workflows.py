@@ -15,7 +15,8 @@
 import json
 from typing import List, Optional, Tuple, Union
 
-from fastapi import APIRouter, Depends
+import requests
+from fastapi import APIRouter, Depends, HTTPException
 
 from controller.api.utils import (
     AuthInfo,
@@ -259,9 +260,12 @@ def infer_workflow(
                 ),
             )
     # Prepare the data to send to the application's workflow
+    user = client.get_user(name=auth.username, db_session=db_session)
     data = {
         "item": query.model_dump(),
         "workflow": workflow.to_dict(short=True),
+        # Admins are admitted in the workflow's admin lane when the application is overloaded:
+        "is_admin": bool(user and user.is_admin),
     }
     path = workflow.deployment
 
@@ -275,6 +279,18 @@ def infer_workflow(
             auth=auth,
         )
         return APIResponse(success=True, data=data)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 429:
+            # The workflow is overloaded, let the client retry later:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Workflow {name} in project {project_name} is overloaded",
+                headers={"Retry-After": e.response.headers.get("Retry-After", "1")},
+            )
+        return APIResponse(
+            success=False,
+            error=f"Failed to infer workflow {name} in project {project_name}: {e}",
+        )
     except Exception as e:
         return APIResponse(
             success=False,
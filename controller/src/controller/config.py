@@ -40,6 +40,9 @@ class CtrlConfig(BaseModel):
     }
     db_type: str = "sql"
     application_url: str = "http://localhost:8000"
+    # the number of seconds a running ingestion job may go without reporting progress before it is considered lost
+    # (for example, when the application restarted) and marked as failed:
+    ingestion_job_timeout: int = 3600
 
     # Add any other configuration parameters as needed with model_config
     def print(self):
@@ -526,7 +526,8 @@ class Client(ABC):
     @abstractmethod
     def delete_document(self, name: str, **kwargs):
         """
-        Delete a document from the database.
+        Delete a document from the database. The document is kept as deleted in the data sources it was ingested into,
+        until their chunks are garbage collected.
 
         :param name: The name of the document to delete.
         """
@@ -557,6 +558,84 @@ class Client(ABC):
         """
         pass
 
+    @abstractmethod
+    def add_document_to_data_source(
+        self,
+        document_id: str,
+        document_version: str,
+        data_source_id: str,
+        data_source_version: str,
+        extra_data: dict = None,
+        **kwargs,
+    ):
+        """
+        Record that a document (version) is ingested into a data source (version).
+
+        :param document_id:         The document's uid.
+        :param document_version:    The document's version.
+        :param data_source_id:      The data source's uid.
+        :param data_source_version: The data source's version.
+        :param extra_data:          Extra data about the ingestion of the document into the data source.
+        """
+        pass
+
+    @abstractmethod
+    def update_data_source_documents(
+        self,
+        data_source_id: str,
+        data_source_version: str,
+        documents: List[dict],
+        **kwargs,
+    ):
+        """
+        Update the extra data of documents ingested into a data source, in bulk.
+
+        :param data_source_id:      The data source's uid.
+        :param data_source_version: The data source's version, for documents that are not associated with it yet.
+        :param documents:           Dictionaries with the "document_id", "document_version" and "extra_data" of each
+                                    document.
+        """
+        pass
+
+    @abstractmethod
+    def list_data_source_documents(
+        self, data_source_id: str, data_source_version: str = None, **kwargs
+    ) -> List[dict]:
+        """
+        List the documents ingested into a data source.
+
+        :param data_source_id:      The data source's uid.
+        :param data_source_version: The data source's version, all the versions if None.
+
+        :return: The list of associations, dictionaries with the document's and data source's uid and version and the
+                 extra data.
+        """
+        pass
+
+    @abstractmethod
+    def list_deleted_documents(self, data_source_id: str, **kwargs) -> List[dict]:
+        """
+        List the documents that were deleted from a data source and whose chunks were not garbage collected yet.
+
+        :param data_source_id: The data source's uid.
+
+        :return: The list of deleted documents, dictionaries with the document's and data source's uid and version and
+                 the deletion time.
+        """
+        pass
+
+    @abstractmethod
+    def purge_deleted_documents(
+        self, data_source_id: str, document_ids: List[str], **kwargs
+    ):
+        """
+        Forget deleted documents of a data source, once their chunks were garbage collected.
+
+        :param data_source_id: The data source's uid.
+        :param document_ids:   The uids of the deleted documents to forget.
+        """
+        pass
+
     @abstractmethod
     def create_workflow(
         self, workflow: Union[api_models.Workflow, dict], **kwargs
@@ -706,3 +785,110 @@ class Client(ABC):
         :return: The list of chat sessions.
         """
         pass
+
+    @abstractmethod
+    def create_ingestion_job(
+        self, job: Union[api_models.IngestionJob, dict], **kwargs
+    ) -> api_models.IngestionJob:
+        """
+        Create a new ingestion job in the database.
+
+        :param job: The ingestion job object to create.
+
+        :return: The created ingestion job.
+        """
+        pass
+
+    @abstractmethod
+    def get_ingestion_job(
+        self, uid: str, **kwargs
+    ) -> Optional[api_models.IngestionJob]:
+        """
+        Get an ingestion job from the database.
+
+        :param uid: The UID of the ingestion job to get.
+
+        :return: The requested ingestion job.
+        """
+        pass
+
+    @abstractmethod
+    def update_ingestion_job(
+        self,
+        uid: str,
+        job: Union[api_models.IngestionJob, dict],
+        project_id: str = None,
+        **kwargs,
+    ) -> Optional[api_models.IngestionJob]:
+        """
+        Update an ingestion job in the database. A cancellation request (a cancelling status) is kept until the job
+        reaches a final status, atomically with the update.
+
+        :param uid:        The UID of the ingestion job to update.
+        :param job:        The ingestion job object with the new data.
+        :param project_id: The project the ingestion job must belong to.
+
+        :return: The updated ingestion job, or None if it does not exist in the given project.
+        """
+        pass
+
+    @abstractmethod
+    def cancel_ingestion_job(
+        self, uid: str, project_id: str = None, **kwargs
+    ) -> Optional[api_models.IngestionJob]:
+        """
+        Request to cancel an ingestion job (set its status to cancelling), if it did not reach a final status.
+
+        :param uid:        The UID of the ingestion job to cancel.
+        :param project_id: The project the ingestion job must belong to.
+
+        :return: The ingestion job, or None if it does not exist.
+        """
+        pass
+
+    @abstractmethod
+    def fail_stale_ingestion_jobs(
+        self, timeout: float, project_id: str = None, **kwargs
+    ) -> int:
+        """
+        Finish the running ingestion jobs that did not report progress for `timeout` seconds (their application is
+        gone), as failed or, if they were being cancelled, as cancelled.
+
+        :param timeout:    The number of seconds without a progress report after which a job is considered lost.
+        :param project_id: The project to finish the stale ingestion jobs of. Default is all the projects.
+
+        :return: The number of finished jobs.
+        """
+        pass
+
+    @abstractmethod
+    def delete_ingestion_job(self, uid: str, **kwargs):
+        """
+        Delete an ingestion job from the database.
+
+        :param uid: The UID of the ingestion job to delete.
+        """
+        pass
+
+    @abstractmethod
+    def list_ingestion_jobs(
+        self,
+        project_id: str = None,
+        data_source_id: str = None,
+        status: str = None,
+        last=0,
+        output_mode: api_models.OutputMode = api_models.OutputMode.DETAILS,
+        **kwargs,
+    ):
+        """
+        List ingestion jobs from the database, latest first.
+
+        :param project_id:     The project to filter the ingestion jobs by.
+        :param data_source_id: The data source to filter the ingestion jobs by.
+        :param status:         The status to filter the ingestion jobs by.
+        :param last:           The number of last ingestion jobs to return.
+        :param output_mode:    The output mode.
+
+        :return: The list of ingestion jobs.
+        """
+        pass
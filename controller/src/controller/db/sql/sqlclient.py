@@ -590,7 +590,16 @@ class SqlClient(Client):
         :return: A response object with the success status.
         """
         logger.debug(f"Deleting data source: name={name}")
-        self._delete(db_session, db.DataSource, name=name, **kwargs)
+        session = self.get_db_session(db_session)
+        # The chunks of the documents deleted from the data source go with it:
+        kwargs = self._drop_none(name=name, **kwargs)
+        for data_source in session.query(db.DataSource).filter_by(**kwargs):
+            session.execute(
+                db.deleted_document.delete().where(
+                    db.deleted_document.c.data_source_id == data_source.uid
+                )
+            )
+        self._delete(session, db.DataSource, **kwargs)
 
     def list_data_sources(
         self,
@@ -1065,7 +1074,206 @@ class SqlClient(Client):
         :param kwargs:     Additional keyword arguments to filter the document.
         """
         logger.debug(f"Deleting document: name={name}")
-        self._delete(db_session, db.Document, name=name, **kwargs)
+        session = self.get_db_session(db_session)
+        # Replace the document's data sources associations with deleted documents records, so its chunks are garbage
+        # collected:
+        table = db.document_to_data_source
+        kwargs = self._drop_none(name=name, **kwargs)
+        for document in session.query(db.Document).filter_by(**kwargs):
+            conditions = [
+                table.c.document_id == document.uid,
+                table.c.document_version == document.version,
+            ]
+            for row in session.execute(sqlalchemy.select(table).where(*conditions)):
+                session.execute(
+                    db.deleted_document.insert().values(
+                        document_id=row.document_id,
+                        document_version=row.document_version,
+                        data_source_id=row.data_source_id,
+                        data_source_version=row.data_source_version,
+                    )
+                )
+            session.execute(table.delete().where(*conditions))
+        self._delete(session, db.Document, **kwargs)
+
+    def add_document_to_data_source(
+        self,
+        document_id: str,
+        document_version: str,
+        data_source_id: str,
+        data_source_version: str,
+        extra_data: dict = None,
+        db_session: sqlalchemy.orm.Session = None,
+    ):
+        """
+        Record that a document (version) is ingested into a data source (version). An existing association is updated
+        with the given extra data.
+
+        :param document_id:         The document's uid.
+        :param document_version:    The document's version.
+        :param data_source_id:      The data source's uid.
+        :param data_source_version: The data source's version.
+        :param extra_data:          Extra data about the ingestion of the document into the data source.
+        :param db_session:          The session to use.
+        """
+        logger.debug(
+            f"Adding document {document_id}:{document_version} to data source {data_source_id}:{data_source_version}"
+        )
+        session = self.get_db_session(db_session)
+        table = db.document_to_data_source
+        conditions = [
+            table.c.document_id == document_id,
+            table.c.document_version == (document_version or ""),
+            table.c.data_source_id == data_source_id,
+            table.c.data_source_version == (data_source_version or ""),
+        ]
+        exists = session.execute(
+            sqlalchemy.select(table.c.document_id).where(*conditions)
+        ).first()
+        if exists is None:
+            session.execute(
+                table.insert().values(
+                    document_id=document_id,
+                    document_version=document_version or "",
+                    data_source_id=data_source_id,
+                    data_source_version=data_source_version or "",
+                    extra_data=extra_data,
+                )
+            )
+        elif extra_data is not None:
+            session.execute(
+                table.update().where(*conditions).values(extra_data=extra_data)
+            )
+        session.commit()
+
+    def update_data_source_documents(
+        self,
+        data_source_id: str,
+        data_source_version: str,
+        documents: List[dict],
+        db_session: sqlalchemy.orm.Session = None,
+    ):
+        """
+        Update the extra data of documents ingested into a data source, in bulk (a single transaction). The extra data
+        is merged into the existing one, and documents that are not associated with the data source yet are added to
+        it.
+
+        :param data_source_id:      The data source's uid.
+        :param data_source_version: The data source's version, for documents that are not associated with it yet.
+        :param documents:           Dictionaries with the "document_id", "document_version" and "extra_data" of each
+                                    document.
+        :param db_session:          The session to use.
+        """
+        logger.debug(
+            f"Updating {len(documents)} documents of data source {data_source_id}"
+        )
+        session = self.get_db_session(db_session)
+        table = db.document_to_data_source
+        for document in documents:
+            document_version = document.get("document_version") or ""
+            extra_data = document.get("extra_data") or {}
+            conditions = [
+                table.c.document_id == document["document_id"],
+                table.c.document_version == document_version,
+                table.c.data_source_id == data_source_id,
+            ]
+            rows = session.execute(
+                sqlalchemy.select(
+                    table.c.data_source_version, table.c.extra_data
+                ).where(*conditions)
+            ).all()
+            if not rows:
+                session.execute(
+                    table.insert().values(
+                        document_id=document["document_id"],
+                        document_version=document_version,
+                        data_source_id=data_source_id,
+                        data_source_version=data_source_version or "",
+                        extra_data=extra_data,
+                    )
+                )
+            for row in rows:
+                session.execute(
+                    table.update()
+                    .where(
+                        *conditions,
+                        table.c.data_source_version == row.data_source_version,
+                    )
+                    .values(extra_data={**(row.extra_data or {}), **extra_data})
+                )
+        session.commit()
+
+    def list_data_source_documents(
+        self,
+        data_source_id: str,
+        data_source_version: str = None,
+        db_session: sqlalchemy.orm.Session = None,
+    ) -> List[dict]:
+        """
+        List the documents ingested into a data source.
+
+        :param data_source_id:      The data source's uid.
+        :param data_source_version: The data source's version, all the versions if None.
+        :param db_session:          The session to use.
+
+        :return: The list of associations, dictionaries with the document's and data source's uid and version and the
+                 extra data.
+        """
+        logger.debug(
+            f"Listing documents of data source: {data_source_id}:{data_source_version}"
+        )
+        session = self.get_db_session(db_session)
+        table = db.document_to_data_source
+        query = sqlalchemy.select(table).where(table.c.data_source_id == data_source_id)
+        if data_source_version is not None:
+            query = query.where(table.c.data_source_version == data_source_version)
+        return [dict(row._mapping) for row in session.execute(query)]
+
+    def list_deleted_documents(
+        self,
+        data_source_id: str,
+        db_session: sqlalchemy.orm.Session = None,
+    ) -> List[dict]:
+        """
+        List the documents that were deleted from a data source and whose chunks were not garbage collected yet.
+
+        :param data_source_id: The data source's uid.
+        :param db_session:     The session to use.
+
+        :return: The list of deleted documents, dictionaries with the document's and data source's uid and version and
+                 the deletion time.
+        """
+        logger.debug(f"Listing deleted documents of data source: {data_source_id}")
+        session = self.get_db_session(db_session)
+        table = db.deleted_document
+        query = sqlalchemy.select(table).where(table.c.data_source_id == data_source_id)
+        return [dict(row._mapping) for row in session.execute(query)]
+
+    def purge_deleted_documents(
+        self,
+        data_source_id: str,
+        document_ids: List[str],
+        db_session: sqlalchemy.orm.Session = None,
+    ):
+        """
+        Forget deleted documents of a data source, once their chunks were garbage collected.
+
+        :param data_source_id: The data source's uid.
+        :param document_ids:   The uids of the deleted documents to forget.
+        :param db_session:     The session to use.
+        """
+        logger.debug(
+            f"Purging {len(document_ids)} deleted documents of data source: {data_source_id}"
+        )
+        session = self.get_db_session(db_session)
+        table = db.deleted_document
+        session.execute(
+            table.delete().where(
+                table.c.data_source_id == data_source_id,
+                table.c.document_id.in_(document_ids),
+            )
+        )
+        session.commit()
 
     def list_documents(
         self,
@@ -1361,6 +1569,238 @@ class SqlClient(Client):
             query = query.limit(last)
         return self._process_output(query.all(), api_models.ChatSession, output_mode)
 
+    def create_ingestion_job(
+        self,
+        job: Union[api_models.IngestionJob, dict],
+        db_session: sqlalchemy.orm.Session = None,
+    ):
+        """
+        Create a new ingestion job in the database.
+
+        :param job:        The ingestion job object to create.
+        :param db_session: The session to use.
+
+        :return: The created ingestion job.
+        """
+        logger.debug(f"Creating ingestion job: {job}")
+        if isinstance(job, dict):
+            job = api_models.IngestionJob.from_dict(job)
+        return self._create(db_session, db.IngestionJob, job)
+
+    def get_ingestion_job(
+        self, uid: str, db_session: sqlalchemy.orm.Session = None, **kwargs
+    ):
+        """
+        Get an ingestion job from the database.
+
+        :param uid:        The UID of the ingestion job to get.
+        :param db_session: The session to use.
+        :param kwargs:     Additional keyword arguments to filter the ingestion job.
+
+        :return: The requested ingestion job.
+        """
+        logger.debug(f"Getting ingestion job: uid={uid}")
+        return self._get(
+            db_session, db.IngestionJob, api_models.IngestionJob, uid=uid, **kwargs
+        )
+
+    def update_ingestion_job(
+        self,
+        uid: str,
+        job: Union[api_models.IngestionJob, dict],
+        project_id: str = None,
+        db_session: sqlalchemy.orm.Session = None,
+    ):
+        """
+        Update an ingestion job in the database.
+
+        :param uid:        The UID of the ingestion job to update.
+        :param job:        The ingestion job object with the new data.
+        :param project_id: The project the ingestion job must belong to.
+        :param db_session: The session to use.
+
+        :return: The updated ingestion job, or None if it does not exist in the given project.
+        """
+        logger.debug(f"Updating ingestion job: {job}")
+        if isinstance(job, dict):
+            job = api_models.IngestionJob.from_dict(job)
+        session = self.get_db_session(db_session)
+        if project_id:
+            if (
+                session.query(db.IngestionJob)
+                .filter_by(uid=uid, project_id=project_id)
+                .one_or_none()
+                is None
+            ):
+                return None
+            job.project_id = project_id
+        if not job.status.is_terminal():
+            # A conditional update, so a cancellation request is kept until the job reaches a final status. It locks
+            # the job's row (the database with SQLite) until the commit, so a concurrent cancellation waits for it:
+            updated = (
+                session.query(db.IngestionJob)
+                .filter(
+                    db.IngestionJob.uid == uid,
+                    db.IngestionJob.status != api_models.JobStatus.CANCELLING.value,
+                )
+                .update({"status": job.status.value}, synchronize_session=False)
+            )
+            if not updated:
+                status = (
+                    session.query(db.IngestionJob.status).filter_by(uid=uid).scalar()
+                )
+                if status == api_models.JobStatus.CANCELLING.value:
+                    job.status = api_models.JobStatus.CANCELLING
+        return self._update(session, db.IngestionJob, job, uid=uid)
+
+    def cancel_ingestion_job(
+        self,
+        uid: str,
+        project_id: str = None,
+        db_session: sqlalchemy.orm.Session = None,
+        **kwargs,
+    ):
+        """
+        Request to cancel an ingestion job, if it did not reach a final status.
+
+        :param uid:        The UID of the ingestion job to cancel.
+        :param project_id: The project the ingestion job must belong to.
+        :param db_session: The session to use.
+
+        :return: The ingestion job (with its current status if it already finished), or None if it does not exist.
+        """
+        logger.debug(f"Cancelling ingestion job: uid={uid}, project_id={project_id}")
+        session = self.get_db_session(db_session)
+        query = session.query(db.IngestionJob).filter(db.IngestionJob.uid == uid)
+        if project_id:
+            query = query.filter(db.IngestionJob.project_id == project_id)
+        updated = query.filter(
+            db.IngestionJob.status.in_(
+                [
+                    api_models.JobStatus.PENDING.value,
+                    api_models.JobStatus.RUNNING.value,
+                ]
+            ),
+        ).update(
+            {"status": api_models.JobStatus.CANCELLING.value},
+            synchronize_session=False,
+        )
+        if updated:
+            obj = session.query(db.IngestionJob).filter_by(uid=uid).one()
+            obj.spec = {
+                **(obj.spec or {}),
+                "status": api_models.JobStatus.CANCELLING.value,
+            }
+        session.commit()
+        return self.get_ingestion_job(
+            uid=uid, project_id=project_id, db_session=session
+        )
+
+    def fail_stale_ingestion_jobs(
+        self,
+        timeout: float,
+        project_id: str = None,
+        db_session: sqlalchemy.orm.Session = None,
+    ) -> int:
+        """
+        Finish the running ingestion jobs that did not report progress for `timeout` seconds, as the application that
+        ran them is gone (for example, it restarted). Running jobs are marked as failed, and jobs that were being
+        cancelled as cancelled.
+
+        :param timeout:    The number of seconds without a progress report after which a job is considered lost.
+        :param project_id: The project to finish the stale ingestion jobs of. Default is all the projects.
+        :param db_session: The session to use.
+
+        :return: The number of finished jobs.
+        """
+        session = self.get_db_session(db_session)
+        now = datetime.datetime.utcnow()
+        query = session.query(db.IngestionJob).filter(
+            db.IngestionJob.status.in_(
+                [
+                    api_models.JobStatus.RUNNING.value,
+                    api_models.JobStatus.CANCELLING.value,
+                ]
+            ),
+            db.IngestionJob.updated < now - datetime.timedelta(seconds=timeout),
+        )
+        if project_id:
+            query = query.filter(db.IngestionJob.project_id == project_id)
+        jobs = query.all()
+        for obj in jobs:
+            status = (
+                api_models.JobStatus.CANCELLED
+                if obj.status == api_models.JobStatus.CANCELLING.value
+                else api_models.JobStatus.FAILED
+            )
+            logger.warning(
+                f"Ingestion job {obj.uid} did not report progress since {obj.updated}, marking it as {status.value}"
+            )
+            spec = obj.spec or {}
+            obj.status = status.value
+            obj.spec = {
+                **spec,
+                "status": status.value,
+                "finished": now.isoformat(),
+                "errors": [
+                    *spec.get("errors", []),
+                    f"The job did not report progress for {timeout} seconds (the application may have restarted)",
+                ],
+            }
+        session.commit()
+        return len(jobs)
+
+    def delete_ingestion_job(
+        self, uid: str, db_session: sqlalchemy.orm.Session = None, **kwargs
+    ):
+        """
+        Delete an ingestion job from the database.
+
+        :param uid:        The UID of the ingestion job to delete.
+        :param db_session: The session to use.
+        :param kwargs:     Additional keyword arguments to filter the ingestion job.
+        """
+        logger.debug(f"Deleting ingestion job: uid={uid}")
+        self._delete(db_session, db.IngestionJob, uid=uid, **kwargs)
+
+    def list_ingestion_jobs(
+        self,
+        project_id: str = None,
+        data_source_id: str = None,
+        status: str = None,
+        last=0,
+        output_mode: api_models.OutputMode = api_models.OutputMode.DETAILS,
+        db_session: sqlalchemy.orm.Session = None,
+    ):
+        """
+        List ingestion jobs from the database, latest first.
+
+        :param project_id:     The project to filter the ingestion jobs by.
+        :param data_source_id: The data source to filter the ingestion jobs by.
+        :param status:         The status to filter the ingestion jobs by.
+        :param last:           The number of last ingestion jobs to return.
+        :param output_mode:    The output mode.
+        :param db_session:     The session to use.
+
+        :return: The list of ingestion jobs.
+        """
+        logger.debug(
+            f"Getting ingestion jobs: project_id={project_id}, data_source_id={data_source_id}, status={status},"
+            f" last={last}, mode={output_mode}"
+        )
+        session = self.get_db_session(db_session)
+        query = session.query(db.IngestionJob)
+        if project_id:
+            query = query.filter(db.IngestionJob.project_id == project_id)
+        if data_source_id:
+            query = query.filter(db.IngestionJob.data_source_id == data_source_id)
+        if status:
+            query = query.filter(db.IngestionJob.status == status)
+        query = query.order_by(db.IngestionJob.created.desc())
+        if last > 0:
+            query = query.limit(last)
+        return self._process_output(query.all(), api_models.IngestionJob, output_mode)
+
     def _process_output(
         self,
         items,
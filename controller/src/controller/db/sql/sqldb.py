@@ -19,6 +19,7 @@ from typing import List, Optional
 from sqlalchemy import (
     JSON,
     Column,
+    DateTime,
     ForeignKey,
     Index,
     Integer,
@@ -189,6 +190,18 @@ document_to_data_source = Table(
     Column("extra_data", JSON),
 )
 
+# Documents deleted from data sources, kept until the chunks they left in the data sources are garbage collected
+# (no foreign key to the document table, as the documents no longer exist):
+deleted_document = Table(
+    "deleted_document",
+    Base.metadata,
+    Column("document_id", String(ID_LENGTH), index=True),
+    Column("document_version", String(TEXT_LENGTH)),
+    Column("data_source_id", String(ID_LENGTH), index=True),
+    Column("data_source_version", String(TEXT_LENGTH)),
+    Column("deleted", DateTime, default=datetime.datetime.utcnow),
+)
+
 
 class User(BaseSchema):
     """
@@ -261,6 +274,7 @@ class Project(VersionedOwnerBaseSchema):
     prompt_templates: Mapped[List["PromptTemplate"]] = relationship(**relationship_args)
     documents: Mapped[List["Document"]] = relationship(**relationship_args)
     workflows: Mapped[List["Workflow"]] = relationship(**relationship_args)
+    ingestion_jobs: Mapped[List["IngestionJob"]] = relationship(**relationship_args)
 
     def __init__(
         self, uid, name, spec, version, description=None, owner_id=None, labels=None
@@ -647,3 +661,49 @@ class Session(OwnerBaseSchema):
             labels=labels,
         )
         self.workflow_id = workflow_id
+
+
+class IngestionJob(OwnerBaseSchema):
+    """
+    The IngestionJob table which is used to track background ingestions of documents into data sources.
+
+    :arg project_id:     The project's id.
+    :arg data_source_id: The id of the data source the documents are ingested into.
+    :arg status:         The job's status. Can be one of the values in genai_factory.schemas.job.JobStatus.
+    """
+
+    # Columns:
+    project_id: Mapped[str] = mapped_column(
+        String(ID_LENGTH), ForeignKey("project.uid")
+    )
+    data_source_id: Mapped[str] = mapped_column(String(ID_LENGTH))
+    status: Mapped[str] = mapped_column(String(32), index=True)
+
+    # Relationships:
+
+    # many-to-one relationship with projects:
+    project: Mapped["Project"] = relationship(back_populates="ingestion_jobs")
+
+    def __init__(
+        self,
+        uid,
+        name,
+        spec,
+        project_id,
+        data_source_id,
+        status,
+        description=None,
+        owner_id=None,
+        labels=None,
+    ):
+        super().__init__(
+            uid=uid,
+            name=name,
+            spec=spec,
+            description=description,
+            owner_id=owner_id,
+            labels=labels,
+        )
+        self.project_id = project_id
+        self.data_source_id = data_source_id
+        self.status = status
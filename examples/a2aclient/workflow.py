@@ -20,6 +20,7 @@ from genai_factory import workflow_server
 from genai_factory.chains.base import HistorySaver, SessionLoader
 from genai_factory.chains.hallucination_guardrail import HallucinationGuardrail
 from genai_factory.chains.language_guardrail import LanguageGuardrail
+from genai_factory.chains.parallel import ParallelGuardrails
 from genai_factory.chains.refine import RefineQuery, CONVERSATION_CONTEXT_REFINER_PROMPT
 import mlrun.serving as mlrun_serving
 
@@ -45,9 +46,13 @@ intent_classifier = IntentClassifier()
 intent_choice = IntentChoice()
 a2a_client = A2AClient(base_url=os.getenv("A2A_BASE_URL", "http://localhost:10000"), name= "a2a")
 communicator = Communicator(name="communicator")
-language_guardrail = LanguageGuardrail()
-hallucination_guardrail= HallucinationGuardrail()
-history_saver = HistorySaver()
+# The guardrails are independent checks, so they run concurrently:
+guardrails = ParallelGuardrails(
+    guardrails=[LanguageGuardrail(), HallucinationGuardrail()],
+    name="guardrails",
+)
+# Saves the conversation also when a guardrail rejected the answer:
+history_saver = HistorySaver(run_on_stop=True)
 
 # Root , Start of Dag
 root = mlrun_serving.states.RootFlowStep()
@@ -64,10 +69,10 @@ communicator_task = choice_task.to(communicator)
 
 
 # Merge back choice steps
-language_guardrail_task = root.add_step(language_guardrail, after=["a2a","communicator"])
+guardrails_task = root.add_step(guardrails, after=["a2a","communicator"])
 
 # Conncet Last steps
-language_guardrail_task.to(hallucination_guardrail).to(history_saver).respond()
+guardrails_task.to(history_saver).respond()
 
 
 
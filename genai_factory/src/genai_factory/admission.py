@@ -0,0 +1,265 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import contextlib
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from genai_factory.telemetry import (
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUE_WAIT,
+    ADMISSION_QUEUED,
+    ADMISSION_REQUESTS,
+)
+from genai_factory.utils import logger
+
+
+class AdmissionRejected(Exception):
+    """
+    A workflow request was not admitted, because the wait queue was full or the request waited too long in it.
+    """
+
+    def __init__(self, workflow: str, reason: str, retry_after: int):
+        super().__init__(
+            f"Workflow '{workflow}' is overloaded ({reason}), retry after {retry_after} seconds"
+        )
+        self.workflow = workflow
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limit the number of requests a workflow runs concurrently, queueing the rest by priority.
+
+    Requests beyond `max_concurrency` wait in a queue of up to `max_queue_size` requests. Each request waits in a
+    priority lane (by its user, or the admin lane for admins) and a freed slot goes to the oldest request of the
+    highest priority lane. When the queue is full, a new request takes the place of the newest request of a lower
+    priority lane, or is rejected if there is none. Requests that wait longer than `queue_timeout` seconds are
+    rejected as well. Rejected requests are answered with 429 and a `Retry-After` estimated from the recent run times.
+
+    Configure it per workflow in the `workflows_kwargs` of the configuration::
+
+        workflows_kwargs:
+          default:
+            admission:
+              max_concurrency: 8
+              max_queue_size: 64
+              queue_timeout: 20
+              lanes: [admin, default, batch]
+              user_lanes: {reports-bot@example.com: batch}
+
+    The admission is exported as the `genai_factory_admission_*` metrics.
+    """
+
+    def __init__(
+        self,
+        workflow: str,
+        max_concurrency: int,
+        max_queue_size: int = 100,
+        queue_timeout: float = 30.0,
+        lanes: List[str] = None,
+        user_lanes: Dict[str, str] = None,
+        admin_lane: str = None,
+        default_lane: str = None,
+        retry_after: Optional[float] = None,
+    ):
+        """
+        Initialize the admission controller.
+
+        :param workflow:        The workflow name, used for errors and metrics.
+        :param max_concurrency: The maximum number of requests the workflow runs concurrently.
+        :param max_queue_size:  The maximum number of requests waiting to run. 0 rejects requests right away when all
+                                the slots are taken.
+        :param queue_timeout:   The maximum time in seconds a request waits in the queue.
+        :param lanes:           The priority lanes, highest priority first. Default is `["admin", "default"]`.
+        :param user_lanes:      The lanes of specific users, by username.
+        :param admin_lane:      The lane of admin users. Default is the highest priority lane.
+        :param default_lane:    The lane of all the other requests. Default is the "default" lane if there is one,
+                                otherwise the lowest priority lane.
+        :param retry_after:     The `Retry-After` seconds of rejected requests. Default is None (estimated from the
+                                queue length and the recent run times).
+        """
+        if max_concurrency < 1:
+            raise ValueError(
+                f"max_concurrency must be at least 1 (got {max_concurrency})"
+            )
+        self.workflow = workflow
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self.lanes = lanes or ["admin", "default"]
+        self.user_lanes = user_lanes or {}
+        self.admin_lane = admin_lane or self.lanes[0]
+        self.default_lane = default_lane or (
+            "default" if "default" in self.lanes else self.lanes[-1]
+        )
+        for lane in [*self.user_lanes.values(), self.admin_lane, self.default_lane]:
+            if lane not in self.lanes:
+                raise ValueError(f"Unknown lane '{lane}', the lanes are {self.lanes}")
+        self.retry_after = retry_after
+
+        self._running = 0
+        self._queues: Dict[str, Deque[asyncio.Future]] = {
+            lane: deque() for lane in self.lanes
+        }
+        # Exponentially weighted average run time in seconds, to estimate when to retry:
+        self._run_time = None
+
+    def lane_of(self, username: str = None, is_admin: bool = False) -> str:
+        """
+        Get the lane of a request.
+
+        :param username: The requesting user.
+        :param is_admin: Whether the user is an admin.
+
+        :return: The request's lane.
+        """
+        if username in self.user_lanes:
+            return self.user_lanes[username]
+        return self.admin_lane if is_admin else self.default_lane
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> dict:
+        """
+        Get the current admission state.
+
+        :return: A dictionary with the number of running requests, the queued requests per lane and the average run
+                 time in seconds.
+        """
+        return {
+            "running": self._running,
+            "queued": {lane: len(queue) for lane, queue in self._queues.items()},
+            "run_time_s": self._run_time,
+        }
+
+    def _retry_after(self) -> int:
+        if self.retry_after is not None:
+            return max(math.ceil(self.retry_after), 1)
+        if not self._run_time:
+            return 1
+        # The time until the queue ahead of a new request drains:
+        waves = self.queued / self.max_concurrency + 1
+        return max(math.ceil(self._run_time * waves), 1)
+
+    def _reject(self, lane: str, reason: str) -> AdmissionRejected:
+        ADMISSION_REQUESTS.labels(
+            workflow=self.workflow, lane=lane, result=reason
+        ).inc()
+        return AdmissionRejected(self.workflow, reason, self._retry_after())
+
+    def _shed(self, lane: str) -> bool:
+        """
+        Reject the newest request of the lowest priority lane that is lower than the given lane.
+
+        :return: True if a request was rejected to make room.
+        """
+        priority = self.lanes.index(lane)
+        for lower_lane in reversed(self.lanes[priority + 1 :]):
+            queue = self._queues[lower_lane]
+            if queue:
+                future = queue.pop()
+                ADMISSION_QUEUED.labels(workflow=self.workflow, lane=lower_lane).dec()
+                future.set_exception(self._reject(lower_lane, "shed"))
+                return True
+        return False
+
+    def _release(self):
+        """
+        Pass the slot of a finished request to the oldest request of the highest priority lane.
+        """
+        for lane in self.lanes:
+            queue = self._queues[lane]
+            while queue:
+                future = queue.popleft()
+                ADMISSION_QUEUED.labels(workflow=self.workflow, lane=lane).dec()
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self._running -= 1
+        ADMISSION_IN_FLIGHT.labels(workflow=self.workflow).dec()
+
+    def _expire(self, lane: str, future: asyncio.Future):
+        if future.done():
+            return
+        self._queues[lane].remove(future)
+        ADMISSION_QUEUED.labels(workflow=self.workflow, lane=lane).dec()
+        future.set_exception(self._reject(lane, "timeout"))
+
+    async def _acquire(self, lane: str):
+        if self._running < self.max_concurrency and not self.queued:
+            self._running += 1
+            ADMISSION_IN_FLIGHT.labels(workflow=self.workflow).inc()
+            return
+        if self.queued >= self.max_queue_size and not self._shed(lane):
+            raise self._reject(lane, "queue_full")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queues[lane].append(future)
+        ADMISSION_QUEUED.labels(workflow=self.workflow, lane=lane).inc()
+        timer = loop.call_later(self.queue_timeout, self._expire, lane, future)
+        start = time.perf_counter()
+        try:
+            # The slot is handed over by `_release`, so the running count does not change:
+            await future
+        except asyncio.CancelledError:
+            # The caller went away, give up the slot if it was already handed over:
+            if future.done() and not future.cancelled() and not future.exception():
+                self._release()
+            elif future in self._queues[lane]:
+                self._queues[lane].remove(future)
+                ADMISSION_QUEUED.labels(workflow=self.workflow, lane=lane).dec()
+            raise
+        finally:
+            timer.cancel()
+            ADMISSION_QUEUE_WAIT.labels(workflow=self.workflow, lane=lane).observe(
+                time.perf_counter() - start
+            )
+
+    @contextlib.asynccontextmanager
+    async def admit(self, lane: str = None):
+        """
+        Wait for a slot to run a request in.
+
+        :param lane: The request's lane (see `lane_of`). Default is the default lane.
+
+        :raises AdmissionRejected: If the queue is full or the request waited longer than `queue_timeout`.
+        """
+        lane = lane or self.default_lane
+        try:
+            await self._acquire(lane)
+        except AdmissionRejected as e:
+            logger.warning(str(e))
+            raise
+        ADMISSION_REQUESTS.labels(
+            workflow=self.workflow, lane=lane, result="admitted"
+        ).inc()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            run_time = time.perf_counter() - start
+            self._run_time = (
+                run_time
+                if self._run_time is None
+                else 0.8 * self._run_time + 0.2 * run_time
+            )
+            self._release()
@@ -14,12 +14,16 @@
 
 from typing import List, Union
 
-from fastapi import APIRouter, Depends, FastAPI, Header, Request
+from fastapi import APIRouter, Body, Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
 from genai_factory import workflow_server
+from genai_factory.admission import AdmissionRejected
+from genai_factory.data import garbage_collection
+from genai_factory.data.collection_registry import get_collection_registry
 from genai_factory.data.doc_loader import get_data_loader, get_loader_obj
+from genai_factory.data.migration import EmbeddingsMigration
 from genai_factory.schemas import Document, QueryItem, Workflow
 
 app = FastAPI()
@@ -64,29 +68,132 @@ async def ingest(
     metadata: dict = None,
     document: Document = None,
     from_file: bool = False,
+    job_id: str = None,
 ):
-    """Ingest documents into the vector database"""
+    """Ingest documents into the vector database, in the background when a job id is given"""
+    if from_file:
+        with open(document.path, "r") as fp:
+            lines = [line.strip() for line in fp]
+        paths = [line for line in lines if line and not line.startswith("#")]
+    else:
+        paths = [document.path]
+
+    if job_id:
+        workflow_server.ingestion_jobs.submit(
+            job_id=job_id,
+            data_source_name=data_source_name,
+            loader=loader,
+            paths=paths,
+            database_kwargs=database_kwargs,
+            metadata=metadata,
+            version=document.version,
+            doc_uid=document.uid,
+        )
+        return {"status": "accepted", "job_id": job_id}
+
     data_loader = get_data_loader(
         config=workflow_server.config,
         data_source_name=data_source_name,
         database_kwargs=database_kwargs,
     )
+    for path in paths:
+        loader_obj = get_loader_obj(path, loader_type=loader)
+        data_loader.load(
+            loader_obj,
+            metadata=metadata,
+            version=document.version,
+            doc_uid=document.uid,
+        )
+    return {"status": "ok"}
 
-    if from_file:
-        with open(document.path, "r") as fp:
-            lines = fp.readlines()
-        for line in lines:
-            path = line.strip()
-            if path and not path.startswith("#"):
-                loader_obj = get_loader_obj(path, loader_type=loader)
-                data_loader.load(
-                    loader_obj, metadata=metadata, version=document.version
-                )
 
-    else:
-        loader_obj = get_loader_obj(document.path, loader_type=loader)
-        data_loader.load(loader_obj, metadata=metadata, version=document.version)
-    return {"status": "ok"}
+@router.post("/data_sources/{data_source_name}/gc")
+async def collect_garbage(
+    data_source_name: str,
+    database_kwargs: dict,
+    live_documents: List[List[str]],
+    batch_size: int = 1000,
+    compact: bool = False,
+    dry_run: bool = False,
+    include_untracked: bool = False,
+    deleted_documents: List[str] = Body(None),
+):
+    """Delete the chunks of documents that are no longer ingested into the data source"""
+    registry = get_collection_registry(workflow_server.config)
+    migration = registry.get_migration(data_source_name) if registry else None
+    if migration and migration.get("state") == "running":
+        # The deleted chunks may already be copied to the new collection:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Collection '{data_source_name}' is being migrated, collect its garbage once the migration ends",
+        )
+    data_loader = get_data_loader(
+        config=workflow_server.config,
+        data_source_name=data_source_name,
+        database_kwargs=database_kwargs,
+    )
+    return garbage_collection.collect_garbage(
+        data_loader.vector_store,
+        live_documents=[tuple(document) for document in live_documents],
+        keyword_index=data_loader.keyword_index,
+        batch_size=batch_size,
+        compact=compact,
+        dry_run=dry_run,
+        include_untracked=include_untracked,
+        deleted_documents=deleted_documents,
+    )
+
+
+# The running embeddings migrations by collection:
+_migrations = {}
+
+
+@router.post("/data_sources/{data_source_name}/migrate")
+async def migrate_embeddings(
+    data_source_name: str,
+    embeddings: dict,
+    database_kwargs: dict = None,
+    batch_size: int = 256,
+    max_chunks_per_second: float = None,
+):
+    """Re-embed the data source's collection with new embeddings in the background, switching to it when complete"""
+    migration = _migrations.get(data_source_name)
+    if migration is not None and migration._thread.is_alive():
+        raise HTTPException(
+            status_code=409,
+            detail=f"Collection '{data_source_name}' is already being migrated",
+        )
+    migration = EmbeddingsMigration(
+        workflow_server.config,
+        data_source_name,
+        embeddings,
+        vector_store_args=database_kwargs,
+        batch_size=batch_size,
+        max_chunks_per_second=max_chunks_per_second,
+    )
+    _migrations[data_source_name] = migration
+    migration.start()
+    return {"status": "accepted", "target": migration.target_collection}
+
+
+@router.get("/data_sources/{data_source_name}/migrate")
+async def get_migration(data_source_name: str):
+    """Get the state of the data source's latest embeddings migration"""
+    registry = get_collection_registry(workflow_server.config)
+    return registry.get_migration(data_source_name) if registry else None
+
+
+@router.post("/data_sources/{data_source_name}/migrate/cancel")
+async def cancel_migration(data_source_name: str):
+    """Cancel the data source's running embeddings migration"""
+    migration = _migrations.get(data_source_name)
+    if migration is None or not migration._thread.is_alive():
+        raise HTTPException(
+            status_code=404,
+            detail=f"Collection '{data_source_name}' is not being migrated",
+        )
+    migration.cancel()
+    return {"status": "cancelling"}
 
 
 @router.post("/workflows/{name}/infer")
@@ -95,6 +202,7 @@ async def infer_workflow(
     name: str,
     workflow: Workflow,
     item: QueryItem,
+    is_admin: bool = Body(False),
     auth=Depends(get_auth_user),
 ):
     """This is the query command"""
@@ -108,6 +216,13 @@ async def infer_workflow(
         "query": item.question,
         "workflow_id": workflow.uid,
     }
-    resp = await app_server.run_workflow(name, event)
+    try:
+        resp = await app_server.run_workflow(name, event, is_admin=is_admin)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
     print(f"resp: {resp}")
     return resp
@@ -0,0 +1,253 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from genai_factory.telemetry import BATCH_SIZE
+from genai_factory.utils import logger
+
+
+class MicroBatcher:
+    """
+    Coalesce items submitted concurrently into batches and process each batch with a single call.
+
+    A batch is flushed once it holds `max_batch_size` items or once `max_latency_ms` milliseconds passed since its
+    first item arrived, whichever comes first. Items can be submitted from any thread (`submit`) or coroutine
+    (`asubmit`), the batch function runs on a dedicated worker thread and its results are scattered back to each
+    caller in submission order.
+
+    Example:
+        batcher = MicroBatcher(lambda texts: classifier(texts), max_batch_size=32, max_latency_ms=5)
+        label = await batcher.asubmit("I love this product")
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 16,
+        max_latency_ms: float = 10.0,
+        name: str = "batcher",
+    ):
+        """
+        Initialize the micro batcher.
+
+        :param batch_fn:       A function that gets a list of items and returns a list of results of the same length.
+                               A result that is an exception instance is raised to the item's caller.
+        :param max_batch_size: The maximum number of items to process in a single call.
+        :param max_latency_ms: The maximum time in milliseconds to wait for a batch to fill up.
+        :param name:           The name of the batcher, used for logs and metrics.
+        """
+        if max_batch_size < 1:
+            raise ValueError(
+                f"max_batch_size must be at least 1 (got {max_batch_size})"
+            )
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency_ms = max_latency_ms
+        self.name = name
+        self.batch_sizes = Counter()
+
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, item) -> Future:
+        """
+        Submit an item to be processed in the next batch.
+
+        :param item: The item to process.
+
+        :return: A future that will hold the item's result.
+        """
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    async def asubmit(self, item):
+        """
+        Submit an item to be processed in the next batch and await its result.
+
+        :param item: The item to process.
+
+        :return: The item's result.
+        """
+        return await asyncio.wrap_future(self.submit(item))
+
+    def stats(self) -> dict:
+        """
+        Get the batch size histogram collected so far (also exported as the `genai_factory_batch_size` metric).
+
+        :return: A dictionary with the number of batches, number of items, mean batch size and the histogram of
+                 batch size to number of batches.
+        """
+        batches = sum(self.batch_sizes.values())
+        items = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": items / batches if batches else 0.0,
+            "histogram": dict(sorted(self.batch_sizes.items())),
+        }
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run_worker, name=f"{self.name}-worker", daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self) -> list:
+        # Block until the first item arrives, then fill the batch until it is full or the deadline passed:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_latency_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_worker(self):
+        while True:
+            # Drop items whose callers gave up waiting (cancelled futures):
+            batch = [
+                (item, future)
+                for item, future in self._collect()
+                if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+            self.batch_sizes[len(batch)] += 1
+            BATCH_SIZE.labels(batcher=self.name).observe(len(batch))
+            logger.debug(f"{self.name}: processing a batch of {len(batch)} items")
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise ValueError(
+                        f"{self.name}: batch function returned {len(results)} results for {len(items)} items"
+                    )
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+class BatchedLLM(Runnable):
+    """
+    Wrap a language model so concurrent `invoke` / `ainvoke` calls are coalesced into `batch` calls.
+
+    Endpoints that batch prompts natively (self-hosted inference servers) get a single request per batch, other models
+    run the batch with their default concurrent `batch` implementation. Each caller gets its own result (or error).
+    Calls only overlap when events are processed concurrently, so the steps using the model should be configured with
+    `max_in_flight` larger than 1.
+
+    It can be set through the LLM configuration with a `batching` key, for example::
+
+        default_llm:
+          class_name: langchain_openai.ChatOpenAI
+          model_name: my-model
+          batching:
+            max_batch_size: 16
+            max_latency_ms: 20
+
+    Attributes that are not part of the `Runnable` interface are taken from the wrapped model.
+    """
+
+    def __init__(
+        self,
+        llm: Runnable,
+        max_batch_size: int = 8,
+        max_latency_ms: float = 20.0,
+        name: Optional[str] = None,
+    ):
+        """
+        Initialize the batched LLM.
+
+        :param llm:            The language model to wrap.
+        :param max_batch_size: The maximum number of prompts in a single `batch` call.
+        :param max_latency_ms: The maximum time in milliseconds a prompt waits for its batch to fill up.
+        :param name:           The name of the batcher, used for logs and metrics. Default is "llm-<model class>".
+        """
+        self.llm = llm
+        self._batcher = MicroBatcher(
+            self._batch,
+            max_batch_size=max_batch_size,
+            max_latency_ms=max_latency_ms,
+            name=name or f"llm-{type(llm).__name__}",
+        )
+
+    def __getattr__(self, name: str):
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    @property
+    def InputType(self):
+        return self.llm.InputType
+
+    @property
+    def OutputType(self):
+        return self.llm.OutputType
+
+    def invoke(self, input, config: Optional[RunnableConfig] = None, **kwargs):
+        return self._batcher.submit((input, config, kwargs)).result()
+
+    async def ainvoke(self, input, config: Optional[RunnableConfig] = None, **kwargs):
+        return await self._batcher.asubmit((input, config, kwargs))
+
+    def stats(self) -> dict:
+        """
+        Get the batch size histogram collected so far, see `MicroBatcher.stats`.
+        """
+        return self._batcher.stats()
+
+    def _batch(self, calls: list) -> list:
+        # Calls with different keyword arguments (for example, stop words) cannot share a `batch` call:
+        groups = {}
+        for i, (_, _, kwargs) in enumerate(calls):
+            groups.setdefault(repr(sorted(kwargs.items())), []).append(i)
+
+        results = [None] * len(calls)
+        for indices in groups.values():
+            outputs = self.llm.batch(
+                [calls[i][0] for i in indices],
+                config=[calls[i][1] for i in indices],
+                return_exceptions=True,
+                **calls[indices[0]][2],
+            )
+            for i, output in zip(indices, outputs):
+                results[i] = output
+        return results
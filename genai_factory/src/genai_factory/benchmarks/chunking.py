@@ -0,0 +1,175 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compare the throughput of the ChunkingEngine with the RecursiveCharacterTextSplitter:
+#
+#   python -m genai_factory.benchmarks.chunking --data ./docs --processes 8 --length-unit tokens
+
+import pathlib
+import random
+import time
+from typing import Callable, List, Optional
+
+import click
+import yaml
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from genai_factory.data.chunking import ChunkingEngine
+
+_WORDS = (
+    "the model retrieves relevant documents from the vector store and answers the question using them as context "
+    "embeddings are computed in batches while chunks overlap so sentences split between chunks keep their meaning"
+).split()
+
+
+def _generate_documents(count: int, size: int, seed: int = 0) -> List[str]:
+    """
+    Generate documents of about `size` characters made of sentences and paragraphs of random words.
+    """
+    rng = random.Random(seed)
+    documents = []
+    for _ in range(count):
+        paragraphs, length = [], 0
+        while length < size:
+            sentences = [
+                " ".join(rng.choices(_WORDS, k=rng.randint(6, 20))).capitalize() + "."
+                for _ in range(rng.randint(2, 8))
+            ]
+            paragraph = " ".join(sentences)
+            paragraphs.append(paragraph)
+            length += len(paragraph) + 2
+        documents.append("\n\n".join(paragraphs))
+    return documents
+
+
+def _load_documents(path: Optional[pathlib.Path], count: int, size: int) -> List[str]:
+    """
+    Load the text files under a directory, or generate documents when no directory is given.
+    """
+    if path is None:
+        return _generate_documents(count, size)
+    return [
+        file.read_text(encoding="utf8", errors="ignore")
+        for file in sorted(path.rglob("*"))
+        if file.is_file() and file.suffix in [".txt", ".md"]
+    ]
+
+
+def benchmark_splitter(
+    documents: List[str], split: Callable[[List[str]], list], repeats: int
+) -> dict:
+    """
+    Benchmark a splitter over the documents.
+
+    :param documents: The texts to split.
+    :param split:     A function splitting all the documents, returning the chunks (or offsets) of each document.
+    :param repeats:   How many times to split the documents, the best time is reported.
+
+    :return: The benchmark results.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        chunks = split(documents)
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    total_chars = sum(len(document) for document in documents)
+    total_chunks = sum(len(document_chunks) for document_chunks in chunks)
+    return {
+        "time_s": best,
+        "documents_per_s": len(documents) / best,
+        "mb_per_s": total_chars / best / 1e6,
+        "chunks": total_chunks,
+    }
+
+
+@click.command(
+    help="Compare the throughput of the chunking engine with the recursive character text splitter."
+)
+@click.option(
+    "--data",
+    type=click.Path(exists=True, file_okay=False, path_type=pathlib.Path),
+    help="Directory of .txt and .md files. Generated documents are used if not given.",
+)
+@click.option(
+    "--documents", type=int, default=2000, help="Number of generated documents."
+)
+@click.option(
+    "--document-size",
+    type=int,
+    default=20000,
+    help="Size of the generated documents in characters.",
+)
+@click.option("--chunk-size", type=int, default=1024, help="The chunk size.")
+@click.option("--chunk-overlap", type=int, default=20, help="The chunk overlap.")
+@click.option(
+    "--length-unit",
+    type=click.Choice(["chars", "tokens"]),
+    default="chars",
+    help="The unit of the chunk size of the chunking engine.",
+)
+@click.option(
+    "--processes",
+    type=int,
+    default=None,
+    help="Worker processes of the chunking engine, default is the number of CPUs.",
+)
+@click.option(
+    "--repeats", type=int, default=3, help="How many times to split the documents."
+)
+def main(
+    data: Optional[pathlib.Path],
+    documents: int,
+    document_size: int,
+    chunk_size: int,
+    chunk_overlap: int,
+    length_unit: str,
+    processes: Optional[int],
+    repeats: int,
+):
+    texts = _load_documents(data, documents, document_size)
+    report = {}
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    report["recursive_character_splitter"] = benchmark_splitter(
+        texts,
+        lambda batch: [splitter.split_text(text) for text in batch],
+        repeats,
+    )
+
+    for name, engine_processes in [("engine_single_process", 1), ("engine", processes)]:
+        engine = ChunkingEngine(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_unit=length_unit,
+            processes=engine_processes,
+            min_parallel_chars=0,
+        )
+        try:
+            # Start the worker processes before measuring:
+            engine.split_texts(texts[:1])
+            report[name] = benchmark_splitter(texts, engine.split_texts, repeats)
+        finally:
+            engine.close()
+        report[name]["speedup"] = (
+            report["recursive_character_splitter"]["time_s"] / report[name]["time_s"]
+        )
+
+    click.echo(yaml.dump(report, sort_keys=False))
+
+
+if __name__ == "__main__":
+    main()
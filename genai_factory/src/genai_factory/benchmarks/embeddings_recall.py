@@ -0,0 +1,256 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Measure the recall@k, vector memory and search latency of truncated (Matryoshka) and quantized embeddings against
+# exact search over the full embeddings, using the configured embeddings model:
+#
+#   python -m genai_factory.benchmarks.embeddings_recall -c workflow-config.yaml --data ./docs \
+#       --dimensions 256 --dimensions 512 --dtype int8 --dtype binary --rescore-multiplier 4
+
+import pathlib
+import random
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+import click
+import numpy as np
+import yaml
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from genai_factory.benchmarks.utils import latency_summary
+from genai_factory.config import WorkflowServerConfig, get_embedding_function
+from genai_factory.data.local_vector_store import DTYPES, LocalVectorStore
+from genai_factory.embeddings import truncate_embeddings
+
+
+class _PrecomputedEmbeddings(Embeddings):
+    """
+    Return embeddings that were computed in advance, so every variant is indexed without embedding the corpus again.
+    The documents are expected in a single `embed_documents` call, in the order of the vectors.
+    """
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.vectors[: len(texts)].tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        raise NotImplementedError("Queries are searched by their vectors")
+
+
+def _load_corpus(
+    path: pathlib.Path, chunk_size: int, num_queries: int, seed: int = 0
+) -> Tuple[List[str], List[str]]:
+    """
+    Split the text files under a directory into chunks, and pick the first sentence of random chunks as queries.
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=0)
+    chunks = [
+        chunk
+        for file in sorted(path.rglob("*"))
+        if file.is_file() and file.suffix in [".txt", ".md"]
+        for chunk in splitter.split_text(
+            file.read_text(encoding="utf8", errors="ignore")
+        )
+    ]
+    rng = random.Random(seed)
+    sampled = rng.sample(chunks, min(num_queries, len(chunks)))
+    queries = [chunk.split(". ")[0] for chunk in sampled]
+    return chunks, queries
+
+
+def recall_at_k(results: List[List[int]], truth: np.ndarray, k: int) -> float:
+    """
+    Get the mean fraction of the true k nearest neighbors that were returned.
+
+    :param results: The returned neighbors of every query.
+    :param truth:   The true neighbors of every query, nearest first.
+    :param k:       The number of neighbors.
+
+    :return: The recall@k, between 0 and 1.
+    """
+    hits = [
+        len(set(found[:k]) & set(expected[:k].tolist()))
+        for found, expected in zip(results, truth)
+    ]
+    return sum(hits) / (k * len(hits)) if hits else float("nan")
+
+
+def benchmark_variant(
+    documents: np.ndarray,
+    queries: np.ndarray,
+    truth: np.ndarray,
+    k: int,
+    dimensions: Optional[int],
+    dtype: str,
+    rescore_multiplier: int,
+    exact_search_threshold: int,
+) -> dict:
+    """
+    Index the embeddings truncated and quantized and measure the search recall@k and latency.
+
+    :param documents:              The full document embeddings.
+    :param queries:                The full query embeddings.
+    :param truth:                  The exact nearest documents of every query by the full embeddings.
+    :param k:                      The number of documents to search.
+    :param dimensions:             The number of dimensions to keep (None keeps all of them).
+    :param dtype:                  The local vector store dtype.
+    :param rescore_multiplier:     The candidates fetched per result to rescore (binary only).
+    :param exact_search_threshold: The collection size below which searches are exact (not HNSW).
+
+    :return: The benchmark results.
+    """
+    if dimensions:
+        documents = truncate_embeddings(documents, dimensions)
+        queries = truncate_embeddings(queries, dimensions)
+    # Memory-mapped, as deployed, so the resident size is measured apart from the rescoring copies of binary vectors:
+    with tempfile.TemporaryDirectory() as persist_directory:
+        store = LocalVectorStore(
+            _PrecomputedEmbeddings(documents),
+            persist_directory=persist_directory,
+            dtype=dtype,
+            rescore_multiplier=rescore_multiplier,
+            exact_search_threshold=exact_search_threshold,
+        )
+        start = time.perf_counter()
+        store.add_texts(
+            [str(i) for i in range(len(documents))],
+            ids=[str(i) for i in range(len(documents))],
+        )
+        build_time = time.perf_counter() - start
+
+        results, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            found = store.similarity_search_by_vector(query.tolist(), k=k)
+            latencies.append(time.perf_counter() - start)
+            results.append([int(document.id) for document in found])
+        return {
+            "dimensions": int(documents.shape[1]),
+            "dtype": dtype,
+            "rescore_multiplier": rescore_multiplier if dtype == "binary" else None,
+            f"recall@{k}": round(recall_at_k(results, truth, k), 4),
+            "bytes_per_vector": store.vectors_size_bytes // len(documents),
+            "vectors_mb": round(store.vectors_size_bytes / 1e6, 3),
+            "resident_mb": round(store.resident_vectors_size_bytes / 1e6, 3),
+            "build_time_s": round(build_time, 3),
+            "search_latency": latency_summary(latencies),
+        }
+
+
+@click.command(
+    help="Measure the recall@k of truncated and quantized embeddings against exact search over the full embeddings."
+)
+@click.option(
+    "-c",
+    "--config",
+    "config_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="The workflows server configuration, for the embeddings model.",
+)
+@click.option(
+    "--data",
+    type=click.Path(exists=True, file_okay=False, path_type=pathlib.Path),
+    required=True,
+    help="Directory of .txt and .md files to split and embed.",
+)
+@click.option("--chunk-size", type=int, default=1024, help="The chunk size.")
+@click.option("--queries", type=int, default=200, help="Number of queries.")
+@click.option("-k", type=int, default=10, help="The number of documents to search.")
+@click.option(
+    "--dimensions",
+    type=int,
+    multiple=True,
+    help="Truncate the embeddings to these dimensions (repeatable). The full embeddings are always measured.",
+)
+@click.option(
+    "--dtype",
+    "dtypes",
+    type=click.Choice(DTYPES),
+    multiple=True,
+    help="The vector store dtypes to measure (repeatable). Default is all of them.",
+)
+@click.option(
+    "--rescore-multiplier",
+    type=int,
+    multiple=True,
+    default=[4],
+    help="The binary rescoring multipliers to measure (repeatable).",
+)
+@click.option(
+    "--exact-search-threshold",
+    type=int,
+    default=2000,
+    help="The collection size below which searches are exact (HNSW above it).",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the report to a YAML file.",
+)
+def main(
+    config_path: Optional[str],
+    data: pathlib.Path,
+    chunk_size: int,
+    queries: int,
+    k: int,
+    dimensions: Tuple[int, ...],
+    dtypes: Tuple[str, ...],
+    rescore_multiplier: Tuple[int, ...],
+    exact_search_threshold: int,
+    output: Optional[str],
+):
+    config = (
+        WorkflowServerConfig.from_yaml(config_path)
+        if config_path
+        else WorkflowServerConfig()
+    )
+    embeddings = get_embedding_function(config)
+    texts, query_texts = _load_corpus(data, chunk_size, queries)
+    click.echo(f"Embedding {len(texts)} chunks and {len(query_texts)} queries")
+    document_vectors = truncate_embeddings(embeddings.embed_documents(texts), None)
+    query_vectors = truncate_embeddings(
+        [embeddings.embed_query(text) for text in query_texts], None
+    )
+    truth = np.argsort(-(query_vectors @ document_vectors.T), axis=1)[:, :k]
+
+    report = []
+    for dims in [None, *dimensions]:
+        for dtype in dtypes or DTYPES:
+            for multiplier in rescore_multiplier if dtype == "binary" else [1]:
+                report.append(
+                    benchmark_variant(
+                        document_vectors,
+                        query_vectors,
+                        truth,
+                        k,
+                        dims,
+                        dtype,
+                        multiplier,
+                        exact_search_threshold,
+                    )
+                )
+
+    report = yaml.dump(report, sort_keys=False)
+    if output:
+        with open(output, "w") as f:
+            f.write(report)
+    click.echo(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Deterministic fake backends for benchmarking the workflows runtime without an LLM provider or a vector database.
+# They are available through the "fake" shortcut of the LLM, embeddings and vector store configurations:
+#
+#   default_llm:
+#     class_name: fake
+#     latency_ms: 200
+#   embeddings:
+#     class_name: fake
+#   default_vector_store:
+#     class_name: fake
+#     num_documents: 1000
+
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.vectorstores import InMemoryVectorStore
+
+_WORDS = [
+    "model",
+    "data",
+    "pipeline",
+    "feature",
+    "serving",
+    "vector",
+    "document",
+    "project",
+    "workflow",
+    "function",
+    "metric",
+    "artifact",
+    "dataset",
+    "training",
+    "inference",
+    "cluster",
+]
+
+
+def _digest(text: str) -> int:
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16)
+
+
+def _fake_text(text: str, num_words: int) -> str:
+    """
+    Generate a deterministic sentence of `num_words` words from the given text.
+    """
+    digest = _digest(text)
+    words = []
+    for _ in range(num_words):
+        digest, index = divmod(digest, len(_WORDS))
+        words.append(_WORDS[index])
+        if not digest:
+            digest = _digest(" ".join(words))
+    return " ".join(words).capitalize() + "."
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    A deterministic chat model that answers after a fixed latency. The answer is derived from the hash of the prompt
+    and ends with a sources line, so it can be parsed by the retrieval QA chain.
+    """
+
+    latency_ms: float = 0.0
+    """The time in milliseconds each call takes."""
+
+    answer_words: int = 32
+    """The number of words in each answer."""
+
+    sources: str = "0"
+    """The sources line added to each answer."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, messages: List[BaseMessage]) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+        content = _fake_text(prompt, self.answer_words)
+        if self.sources:
+            content += f"\nSOURCES: {self.sources}"
+        prompt_tokens = len(prompt.split())
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": self.answer_words,
+                "total_tokens": prompt_tokens + self.answer_words,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs,
+    ) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        return self._answer(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self._answer(messages)
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """
+    Deterministic random embeddings (seeded by the hash of the text) that take a fixed latency per call.
+    """
+
+    size: int = 384
+    """The size of the embedding vectors."""
+
+    latency_ms: float = 0.0
+    """The time in milliseconds each call takes."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency_ms / 1000)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency_ms / 1000)
+        return super().embed_query(text)
+
+
+# The fake collections are kept per process, so every step (and the ingestion) sees the same documents:
+_collections: Dict[str, Dict[str, Any]] = {}
+_collections_lock = threading.Lock()
+
+
+class FakeVectorStore(InMemoryVectorStore):
+    """
+    An in-memory vector store that accepts the arguments the workflows pass to a vector store. Collections are shared
+    by all the instances in the process and can be seeded with synthetic documents.
+    """
+
+    def __init__(
+        self,
+        embedding_function,
+        collection_name: str = "default",
+        num_documents: int = 0,
+        **kwargs,
+    ):
+        """
+        Initialize the fake vector store.
+
+        :param embedding_function: The embeddings to use.
+        :param collection_name:    The name of the collection.
+        :param num_documents:      The number of synthetic documents to seed an empty collection with.
+        """
+        super().__init__(embedding=embedding_function)
+        self.collection_name = collection_name
+        with _collections_lock:
+            self.store = _collections.setdefault(collection_name, {})
+            if num_documents and not self.store:
+                self.add_documents(
+                    [
+                        Document(
+                            page_content=_fake_text(f"{collection_name}-{i}", 64),
+                            metadata={
+                                "source": f"fake://{collection_name}/{i}",
+                                "doc_uid": str(i),
+                            },
+                        )
+                        for i in range(num_documents)
+                    ]
+                )
@@ -0,0 +1,177 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compare the latency and accuracy of the SentimentAnalysisStep backends:
+#
+#   python -m genai_factory.benchmarks.sentiment_backends --data reviews.jsonl --batch-size 16
+
+import json
+import pathlib
+import time
+from typing import List, Optional, Tuple
+
+import click
+import yaml
+
+from genai_factory.benchmarks.utils import latency_summary
+from genai_factory.chains.sentiment_analysis import SentimentAnalysisStep
+
+# Used when no data file is given, labels follow the default model's label names
+_SAMPLE_DATA = [
+    ("I absolutely love this, it works perfectly!", "LABEL_2"),
+    ("This is the worst service I have ever used.", "LABEL_0"),
+    ("The package arrived on Tuesday.", "LABEL_1"),
+    ("Not bad at all, I would buy it again.", "LABEL_2"),
+    ("It broke after two days, very disappointed.", "LABEL_0"),
+    ("The meeting is scheduled for 3pm.", "LABEL_1"),
+    ("Fantastic support team, they solved my issue in minutes.", "LABEL_2"),
+    ("I waited an hour and nobody answered.", "LABEL_0"),
+]
+
+
+def _load_data(path: Optional[pathlib.Path]) -> Tuple[List[str], List[Optional[str]]]:
+    """
+    Load the benchmark texts and their (optional) gold labels from a JSON lines file with "text" and "label" keys.
+    """
+    if path is None:
+        return [text for text, _ in _SAMPLE_DATA], [label for _, label in _SAMPLE_DATA]
+    texts, labels = [], []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                texts.append(record["text"])
+                labels.append(record.get("label"))
+    return texts, labels
+
+
+def benchmark_backend(
+    texts: List[str], batch_size: int, repeats: int, **step_kwargs
+) -> Tuple[dict, List[str]]:
+    """
+    Benchmark a single backend of the sentiment analysis step.
+
+    :param texts:       The texts to classify.
+    :param batch_size:  The batch size to measure the throughput with.
+    :param repeats:     How many times to go over the texts when measuring.
+    :param step_kwargs: Keyword arguments for the `SentimentAnalysisStep`.
+
+    :return: A tuple of the benchmark results and the predicted labels.
+    """
+    start = time.perf_counter()
+    step = SentimentAnalysisStep(**step_kwargs)
+    load_time = time.perf_counter() - start
+    classifier = step.sentiment_classifier
+
+    # Warm up:
+    classifier(texts[:batch_size], batch_size=batch_size)
+
+    # Single query latency:
+    latencies = []
+    predictions = []
+    for _ in range(repeats):
+        for text in texts:
+            start = time.perf_counter()
+            predictions.append(classifier(text)[0]["label"])
+            latencies.append(time.perf_counter() - start)
+
+    # Batched throughput:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(texts), batch_size):
+            classifier(texts[i : i + batch_size], batch_size=batch_size)
+    batched_time = time.perf_counter() - start
+
+    results = {
+        "load_time_s": load_time,
+        "single_query": latency_summary(latencies),
+        "batched_throughput_per_s": repeats * len(texts) / batched_time,
+    }
+    return results, predictions[: len(texts)]
+
+
+@click.command(
+    help="Compare the latency and accuracy of the sentiment analysis backends."
+)
+@click.option(
+    "--data",
+    type=click.Path(exists=True, path_type=pathlib.Path),
+    help="JSON lines file with 'text' and optional 'label' keys. A small built-in sample is used if not given.",
+)
+@click.option("--model", type=str, default=None, help="The model to benchmark.")
+@click.option(
+    "--batch-size",
+    type=int,
+    default=16,
+    help="Batch size for the throughput measurement.",
+)
+@click.option(
+    "--repeats", type=int, default=3, help="How many times to go over the data."
+)
+@click.option(
+    "--onnx-quantization",
+    type=str,
+    default="avx2",
+    help="Quantization target of the ONNX backend, 'none' to disable quantization.",
+)
+@click.option(
+    "--onnx-cache-dir", type=str, default=None, help="ONNX models cache directory."
+)
+def main(
+    data: Optional[pathlib.Path],
+    model: Optional[str],
+    batch_size: int,
+    repeats: int,
+    onnx_quantization: str,
+    onnx_cache_dir: Optional[str],
+):
+    texts, labels = _load_data(data)
+    report = {}
+
+    reference, reference_predictions = benchmark_backend(
+        texts, batch_size, repeats, model=model, backend="pytorch"
+    )
+    report["pytorch"] = reference
+
+    onnx, onnx_predictions = benchmark_backend(
+        texts,
+        batch_size,
+        repeats,
+        model=model,
+        backend="onnx",
+        onnx_quantization=None if onnx_quantization == "none" else onnx_quantization,
+        onnx_cache_dir=onnx_cache_dir,
+    )
+    onnx["agreement_with_pytorch"] = sum(
+        a == b for a, b in zip(onnx_predictions, reference_predictions)
+    ) / len(texts)
+    onnx["speedup"] = (
+        reference["single_query"]["p50_ms"] / onnx["single_query"]["p50_ms"]
+    )
+    report["onnx"] = onnx
+
+    # Accuracy against the gold labels (when given):
+    if any(label is not None for label in labels):
+        for backend, predictions in [
+            ("pytorch", reference_predictions),
+            ("onnx", onnx_predictions),
+        ]:
+            scored = [(p, g) for p, g in zip(predictions, labels) if g is not None]
+            report[backend]["accuracy"] = sum(p == g for p, g in scored) / len(scored)
+
+    click.echo(yaml.dump(report, sort_keys=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+from typing import List
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """
+    Get the q-th percentile of the samples using the nearest-rank method.
+
+    :param samples: The samples to compute the percentile of.
+    :param q:       The percentile to compute, between 0 and 100.
+
+    :return: The percentile value, or NaN if there are no samples.
+    """
+    if not samples:
+        return math.nan
+    ordered = sorted(samples)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def latency_summary(samples: List[float]) -> dict:
+    """
+    Summarize latency samples (in seconds) into milliseconds statistics.
+
+    :param samples: The latency samples in seconds.
+
+    :return: A dictionary with the count, mean, p50, p95, p99 and max latencies in milliseconds.
+    """
+    return {
+        "count": len(samples),
+        "mean_ms": 1000 * sum(samples) / len(samples) if samples else math.nan,
+        "p50_ms": 1000 * percentile(samples, 50),
+        "p95_ms": 1000 * percentile(samples, 95),
+        "p99_ms": 1000 * percentile(samples, 99),
+        "max_ms": 1000 * max(samples) if samples else math.nan,
+    }
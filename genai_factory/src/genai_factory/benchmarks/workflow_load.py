@@ -0,0 +1,234 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Load test a deployed workflow and report its throughput, latency per step and the server's memory. Deploy the
+# workflows with the fake backends (see `fakes.py`) to measure the runtime itself, for example:
+#
+#   genai-factory run examples/quick_start/workflow.py -c examples/quick_start/benchmark-config.yaml
+#   python -m genai_factory.benchmarks.workflow_load --workflow default --concurrency 16 --requests 500
+
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import click
+import requests
+import yaml
+
+from genai_factory.benchmarks.utils import latency_summary
+
+_RSS_METRIC = re.compile(r"^process_resident_memory_bytes\s+(\S+)$", re.MULTILINE)
+
+
+class _Results:
+    """
+    Latency samples collected by the load generator threads.
+    """
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.step_latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float, step_latencies: dict):
+        with self._lock:
+            self.latencies.append(latency)
+            for step, step_latency in step_latencies.items():
+                self.step_latencies[step].append(step_latency)
+
+    def add_error(self, error: str):
+        with self._lock:
+            self.errors[error] += 1
+
+
+def _get_rss(url: str) -> Optional[int]:
+    """
+    Get the resident memory of the workflows server process from its metrics endpoint.
+    """
+    try:
+        response = requests.get(f"{url}/metrics", timeout=5)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+    match = _RSS_METRIC.search(response.text)
+    return int(float(match.group(1))) if match else None
+
+
+def _send(
+    session: requests.Session, url: str, workflow: str, question: str, timeout: float
+) -> dict:
+    """
+    Send a single inference request and return its returned state.
+    """
+    response = session.post(
+        f"{url}/api/workflows/{workflow}/infer",
+        json={
+            "item": {"question": question},
+            "workflow": {
+                "name": workflow,
+                "owner_id": "benchmark",
+                "project_id": "benchmark",
+                "workflow_type": "application",
+            },
+        },
+        timeout=timeout,
+    )
+    response.raise_for_status()
+    body = response.json()
+    if not body.get("success", False):
+        raise RuntimeError(body.get("error") or "request failed")
+    return (body.get("data") or {}).get("returned_state") or {}
+
+
+def run_load(
+    url: str,
+    workflow: str,
+    concurrency: int,
+    num_requests: int,
+    warmup: int = 0,
+    timeout: float = 60.0,
+    memory_interval: float = 1.0,
+) -> dict:
+    """
+    Drive a workflow's inference endpoint with concurrent requests.
+
+    :param url:             The workflows server URL.
+    :param workflow:        The name of the workflow to run.
+    :param concurrency:     The number of concurrent clients.
+    :param num_requests:    The total number of requests to send (not including the warmup).
+    :param warmup:          The number of requests to send before measuring.
+    :param timeout:         The timeout in seconds of each request.
+    :param memory_interval: The interval in seconds between samples of the server's memory.
+
+    :return: The load test report.
+    """
+    for i in range(warmup):
+        with requests.Session() as session:
+            _send(session, url, workflow, f"Warmup question {i}", timeout)
+
+    results = _Results()
+    counter = iter(range(num_requests))
+    counter_lock = threading.Lock()
+
+    def client():
+        with requests.Session() as session:
+            while True:
+                with counter_lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    state = _send(
+                        session, url, workflow, f"Benchmark question {i}", timeout
+                    )
+                except Exception as e:
+                    results.add_error(type(e).__name__)
+                    continue
+                results.add(
+                    time.perf_counter() - start, state.get("step_latencies", {})
+                )
+
+    # Sample the server's memory while the load runs:
+    rss_samples = [_get_rss(url)]
+    done = threading.Event()
+
+    def sample_memory():
+        while not done.wait(memory_interval):
+            rss_samples.append(_get_rss(url))
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    duration = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    rss_samples.append(_get_rss(url))
+
+    rss = [sample for sample in rss_samples if sample is not None]
+    return {
+        "workflow": workflow,
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "errors": dict(results.errors),
+        "duration_s": duration,
+        "throughput_per_s": len(results.latencies) / duration,
+        "latency": latency_summary(results.latencies),
+        "steps": {
+            step: latency_summary(samples)
+            for step, samples in results.step_latencies.items()
+        },
+        "memory": {
+            "rss_start_mb": rss[0] / 2**20 if rss else None,
+            "rss_peak_mb": max(rss) / 2**20 if rss else None,
+            "rss_end_mb": rss[-1] / 2**20 if rss else None,
+        },
+    }
+
+
+@click.command(help="Load test a deployed workflow.")
+@click.option(
+    "--url",
+    type=str,
+    default="http://localhost:8000",
+    help="The workflows server URL.",
+)
+@click.option("-w", "--workflow", type=str, default="default", help="Workflow name.")
+@click.option(
+    "-c", "--concurrency", type=int, default=8, help="Number of concurrent clients."
+)
+@click.option(
+    "-n", "--requests", "num_requests", type=int, default=200, help="Total requests."
+)
+@click.option("--warmup", type=int, default=5, help="Number of warmup requests.")
+@click.option("--timeout", type=float, default=60.0, help="Request timeout in seconds.")
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the report to a YAML file as well.",
+)
+def main(
+    url: str,
+    workflow: str,
+    concurrency: int,
+    num_requests: int,
+    warmup: int,
+    timeout: float,
+    output: Optional[str],
+):
+    report = run_load(
+        url=url.rstrip("/"),
+        workflow=workflow,
+        concurrency=concurrency,
+        num_requests=num_requests,
+        warmup=warmup,
+        timeout=timeout,
+    )
+    report = yaml.dump(report, sort_keys=False)
+    click.echo(report)
+    if output:
+        with open(output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,12 +17,35 @@ import asyncio
 import storey
 
 from genai_factory.schemas import WorkflowEvent
+from genai_factory.telemetry import step_span
+from genai_factory.utils import logger
 
 
 class ChainRunner(storey.Flow):
-    def __init__(self, **kwargs):
+    def __init__(self, max_in_flight: int = 1, run_on_stop: bool = False, **kwargs):
+        """
+        Initialize the chain runner.
+
+        A step may stop an event by returning `{"stop": True, "error_message": ...}` (see the guardrails). A stopped
+        event skips every later step on its way to the responder, except for finalizer steps (`run_on_stop=True`).
+
+        :param max_in_flight: The maximum number of events this step processes concurrently. Default is 1, meaning
+                              events are processed one after the other. Higher values let events overlap in this step
+                              (synchronous `_run` implementations are then executed in worker threads), which is
+                              required for steps that batch work across events.
+        :param run_on_stop:   Whether this step is a finalizer that runs even when a previous step stopped the event.
+                              Default is False.
+        """
         super().__init__(**kwargs)
+        if max_in_flight < 1:
+            raise ValueError(
+                f"max_in_flight may not be less than 1 (got {max_in_flight})"
+            )
+        self.max_in_flight = max_in_flight
+        self.run_on_stop = run_on_stop
         self._is_async = asyncio.iscoroutinefunction(self._run)
+        self._in_flight = set()
+        self._in_flight_slots = None
 
     def _run(self, event: WorkflowEvent):
         raise NotImplementedError()
@@ -50,21 +73,90 @@ class ChainRunner(storey.Flow):
 
     async def _do(self, event):
         if event is storey.dtypes._termination_obj:
+            # Let events that are still in flight reach the downstream steps before terminating them:
+            if self._in_flight:
+                await asyncio.gather(*self._in_flight, return_exceptions=True)
             return await self._do_downstream(storey.dtypes._termination_obj)
+        if self.max_in_flight == 1:
+            return await self._process(event, run_in_thread=False)
+
+        # Process the event in the background so the next event can enter this step right away:
+        if self._in_flight_slots is None:
+            self._in_flight_slots = asyncio.Semaphore(self.max_in_flight)
+        await self._in_flight_slots.acquire()
+        task = asyncio.get_running_loop().create_task(self._process_in_flight(event))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _process_in_flight(self, event):
+        try:
+            await self._process(event, run_in_thread=True)
+        except Exception as ex:
+            # There is no caller awaiting this task, so the error is reported to the event's awaiter:
+            if event._awaitable_result:
+                none_or_coroutine = event._awaitable_result._set_error(ex)
+                if none_or_coroutine:
+                    await none_or_coroutine
+            elif self.logger:
+                self.logger.error(
+                    f"Step '{self.name}' failed to process an event: {ex}"
+                )
+        finally:
+            self._in_flight_slots.release()
+
+    async def arun(self, event: WorkflowEvent):
+        """
+        Run the step on the given event outside the graph, without blocking the event loop (a synchronous `_run` is
+        executed in a worker thread). Used by composite steps that run other steps concurrently.
+
+        :param event: The event to run the step on.
+
+        :return: The step's results.
+        """
+        if self._is_async:
+            return await self._run(event)
+        return await asyncio.to_thread(self._run, event)
+
+    @staticmethod
+    def _apply_results(element: WorkflowEvent, resp: dict):
+        for key, val in resp.items():
+            element.results[key] = val
+        if "answer" in resp:
+            element.query = resp["answer"]
+
+    @staticmethod
+    def is_stopped(element: WorkflowEvent) -> bool:
+        """
+        Check whether a previous step stopped the event.
+
+        :param element: The event to check.
+
+        :return: True if the event was stopped, False otherwise.
+        """
+        return bool(element.results.get("stop"))
+
+    async def _process(self, event, run_in_thread: bool):
+        element = self._get_event_or_body(event)
+        if self.is_stopped(element) and not self.run_on_stop:
+            # Pass the stopped event straight through to the responder:
+            logger.debug(f"Skipping step '{self.name}', the event was stopped")
+            resp = None
         else:
-            print("step name: ", self.name)
-            element = self._get_event_or_body(event)
-            if self._is_async:
-                resp = await self._run(element)
-            else:
-                resp = self._run(element)
-            if resp:
-                for key, val in resp.items():
-                    element.results[key] = val
-                if "answer" in resp:
-                    element.query = resp["answer"]
-                mapped_event = self._user_fn_output_to_event(event, element)
-                await self._do_downstream(mapped_event)
+            logger.debug(f"Running step '{self.name}'")
+            with step_span(
+                step=self.name,
+                workflow=getattr(self.context, "workflow_name", ""),
+                trace_context=getattr(element, "trace_context", None),
+                timings=getattr(element, "step_latencies", None),
+            ):
+                if run_in_thread or self._is_async:
+                    resp = await self.arun(element)
+                else:
+                    resp = self._run(element)
+        if resp:
+            self._apply_results(element, resp)
+        mapped_event = self._user_fn_output_to_event(event, element)
+        await self._do_downstream(mapped_event)
 
 
 class SessionLoader(storey.Flow):
@@ -107,10 +199,13 @@ class HistorySaver(ChainRunner):
         if self.save_sources and "sources" in event.results:
             sources = [src.metadata for src in event.results["sources"]]
             event.results["sources"] = sources
+        if self.is_stopped(event):
+            # The event was stopped, so the user was answered with the error message:
+            answer = event.results.get("error_message", "")
+        else:
+            answer = event.results[self.answer_key or "answer"]
         event.conversation.add_message("Human", question)
-        event.conversation.add_message(
-            "AI", event.results[self.answer_key or "answer"], sources
-        )
+        event.conversation.add_message("AI", answer, sources)
 
         self.context.session_store.save(event)
         return event.results
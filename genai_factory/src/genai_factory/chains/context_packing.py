@@ -0,0 +1,248 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+from typing import Any, Dict, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from genai_factory.utils import logger
+
+
+def get_token_counter(encoding: str = "cl100k_base"):
+    """
+    Get a function that counts and trims tokens of texts. Uses `tiktoken` when it is installed, and otherwise
+    estimates a token as 4 characters.
+
+    :param encoding: The tiktoken encoding name.
+
+    :return: A tuple of a count function (text -> number of tokens) and a trim function (text, max tokens -> text).
+    """
+    try:
+        import tiktoken
+
+        tokenizer = tiktoken.get_encoding(encoding)
+    except Exception as e:
+        logger.debug(f"Using approximate token counts ({e})")
+
+        def count(text: str) -> int:
+            return (len(text) + 3) // 4
+
+        def trim(text: str, max_tokens: int) -> str:
+            return text[: max_tokens * 4]
+
+        return count, trim
+
+    def count(text: str) -> int:
+        return len(tokenizer.encode(text, disallowed_special=()))
+
+    def trim(text: str, max_tokens: int) -> str:
+        tokens = tokenizer.encode(text, disallowed_special=())
+        return tokenizer.decode(tokens[:max_tokens])
+
+    return count, trim
+
+
+def _join_overlapping(first: str, second: str, max_overlap: int = 1024) -> str:
+    """
+    Join two consecutive chunks, dropping the text the second chunk repeats from the end of the first one (the
+    splitter's chunk overlap).
+    """
+    for size in range(min(len(first), len(second), max_overlap), 0, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+class _Span:
+    """
+    Consecutive chunks of a single document, merged into one text.
+    """
+
+    def __init__(self, document: Document):
+        self.first = self.last = document.metadata["chunk"]
+        self.text = document.page_content
+        self.metadata = dict(document.metadata)
+
+    def extend(self, document: Document) -> bool:
+        chunk = document.metadata["chunk"]
+        if chunk == self.last + 1:
+            self.text = _join_overlapping(self.text, document.page_content)
+            self.last = chunk
+        elif chunk == self.first - 1:
+            self.text = _join_overlapping(document.page_content, self.text)
+            self.first = chunk
+        else:
+            return False
+        return True
+
+    def merge(self, other: "_Span") -> bool:
+        """
+        Merge an adjacent span of the same document into this span.
+        """
+        if other.first == self.last + 1:
+            self.text = _join_overlapping(self.text, other.text)
+            self.last = other.last
+        elif other.last == self.first - 1:
+            self.text = _join_overlapping(other.text, self.text)
+            self.first = other.first
+        else:
+            return False
+        return True
+
+    def to_document(self) -> Document:
+        metadata = dict(self.metadata)
+        metadata["chunk"] = self.first
+        if self.last != self.first:
+            metadata["chunks"] = list(range(self.first, self.last + 1))
+        return Document(page_content=self.text, metadata=metadata)
+
+
+class ContextPacker:
+    """
+    Fit retrieved documents into a token budget before they are stuffed into the LLM prompt:
+
+    1. Duplicates are dropped (the same chunk of the same document, or identical text).
+    2. Adjacent chunks of the same document (`doc_uid` and consecutive `chunk` numbers) are merged into one document,
+       without the text the chunks overlap in.
+    3. Documents are added in rank order while they fit in `max_tokens`. The first document that does not fit is
+       trimmed to the remaining budget if at least `min_tokens` are left, and packing stops.
+
+    Example:
+        packer = ContextPacker(max_tokens=2000)
+        documents = packer.pack(retrieved_documents)
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 3000,
+        min_tokens: int = 64,
+        document_overhead_tokens: int = 8,
+        encoding: str = "cl100k_base",
+    ):
+        """
+        Initialize the context packer.
+
+        :param max_tokens:               The token budget of all the documents together.
+        :param min_tokens:               The minimal number of tokens worth adding as a trimmed document.
+        :param document_overhead_tokens: The tokens the document prompt adds to each document (content and source
+                                         labels).
+        :param encoding:                 The tiktoken encoding to count tokens with.
+        """
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.document_overhead_tokens = document_overhead_tokens
+        self._count, self._trim = get_token_counter(encoding)
+
+    def _merge(self, documents: List[Document]) -> List[Document]:
+        """
+        Drop duplicates and merge adjacent chunks, keeping the rank order (a merged document takes the rank of its
+        best chunk).
+        """
+        seen = set()
+        spans: Dict[Any, List[_Span]] = {}
+        entries = []  # Either spans or documents without chunk information, in rank order
+        for document in documents:
+            metadata = document.metadata
+            text_hash = hashlib.sha256(document.page_content.encode("utf-8")).digest()
+            key = (
+                (metadata["doc_uid"], metadata["chunk"])
+                if "doc_uid" in metadata and "chunk" in metadata
+                else text_hash
+            )
+            if key in seen or text_hash in seen:
+                continue
+            seen.update([key, text_hash])
+            if not isinstance(key, tuple):
+                entries.append(document)
+                continue
+            document_spans = spans.setdefault(metadata["doc_uid"], [])
+            extended = next(
+                (span for span in document_spans if span.extend(document)), None
+            )
+            if extended is None:
+                span = _Span(document)
+                document_spans.append(span)
+                entries.append(span)
+                continue
+            # The chunk may close the gap to another span (chunks ranked 1, 3, 2), which is merged into the better
+            # ranked of the two:
+            for other in document_spans:
+                if other is extended:
+                    continue
+                first, second = sorted(
+                    [extended, other], key=lambda entry: entries.index(entry)
+                )
+                if first.merge(second):
+                    document_spans.remove(second)
+                    entries.remove(second)
+                    break
+        return [
+            entry.to_document() if isinstance(entry, _Span) else entry
+            for entry in entries
+        ]
+
+    def pack(self, documents: List[Document]) -> List[Document]:
+        """
+        Pack the documents into the token budget.
+
+        :param documents: The retrieved documents, most relevant first.
+
+        :return: The packed documents.
+        """
+        packed = []
+        budget = self.max_tokens
+        merged = self._merge(documents)
+        for document in merged:
+            tokens = self._count(document.page_content) + self.document_overhead_tokens
+            if tokens <= budget:
+                packed.append(document)
+                budget -= tokens
+                continue
+            remaining = budget - self.document_overhead_tokens
+            if remaining >= self.min_tokens:
+                packed.append(
+                    Document(
+                        page_content=self._trim(document.page_content, remaining),
+                        metadata={**document.metadata, "trimmed": True},
+                    )
+                )
+                budget = 0
+            break
+        logger.debug(
+            f"Packed {len(documents)} documents into {len(packed)} ({self.max_tokens - budget} tokens)"
+        )
+        return packed
+
+
+class PackingRetriever(BaseRetriever):
+    """
+    A retriever that packs the documents of a base retriever into a token budget (see `ContextPacker`).
+    """
+
+    base_retriever: BaseRetriever
+    """The documents retriever."""
+
+    packer: Any
+    """The context packer."""
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        documents = self.base_retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        return self.packer.pack(documents)
@@ -14,8 +14,15 @@
 
 from langchain.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
+from genai_factory.batching import BatchedLLM
 from genai_factory.chains.base import ChainRunner
+from genai_factory.rate_limiting import (
+    RateLimitedLLM,
+    get_llm_limiter_name,
+    get_rate_limiter,
+)
 from genai_factory.schemas import WorkflowEvent
+from genai_factory.telemetry import telemetry_callback
 
 HALLUCINATION_GUARDRAIL_PROMPT = """
 You are a strict factual consistency checker.
@@ -39,8 +46,19 @@ Respond with ONLY one word:
 """
 
 class HallucinationGuardrail(ChainRunner):
-    def __init__(self, **kwargs):
+    def __init__(self, batching: dict = None, rate_limit: dict = None, **kwargs):
+        """
+        Initialize the hallucination guardrail.
+
+        :param batching:   Keyword arguments for a `BatchedLLM` to coalesce the checks of concurrent events into batch
+                           calls (requires `max_in_flight` larger than 1). Default is None (no batching).
+        :param rate_limit: Keyword arguments for the shared rate limiter of the checks (see `get_rate_limiter`), by
+                           default the model's limiter, shared with the other clients of the model (see
+                           `get_llm_limiter_name`). Default is None (no rate limiting).
+        """
         super().__init__(**kwargs)
+        self.batching = batching
+        self.rate_limit = rate_limit
         self._llm = None
         self._chain = None
 
@@ -50,7 +68,19 @@ class HallucinationGuardrail(ChainRunner):
             self._llm = ChatOpenAI(
                 model="gpt-4o-mini",
                 temperature=0,
+                **({"max_retries": 0} if self.rate_limit else {}),
             )
+            if self.rate_limit:
+                rate_limit = {
+                    "name": get_llm_limiter_name(self._llm),
+                    **self.rate_limit,
+                }
+                completion_tokens = rate_limit.pop("completion_tokens", 8)
+                self._llm = RateLimitedLLM(
+                    self._llm, get_rate_limiter(**rate_limit), completion_tokens
+                )
+            if self.batching:
+                self._llm = BatchedLLM(self._llm, **self.batching)
         return self._llm
 
     def post_init(
@@ -76,7 +106,8 @@ class HallucinationGuardrail(ChainRunner):
             {
                 "source": source,
                 "answer": answer,
-            }
+            },
+            config={"callbacks": [telemetry_callback]},
         ).content.strip()
 
         if verdict != "SUPPORTED":
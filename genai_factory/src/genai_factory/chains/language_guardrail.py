@@ -14,22 +14,40 @@
 
 from openai import OpenAI
 from genai_factory.chains.base import ChainRunner
+from genai_factory.rate_limiting import get_rate_limiter
 
 
 class LanguageGuardrail(ChainRunner):
-    def __init__(self, **kwargs):
+    def __init__(self, rate_limit: dict = None, **kwargs):
+        """
+        Initialize the language guardrail.
+
+        :param rate_limit: Keyword arguments for the shared rate limiter of the moderation calls (see
+                           `get_rate_limiter`), by default the "openai-moderation" limiter. Default is None (no rate
+                           limiting).
+        """
         super().__init__(**kwargs)
-        self.client = OpenAI()
+        self.rate_limiter = None
+        if rate_limit:
+            rate_limit = {"name": "openai-moderation", **rate_limit}
+            # Moderation calls are limited by requests, their tokens are not estimated:
+            rate_limit.pop("completion_tokens", None)
+            self.rate_limiter = get_rate_limiter(**rate_limit)
+        # Rate limited calls are retried by the limiter:
+        self.client = OpenAI(max_retries=0) if self.rate_limiter else OpenAI()
 
     def _run(self, event):
         answer = event.results.get("answer", "")
         if not answer:
             return {}
 
-        response = self.client.moderations.create(
-            model="omni-moderation-latest",
-            input=answer,
-        )
+        def moderate():
+            return self.client.moderations.create(
+                model="omni-moderation-latest",
+                input=answer,
+            )
+
+        response = self.rate_limiter.call(moderate) if self.rate_limiter else moderate()
 
         result = response.results[0]
 
@@ -0,0 +1,434 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import copy
+from typing import Dict, List, Union
+
+from mlrun.utils import get_class
+
+from genai_factory.chains.base import ChainRunner
+from genai_factory.config import get_object_from_dict
+from genai_factory.schemas import WorkflowEvent
+from genai_factory.telemetry import step_span
+from genai_factory.utils import logger
+
+
+class ParallelGuardrails(ChainRunner):
+    """
+    Run several independent guardrails concurrently on the same event.
+
+    The guardrails' latency becomes the latency of the slowest check instead of the sum of all checks. As soon as one
+    guardrail returns `stop`, the rest are cancelled (guardrails running in worker threads are left to finish, but
+    their results are discarded) and the stopping result is returned. Otherwise, the results of all guardrails are
+    merged in the order they were given.
+
+    Example:
+        guardrails = ParallelGuardrails(
+            guardrails=[LanguageGuardrail(), HallucinationGuardrail()],
+            name="guardrails",
+        )
+    """
+
+    def __init__(self, guardrails: List[Union[ChainRunner, dict]] = None, **kwargs):
+        """
+        Initialize the parallel guardrails step.
+
+        :param guardrails: The guardrails to run. Each guardrail is either a `ChainRunner` instance or a dictionary
+                           with a `class_name` key (full class path) and the guardrail's initialization arguments.
+        """
+        super().__init__(**kwargs)
+        if not guardrails:
+            raise ValueError("At least one guardrail must be given")
+        self.guardrails: List[ChainRunner] = [
+            get_object_from_dict(guardrail) for guardrail in guardrails
+        ]
+
+    def post_init(
+        self,
+        mode="sync",
+        context=None,
+        namespace=None,
+        creation_strategy=None,
+        **kwargs,
+    ):
+        """
+        Post initialization function, share the step's context with the guardrails and initialize them.
+        """
+        for guardrail in self.guardrails:
+            guardrail.context = self.context
+            guardrail.post_init(
+                mode=mode,
+                context=context,
+                namespace=namespace,
+                creation_strategy=creation_strategy,
+                **kwargs,
+            )
+
+    async def _run(self, event: WorkflowEvent) -> dict:
+        """
+        Run all guardrails concurrently and merge their results.
+
+        :param event: The event to validate.
+
+        :return: The stopping guardrail's result, or the merged results of all guardrails.
+        """
+        tasks = [
+            asyncio.ensure_future(guardrail.arun(event))
+            for guardrail in self.guardrails
+        ]
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    resp = task.result()
+                    if resp and resp.get("stop"):
+                        guardrail = self.guardrails[tasks.index(task)]
+                        logger.debug(
+                            f"Guardrail '{guardrail.name}' stopped the event: {resp.get('error_message')}"
+                        )
+                        return resp
+        finally:
+            for task in pending:
+                task.cancel()
+
+        results = {}
+        for task in tasks:
+            results.update(task.result() or {})
+        return results
+
+
+class SpeculativeSteps(ChainRunner):
+    """
+    Run downstream steps speculatively while a validator step is still running.
+
+    The validator (for example a guardrail or an intent check) and the speculative steps start together. The
+    speculative steps run one after the other on a copy of the event, so the validator always sees the event as it
+    was when this step started. If the validator returns `stop`, the speculative work is cancelled (a step already
+    running in a worker thread is left to finish, but its results are discarded) and the validator's result is
+    returned. Otherwise, the validator's results are merged with the speculative steps' results, so the common
+    pass-through case costs only the latency of the slowest branch.
+
+    Speculative steps must not have side effects that cannot be discarded, such as saving the session history.
+
+    Example:
+        speculative = SpeculativeSteps(
+            validator=LanguageGuardrail(),
+            steps=[RefineQuery(), MultiRetriever()],
+            name="speculative-retrieval",
+        )
+    """
+
+    def __init__(
+        self,
+        validator: Union[ChainRunner, dict] = None,
+        steps: List[Union[ChainRunner, dict]] = None,
+        **kwargs,
+    ):
+        """
+        Initialize the speculative steps.
+
+        :param validator: The validator step. Either a `ChainRunner` instance or a dictionary with a `class_name` key
+                          (full class path) and the step's initialization arguments.
+        :param steps:     The steps to run speculatively, in order. Each step is given like the validator.
+        """
+        super().__init__(**kwargs)
+        if validator is None or not steps:
+            raise ValueError(
+                "A validator and at least one speculative step must be given"
+            )
+        self.validator: ChainRunner = get_object_from_dict(validator)
+        self.steps: List[ChainRunner] = [get_object_from_dict(step) for step in steps]
+
+    def post_init(
+        self,
+        mode="sync",
+        context=None,
+        namespace=None,
+        creation_strategy=None,
+        **kwargs,
+    ):
+        """
+        Post initialization function, share the step's context with the inner steps and initialize them.
+        """
+        for step in [self.validator, *self.steps]:
+            step.context = self.context
+            step.post_init(
+                mode=mode,
+                context=context,
+                namespace=namespace,
+                creation_strategy=creation_strategy,
+                **kwargs,
+            )
+
+    async def _run_speculative(self, event: WorkflowEvent) -> dict:
+        """
+        Run the speculative steps in order on the given event copy.
+
+        :param event: A copy of the event to run the steps on.
+
+        :return: The results the speculative steps added or changed.
+        """
+        original_results = dict(event.results)
+        for step in self.steps:
+            resp = await step.arun(event)
+            if resp:
+                step._apply_results(event, resp)
+                if resp.get("stop"):
+                    break
+        return {
+            key: value
+            for key, value in event.results.items()
+            if key not in original_results or original_results[key] is not value
+        }
+
+    async def _run(self, event: WorkflowEvent) -> dict:
+        """
+        Run the validator and the speculative steps concurrently.
+
+        :param event: The event to process.
+
+        :return: The validator's result if it stopped the event, otherwise the merged results of both branches.
+        """
+        speculative_event = copy.copy(event)
+        speculative_event.results = dict(event.results)
+        speculative_event.state = dict(event.state)
+        speculative = asyncio.ensure_future(self._run_speculative(speculative_event))
+        try:
+            validation = await self.validator.arun(event) or {}
+        except BaseException:
+            speculative.cancel()
+            raise
+        if validation.get("stop"):
+            speculative.cancel()
+            logger.debug(
+                f"Validator '{self.validator.name}' stopped the event, discarding the speculative steps: "
+                f"{validation.get('error_message')}"
+            )
+            return validation
+        return {**validation, **await speculative}
+
+
+class DagSteps(ChainRunner):
+    """
+    Run steps as a dependency graph: every step starts as soon as the steps it comes after are done, so independent
+    steps (for example retrieval from two sources, or intent classification alongside query refinement) run
+    concurrently and the latency is the one of the slowest path through the graph instead of the sum of all steps.
+
+    Every step runs on a copy of the event that holds the results of the steps it comes after (in the order the steps
+    were given), so parallel branches do not see each other's results. The results of all steps are then joined into
+    the event: list values under `join_keys` (such as the `sources` of several retrievers) are concatenated and other
+    results are taken from the last step (in the given order) that set them. As soon as a step returns `stop`, the
+    rest are cancelled (steps running in worker threads are left to finish, but their results are discarded) and the
+    stopping result is returned.
+
+    `Workflow.build` creates this step from skeletons with `after` dependencies. It may also be added to a graph
+    directly:
+
+    Example:
+        retrieval = DagSteps(
+            steps=[RefineQuery(name="refine"), IntentClassifier(name="intent"), MultiRetriever(name="retrieve")],
+            dependencies={"retrieve": ["refine"]},
+            name="retrieval",
+        )
+    """
+
+    def __init__(
+        self,
+        steps: List[Union[ChainRunner, dict]] = None,
+        dependencies: Dict[str, List[str]] = None,
+        join_keys: List[str] = None,
+        **kwargs,
+    ):
+        """
+        Initialize the DAG steps.
+
+        :param steps:        The steps to run. Each step is either a `ChainRunner` instance or a dictionary with a
+                             `class_name` key and the step's initialization arguments. The class name is resolved like
+                             the graph's steps (a full class path, or a class in the graph's namespace) when the graph
+                             is initialized, and the step is named by its `name` or by its class. The steps must be
+                             given in an order in which every step comes after its dependencies.
+        :param dependencies: The names of the steps each step comes after, by step name. Steps that are not listed
+                             start right away.
+        :param join_keys:    The results whose lists are concatenated across the steps. Default is `["sources"]`.
+
+        :raises ValueError: If there are no steps, a step is not a `ChainRunner`, the step names are not unique or a
+                            dependency is not an earlier step.
+        """
+        super().__init__(**kwargs)
+        if not steps:
+            raise ValueError("At least one step must be given")
+        # Steps given as dictionaries are created in `post_init`, with the graph's namespace:
+        self.steps: List[Union[ChainRunner, dict]] = []
+        for step in steps:
+            if isinstance(step, dict):
+                step = {
+                    "name": step["class_name"].rsplit(".", 1)[-1],
+                    **step,
+                }
+            else:
+                self._validate_step(step.name, type(step))
+            self.steps.append(step)
+        self.dependencies = dependencies or {}
+        self.join_keys = ["sources"] if join_keys is None else join_keys
+        names = [self._step_name(step) for step in self.steps]
+        if len(set(names)) != len(names):
+            raise ValueError(f"The step names must be unique (got {names})")
+        for name, after in self.dependencies.items():
+            if name not in names:
+                raise ValueError(f"Unknown step '{name}' in the dependencies")
+            for dependency in after:
+                if dependency not in names[: names.index(name)]:
+                    raise ValueError(
+                        f"Step '{name}' must come after '{dependency}' in the steps list"
+                    )
+        # The transitive dependencies of every step, in the order of the steps:
+        self._ancestors: Dict[str, List[str]] = {}
+        for name in names:
+            ancestors = set(self.dependencies.get(name, []))
+            for dependency in self.dependencies.get(name, []):
+                ancestors.update(self._ancestors[dependency])
+            self._ancestors[name] = [other for other in names if other in ancestors]
+
+    @staticmethod
+    def _step_name(step: Union[ChainRunner, dict]) -> str:
+        return step["name"] if isinstance(step, dict) else step.name
+
+    @staticmethod
+    def _validate_step(name: str, step_class):
+        if not (isinstance(step_class, type) and issubclass(step_class, ChainRunner)):
+            raise ValueError(
+                f"The DAG step '{name}' must be a ChainRunner (got {getattr(step_class, '__name__', step_class)})"
+            )
+
+    def post_init(
+        self,
+        mode="sync",
+        context=None,
+        namespace=None,
+        creation_strategy=None,
+        **kwargs,
+    ):
+        """
+        Post initialization function, create the steps given as dictionaries, share the step's context with the inner
+        steps and initialize them.
+        """
+        for i, step in enumerate(self.steps):
+            if isinstance(step, dict):
+                step = dict(step)
+                step_class = get_class(step.pop("class_name"), namespace)
+                self._validate_step(step["name"], step_class)
+                self.steps[i] = step_class(**step)
+        for step in self.steps:
+            step.context = self.context
+            step.post_init(
+                mode=mode,
+                context=context,
+                namespace=namespace,
+                creation_strategy=creation_strategy,
+                **kwargs,
+            )
+
+    async def _run_step(
+        self,
+        step: ChainRunner,
+        event: WorkflowEvent,
+        tasks: Dict[str, asyncio.Future],
+        changes: Dict[str, dict],
+    ) -> dict:
+        """
+        Run a step once the steps it comes after are done, on a copy of the event with their results.
+
+        :return: The results the step added or changed.
+        """
+        dependencies = self.dependencies.get(step.name, [])
+        if dependencies:
+            # Raises the error of a failed dependency:
+            await asyncio.gather(*[tasks[name] for name in dependencies])
+            if any(changes[name].get("stop") for name in dependencies):
+                changes[step.name] = {}
+                return changes[step.name]
+        step_event = copy.copy(event)
+        step_event.results = dict(event.results)
+        step_event.state = dict(event.state)
+        for name in self._ancestors[step.name]:
+            step._apply_results(step_event, changes[name])
+        original_results = dict(step_event.results)
+        with step_span(
+            step=step.name,
+            workflow=getattr(self.context, "workflow_name", ""),
+            trace_context=getattr(event, "trace_context", None),
+            timings=getattr(event, "step_latencies", None),
+        ):
+            resp = await step.arun(step_event)
+        if resp:
+            step._apply_results(step_event, resp)
+        changes[step.name] = {
+            key: value
+            for key, value in step_event.results.items()
+            if key not in original_results or original_results[key] is not value
+        }
+        return changes[step.name]
+
+    def _join(self, changes: List[dict]) -> dict:
+        """
+        Join the steps' results, concatenating the lists under the join keys.
+        """
+        results = {}
+        for step_changes in changes:
+            for key, value in step_changes.items():
+                if (
+                    key in self.join_keys
+                    and isinstance(value, list)
+                    and isinstance(results.get(key), list)
+                ):
+                    results[key] = results[key] + value
+                else:
+                    results[key] = value
+        return results
+
+    async def _run(self, event: WorkflowEvent) -> dict:
+        """
+        Run the steps by their dependencies and join their results.
+
+        :param event: The event to process.
+
+        :return: The stopping step's result, or the joined results of all steps.
+        """
+        tasks: Dict[str, asyncio.Future] = {}
+        changes: Dict[str, dict] = {}
+        for step in self.steps:
+            tasks[step.name] = asyncio.ensure_future(
+                self._run_step(step, event, tasks, changes)
+            )
+        pending = set(tasks.values())
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    resp = task.result()
+                    if resp.get("stop"):
+                        logger.debug(
+                            f"A step of '{self.name}' stopped the event: {resp.get('error_message')}"
+                        )
+                        return resp
+        finally:
+            for task in pending:
+                task.cancel()
+        return self._join([changes[step.name] for step in self.steps])
@@ -17,6 +17,7 @@ from langchain_core.prompts.prompt import PromptTemplate
 from genai_factory.chains.base import ChainRunner
 from genai_factory.config import get_llm
 from genai_factory.schemas import WorkflowEvent
+from genai_factory.telemetry import telemetry_callback
 from genai_factory.utils import logger
 
 _refine_prompt_template = """
@@ -215,7 +216,8 @@ class RefineQuery(ChainRunner):
         chat_history = str(event.conversation)
         logger.debug(f"Question: {event.query}\nChat history: {chat_history}")
         resp = self._chain.invoke(
-            {"question": event.query, "chat_history": chat_history}
+            {"question": event.query, "chat_history": chat_history},
+            config={"callbacks": [telemetry_callback]},
         )
         logger.debug(f"Refined question: {resp}")
         return {"answer": resp}
@@ -0,0 +1,164 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from genai_factory.telemetry import record_cache_lookup
+from genai_factory.utils import logger
+
+DEFAULT_RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# Loaded cross-encoder models by (model name, device), shared by all the rerankers in the process:
+_models: Dict[Tuple[str, str], Any] = {}
+_models_lock = threading.Lock()
+
+
+def _document_id(document: Document) -> str:
+    # Keyed by the content, as a re-ingested document keeps its doc_uid and chunk numbers:
+    return hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
+
+
+class CrossEncoderReranker:
+    """
+    Score (query, document) pairs with a local cross-encoder model, caching the scores of recent pairs.
+
+    Example:
+        reranker = CrossEncoderReranker()
+        top_documents = reranker.rerank("How do I deploy a model?", documents, top_n=4)
+    """
+
+    def __init__(
+        self,
+        model: str = DEFAULT_RERANKER_MODEL,
+        device: str = "cpu",
+        batch_size: int = 32,
+        cache_size: int = 10000,
+    ):
+        """
+        Initialize the reranker.
+
+        :param model:      The cross-encoder model name or path.
+        :param device:     The device to run the model on.
+        :param batch_size: The number of pairs to score in each forward pass.
+        :param cache_size: The maximum number of (query, document) scores to cache, 0 to disable the cache.
+        """
+        self.model_name = model
+        self.device = device
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def model(self):
+        key = (self.model_name, self.device)
+        with _models_lock:
+            if key not in _models:
+                try:
+                    from sentence_transformers import CrossEncoder
+                except ImportError as e:
+                    raise ImportError(
+                        "Reranking requires the `sentence-transformers` package, "
+                        "install it with `pip install sentence-transformers`"
+                    ) from e
+                _models[key] = CrossEncoder(self.model_name, device=self.device)
+            return _models[key]
+
+    def score(self, query: str, documents: List[Document]) -> List[float]:
+        """
+        Score the documents' relevance to the query. Only pairs missing from the cache are passed to the model, in
+        batches.
+
+        :param query:     The query.
+        :param documents: The documents to score.
+
+        :return: The documents' scores, higher is more relevant.
+        """
+        query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        keys = [(query_hash, _document_id(document)) for document in documents]
+        scores = [None] * len(documents)
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        record_cache_lookup("rerank", hit=True, count=len(documents) - len(missing))
+        record_cache_lookup("rerank", hit=False, count=len(missing))
+        if missing:
+            predictions = self.model.predict(
+                [(query, documents[i].page_content) for i in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            )
+            with self._cache_lock:
+                for i, prediction in zip(missing, predictions):
+                    scores[i] = float(prediction)
+                    if self.cache_size:
+                        self._cache[keys[i]] = scores[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def rerank(
+        self, query: str, documents: List[Document], top_n: int
+    ) -> List[Document]:
+        """
+        Get the `top_n` documents most relevant to the query.
+
+        :param query:     The query.
+        :param documents: The candidate documents.
+        :param top_n:     The number of documents to return.
+
+        :return: The top documents, most relevant first.
+        """
+        if not documents:
+            return []
+        scores = self.score(query, documents)
+        ranked = sorted(zip(scores, range(len(documents))), reverse=True)[:top_n]
+        logger.debug(
+            f"Reranked {len(documents)} documents, top scores: {[round(score, 3) for score, _ in ranked]}"
+        )
+        return [documents[i] for _, i in ranked]
+
+
+class RerankingRetriever(BaseRetriever):
+    """
+    A retriever that reranks the candidates of a base retriever (configured to return `fetch_k` documents) with a
+    cross-encoder and returns the `top_n` most relevant, so fewer and better documents reach the LLM prompt.
+    """
+
+    base_retriever: BaseRetriever
+    """The candidates retriever."""
+
+    reranker: Any
+    """The reranker (see `CrossEncoderReranker`)."""
+
+    top_n: int = 4
+    """The number of documents to return."""
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = self.base_retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        return self.reranker.rerank(query, candidates, self.top_n)
@@ -12,16 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict, List, Optional
+import contextvars
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Union
 
 from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chains.qa_with_sources.base import QAWithSourcesChain
 from langchain.chains.qa_with_sources.retrieval import RetrievalQAWithSourcesChain
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
 
 from genai_factory.chains.base import ChainRunner
+from genai_factory.chains.context_packing import ContextPacker, PackingRetriever
+from genai_factory.chains.reranking import CrossEncoderReranker, RerankingRetriever
 from genai_factory.config import get_llm, get_vector_db
+from genai_factory.data.collection_registry import get_collection_registry
+from genai_factory.data.keyword_index import get_keyword_index
 from genai_factory.schemas import WorkflowEvent
+from genai_factory.telemetry import telemetry_callback
 from genai_factory.utils import logger
 
 
@@ -39,6 +53,65 @@ class DocumentCallbackHandler(BaseCallbackHandler):
             doc.metadata["index"] = str(i)
 
 
+class HybridRetriever(BaseRetriever):
+    """
+    A retriever that fuses vector search hits with keyword (BM25) search hits using weighted reciprocal rank fusion:
+    every document scores `weight / (rrf_k + rank)` in each result list it appears in, and the top `k` documents by
+    total score are returned.
+    """
+
+    vector_retriever: BaseRetriever
+    """The vector store retriever, expected to return `fetch_k` documents."""
+
+    keyword_index: Any
+    """The collection's keyword index (see `BM25Index`)."""
+
+    k: int = 4
+    """The number of documents to return."""
+
+    fetch_k: int = 20
+    """The number of keyword search hits to fuse."""
+
+    vector_weight: float = 1.0
+    """The weight of the vector search ranks."""
+
+    keyword_weight: float = 1.0
+    """The weight of the keyword search ranks."""
+
+    rrf_k: int = 60
+    """The rank constant of the fusion, higher values flatten the difference between top and lower ranks."""
+
+    @staticmethod
+    def _document_key(document: Document):
+        metadata = document.metadata
+        if "doc_uid" in metadata:
+            return metadata["doc_uid"], metadata.get("chunk")
+        return document.page_content
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vector_documents = self.vector_retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        keyword_documents = [
+            document for document, _ in self.keyword_index.search(query, self.fetch_k)
+        ]
+
+        scores = {}
+        documents = {}
+        for weight, ranked in [
+            (self.vector_weight, vector_documents),
+            (self.keyword_weight, keyword_documents),
+        ]:
+            for rank, document in enumerate(ranked, start=1):
+                key = self._document_key(document)
+                documents.setdefault(key, document)
+                scores[key] = scores.get(key, 0.0) + weight / (self.rrf_k + rank)
+        ranked_keys = sorted(scores, key=scores.get, reverse=True)[: self.k]
+        return [documents[key] for key in ranked_keys]
+
+
 class DocumentRetriever:
     """A wrapper for the retrieval QA chain that returns source documents.
 
@@ -62,6 +135,12 @@ class DocumentRetriever:
         vector_store,
         verbose: bool = False,
         chain_type: Optional[str] = None,
+        keyword_index=None,
+        hybrid_kwargs: Optional[dict] = None,
+        reranker=None,
+        rerank_fetch_k: int = 20,
+        rerank_top_n: int = 4,
+        context_packer=None,
         **search_kwargs,
     ):
         """
@@ -72,6 +151,15 @@ class DocumentRetriever:
         :param verbose:       Whether to print debug information.
         :param chain_type:    Type of document combining chain to use. Should be one of "stuff",
                               "map_reduce", "refine" and "map_rerank".
+        :param keyword_index: A keyword index of the collection. When given, retrieval is hybrid (see
+                              `HybridRetriever`).
+        :param hybrid_kwargs: Keyword arguments for the `HybridRetriever` (weights, `rrf_k` and `fetch_k`).
+        :param reranker:       A reranker (see `CrossEncoderReranker`). When given, `rerank_fetch_k` candidates are
+                               retrieved and only the `rerank_top_n` most relevant are passed to the LLM.
+        :param rerank_fetch_k: The number of candidates to retrieve for reranking.
+        :param rerank_top_n:   The number of documents to keep after reranking.
+        :param context_packer: A context packer (see `ContextPacker`) to fit the documents into a token budget
+                               before they are passed to the LLM.
         :param search_kwargs: Additional keyword arguments to pass to the vector store.
         """
         # Create a prompt template for the documents for when they are retrieved to the llm
@@ -80,14 +168,43 @@ class DocumentRetriever:
             input_variables=["page_content", "index"],
         )
 
+        if reranker is not None:
+            search_kwargs = {**search_kwargs, "k": rerank_fetch_k}
+        if keyword_index is not None:
+            hybrid_kwargs = {"k": search_kwargs.get("k", 4), **(hybrid_kwargs or {})}
+            fetch_k = hybrid_kwargs.setdefault("fetch_k", max(20, hybrid_kwargs["k"]))
+            retriever = HybridRetriever(
+                vector_retriever=vector_store.as_retriever(
+                    search_kwargs={**search_kwargs, "k": fetch_k}
+                ),
+                keyword_index=keyword_index,
+                **hybrid_kwargs,
+            )
+        else:
+            retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
+        if reranker is not None:
+            retriever = RerankingRetriever(
+                base_retriever=retriever, reranker=reranker, top_n=rerank_top_n
+            )
+        if context_packer is not None:
+            retriever = PackingRetriever(
+                base_retriever=retriever, packer=context_packer
+            )
+
         self.chain = RetrievalQAWithSourcesChain.from_chain_type(
             llm=llm,
-            retriever=vector_store.as_retriever(search_kwargs=search_kwargs),
+            retriever=retriever,
             chain_type=chain_type or "stuff",
             return_source_documents=True,
             chain_type_kwargs={"document_prompt": document_prompt},
             verbose=verbose,
         )
+        # Answers from documents that were already retrieved (see `get_answer_from_documents`):
+        self._documents_chain = QAWithSourcesChain(
+            combine_documents_chain=self.chain.combine_documents_chain,
+            return_source_documents=True,
+            verbose=verbose,
+        )
         self.cb = DocumentCallbackHandler()
         self.cb.verbose = verbose
         self.verbose = verbose
@@ -110,6 +227,36 @@ class DocumentRetriever:
         llm = get_llm(config)
         return cls(llm, vector_db, verbose=config.verbose, **search_kwargs)
 
+    def retrieve(self, query: str) -> List[Document]:
+        """
+        Retrieve the documents for a question, without answering it.
+
+        :param query: The question.
+
+        :return: The retrieved documents, most relevant first.
+        """
+        return self.chain.retriever.invoke(
+            query, config={"callbacks": [telemetry_callback]}
+        )
+
+    def get_answer_from_documents(
+        self, query: str, documents: List[Document]
+    ) -> tuple[str, List[Document]]:
+        """
+        Answer a question from already retrieved documents.
+
+        :param query:     The question to answer.
+        :param documents: The documents to answer from.
+
+        :return: A tuple containing the answer and the source documents.
+        """
+        for i, doc in enumerate(documents):
+            doc.metadata["index"] = str(i)
+        result = self._documents_chain(
+            {"question": query, "docs": documents}, callbacks=[telemetry_callback]
+        )
+        return self._parse_result(result)
+
     def _get_answer(self, query: str) -> tuple[str, List[Document]]:
         """
         Get the answer to a question and the source documents used.
@@ -119,8 +266,12 @@ class DocumentRetriever:
         :return: A tuple containing the answer and the source documents.
         """
         # Run the chain to get the answer and source documents
-        result = self.chain({"question": query}, callbacks=[self.cb])
+        result = self.chain(
+            {"question": query}, callbacks=[self.cb, telemetry_callback]
+        )
+        return self._parse_result(result)
 
+    def _parse_result(self, result: dict) -> tuple[str, List[Document]]:
         # Filter the source documents to only include the ones that were used as sources and clean up the metadata
         sources = [s.strip() for s in result["sources"].split(",")]
         source_docs = [
@@ -150,20 +301,75 @@ class DocumentRetriever:
         return {"answer": answer, "sources": sources}
 
 
+# The answer when none of the fanned out collections could be searched:
+FAN_OUT_UNAVAILABLE_ANSWER = (
+    "The knowledge base is not available right now, please try again later."
+)
+
+
 class MultiRetriever(ChainRunner):
     """A class that manages multiple document retrievers."""
 
-    def __init__(self, llm=None, default_collection: Optional[str] = None, **kwargs):
+    def __init__(
+        self,
+        llm=None,
+        default_collection: Optional[str] = None,
+        hybrid: Optional[Dict[str, dict]] = None,
+        rerank: Optional[dict] = None,
+        context_packing: Optional[dict] = None,
+        fan_out_collections: Optional[List[str]] = None,
+        fan_out_timeout: Union[float, Dict[str, float]] = 5.0,
+        fan_out_k: int = 4,
+        fan_out_max_in_flight: int = 4,
+        **kwargs,
+    ):
         """
         Initialize the multi retriever.
 
         :param llm:                The language model to use.
         :param default_collection: The default collection to use.
+        :param hybrid:             Collections to retrieve from with hybrid (keyword and vector) search, mapped to
+                                   their `HybridRetriever` settings, for example
+                                   `{"products": {"keyword_weight": 2.0}, "*": {}}`. The "*" entry applies to
+                                   all other collections. Requires `keyword_index_path` in the configuration.
+        :param rerank:             Cross-encoder reranking settings, applied to all collections: `fetch_k` (number of
+                                   candidates, default 20), `top_n` (number of documents to keep, default 4) and the
+                                   `CrossEncoderReranker` arguments (`model`, `device`, `batch_size`, `cache_size`).
+                                   Default is None (no reranking).
+        :param context_packing:    `ContextPacker` settings (`max_tokens`, `min_tokens`, `document_overhead_tokens`
+                                   and `encoding`) to fit the retrieved documents into a token budget. Default is
+                                   None (all retrieved documents are passed to the LLM).
+        :param fan_out_collections: Collections to search together for every query (an event's `collection_names`
+                                   takes priority). The collections are searched concurrently, their hits are fused
+                                   and deduplicated, and a single answer is generated from the fused hits. Default
+                                   is None (a single collection is searched).
+        :param fan_out_timeout:    The time in seconds to wait for each collection's hits, either one value or a
+                                   dictionary of collection name to timeout (with an optional "*" default). Slow
+                                   collections are dropped from the answer.
+        :param fan_out_k:          The number of fused hits to answer from.
+        :param fan_out_max_in_flight: The maximum number of concurrent searches of each collection. Every collection
+                                   is searched in its own threads, and a collection whose searches are all still
+                                   running (stalled past their timeout) is skipped until one of them returns, so a
+                                   stalled collection cannot hold up the others.
         """
         super().__init__(**kwargs)
         self.llm = llm
         self.default_collection = default_collection
-        self._retrievers: Dict[str, DocumentRetriever] = {}
+        self.hybrid = hybrid
+        self.rerank = rerank
+        self._reranker = None
+        self._rerank_fetch_k = 20
+        self._rerank_top_n = 4
+        self.context_packing = context_packing
+        self._context_packer = None
+        self.fan_out_collections = fan_out_collections
+        self.fan_out_timeout = fan_out_timeout
+        self.fan_out_k = fan_out_k
+        self.fan_out_max_in_flight = fan_out_max_in_flight
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._fan_out_lock = threading.Lock()
+        self._retrievers: Dict[tuple, DocumentRetriever] = {}
 
     def post_init(self,
         mode="sync",
@@ -179,6 +385,13 @@ class MultiRetriever(ChainRunner):
         self.llm = self.llm or get_llm(self.context._config)
         if not self.default_collection:
             self.default_collection = self.context._config.default_collection()
+        if self.rerank:
+            rerank = dict(self.rerank)
+            self._rerank_fetch_k = rerank.pop("fetch_k", 20)
+            self._rerank_top_n = rerank.pop("top_n", 4)
+            self._reranker = CrossEncoderReranker(**rerank)
+        if self.context_packing is not None:
+            self._context_packer = ContextPacker(**self.context_packing)
 
     def _get_retriever(
         self, collection_name: Optional[str] = None
@@ -192,16 +405,46 @@ class MultiRetriever(ChainRunner):
         """
         collection_name = collection_name or self.default_collection
         logger.debug(f"Selected collection: {collection_name}")
+        # Retrievers are kept per vector store collection, so a migrated collection is switched on the next query:
+        registry = get_collection_registry(self.context._config)
+        key = (
+            collection_name,
+            registry.resolve(collection_name)["collection"] if registry else None,
+        )
         # Create a new retriever if one does not exist for the given collection
-        if collection_name not in self._retrievers:
+        if key not in self._retrievers:
             # Get the vector database for the collection
             vector_db = get_vector_db(
                 self.context._config, collection_name=collection_name
             )
+            # Use hybrid retrieval if it is set for the collection and the collection has a keyword index:
+            hybrid = self.hybrid or {}
+            hybrid_kwargs = hybrid.get(collection_name, hybrid.get("*"))
+            keyword_index = None
+            if hybrid_kwargs is not None:
+                keyword_index = get_keyword_index(self.context._config, collection_name)
+                if keyword_index is None:
+                    logger.warning(
+                        f"Hybrid retrieval is set for collection '{collection_name}' but `keyword_index_path` is "
+                        f"not configured, using vector retrieval only"
+                    )
             # Create a new retriever and store it
-            retriever = DocumentRetriever(self.llm, vector_db, verbose=self.verbose)
-            self._retrievers[collection_name] = retriever
-        return self._retrievers[collection_name]
+            retriever = DocumentRetriever(
+                self.llm,
+                vector_db,
+                verbose=self.verbose,
+                keyword_index=keyword_index,
+                hybrid_kwargs=hybrid_kwargs,
+                reranker=self._reranker,
+                rerank_fetch_k=self._rerank_fetch_k,
+                rerank_top_n=self._rerank_top_n,
+                context_packer=self._context_packer,
+            )
+            # Drop the retriever of the collection before it was switched:
+            for old_key in [k for k in self._retrievers if k[0] == collection_name]:
+                del self._retrievers[old_key]
+            self._retrievers[key] = retriever
+        return self._retrievers[key]
 
     def _run(self, event: WorkflowEvent) -> Dict[str, any]:
         """
@@ -211,12 +454,119 @@ class MultiRetriever(ChainRunner):
 
         :return: A dictionary containing the answer and the source documents.
         """
-        collection_name = event.kwargs.get(
-            "collection_name"
+        collection_names = (
+            event.kwargs.get("collection_names") or self.fan_out_collections
+        )
+        if collection_names and len(collection_names) > 1:
+            return self._run_fan_out(event, collection_names)
+        collection_name = event.kwargs.get("collection_name") or (
+            collection_names[0] if collection_names else None
         )  # TODO name always in kwargs?
         retriever = self._get_retriever(collection_name)
         return retriever.run(event)
 
+    def _get_timeout(self, collection_name: str) -> float:
+        if isinstance(self.fan_out_timeout, dict):
+            return self.fan_out_timeout.get(
+                collection_name, self.fan_out_timeout.get("*", 5.0)
+            )
+        return self.fan_out_timeout
+
+    @staticmethod
+    def _fuse(hits: Dict[str, List[Document]], k: int, rrf_k: int = 60):
+        """
+        Fuse the hits of several collections by reciprocal rank (relevance scores of different collections and
+        backends are not comparable) and drop duplicates.
+        """
+        scores = {}
+        documents = {}
+        for collection_name, collection_hits in hits.items():
+            for rank, document in enumerate(collection_hits, start=1):
+                key = hashlib.sha256(document.page_content.encode("utf-8")).digest()
+                if key not in documents:
+                    document.metadata.setdefault("collection", collection_name)
+                    documents[key] = document
+                scores[key] = scores.get(key, 0.0) + 1 / (rrf_k + rank)
+        ranked_keys = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [documents[key] for key in ranked_keys]
+
+    def _submit_search(self, name: str, retriever: DocumentRetriever, query: str):
+        """
+        Search a collection in its own threads, unless all of them are taken by searches that are still running.
+
+        :return: The search's future, or None if the collection was skipped.
+        """
+        with self._fan_out_lock:
+            if self._in_flight.get(name, 0) >= self.fan_out_max_in_flight:
+                logger.warning(
+                    f"Collection '{name}' has {self._in_flight[name]} searches still running, skipping it"
+                )
+                return None
+            self._in_flight[name] = self._in_flight.get(name, 0) + 1
+            if name not in self._executors:
+                self._executors[name] = ThreadPoolExecutor(
+                    max_workers=self.fan_out_max_in_flight,
+                    thread_name_prefix=f"{self.name}-{name}",
+                )
+        future = self._executors[name].submit(
+            contextvars.copy_context().run, retriever.retrieve, query
+        )
+
+        def done(_):
+            with self._fan_out_lock:
+                self._in_flight[name] -= 1
+
+        future.add_done_callback(done)
+        return future
+
+    def _run_fan_out(
+        self, event: WorkflowEvent, collection_names: List[str]
+    ) -> Dict[str, any]:
+        """
+        Search several collections concurrently and answer from their fused hits.
+
+        :param event:            The event to run the retrievers with.
+        :param collection_names: The collections to search.
+
+        :return: A dictionary containing the answer and the source documents.
+        """
+        query = event.query.content if hasattr(event.query, "content") else event.query
+        retrievers = {name: self._get_retriever(name) for name in collection_names}
+        start = time.monotonic()
+        futures = {}
+        for name, retriever in retrievers.items():
+            future = self._submit_search(name, retriever, query)
+            if future is not None:
+                futures[name] = future
+
+        # Collect the hits, dropping collections that fail or do not answer in time:
+        hits = {}
+        for name, future in futures.items():
+            timeout = max(0.0, start + self._get_timeout(name) - time.monotonic())
+            try:
+                hits[name] = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                logger.warning(
+                    f"Collection '{name}' did not answer within {self._get_timeout(name)}s, dropping its hits"
+                )
+            except Exception as e:
+                logger.warning(f"Collection '{name}' failed, dropping its hits: {e}")
+
+        if not hits:
+            # Do not answer from no context when no collection could be searched:
+            logger.error(f"No collection of {collection_names} could be searched")
+            return {"answer": FAN_OUT_UNAVAILABLE_ANSWER, "sources": []}
+        documents = self._fuse(hits, self.fan_out_k)
+        if self._context_packer is not None:
+            documents = self._context_packer.pack(documents)
+        logger.debug(f"Fused {len(documents)} documents from collections {list(hits)}")
+        # Generate a single answer (any of the retrievers holds the same generation chain):
+        answer, sources = retrievers[collection_names[0]].get_answer_from_documents(
+            query, documents
+        )
+        return {"answer": answer, "sources": sources}
+
 
 def fix_milvus_filter_arg(vector_db, search_kwargs: Dict[str, any]):
     """
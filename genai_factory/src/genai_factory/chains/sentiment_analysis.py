@@ -10,9 +10,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from transformers import pipeline
+import os
+import shutil
+import tempfile
+from pathlib import Path
 
+from transformers import AutoTokenizer, pipeline
+
+from genai_factory.batching import MicroBatcher
 from genai_factory.chains.base import ChainRunner
+from genai_factory.utils import logger
 
 
 class SentimentAnalysisStep(ChainRunner):
@@ -23,34 +30,160 @@ class SentimentAnalysisStep(ChainRunner):
     # Default model to use as model and tokenizer if not given
     DEFAULT_MODEL = "cardiffnlp/twitter-roberta-base-sentiment"
 
+    # Supported inference backends
+    BACKENDS = ["pytorch", "onnx"]
+
+    # Supported dynamic quantization targets of the ONNX backend (`AutoQuantizationConfig` methods)
+    ONNX_QUANTIZATIONS = ["avx2", "avx512", "avx512_vnni", "arm64"]
+
+    # Default directory to cache exported (and quantized) ONNX models in
+    DEFAULT_ONNX_CACHE_DIR = os.path.join("~", ".cache", "genai_factory", "onnx")
+
     def __init__(
         self,
         tokenizer: str = None,
         model: str = None,
         pipeline_kwargs: dict = None,
+        max_batch_size: int = 16,
+        max_batch_latency_ms: float = 10.0,
+        backend: str = "pytorch",
+        onnx_quantization: str = "avx2",
+        onnx_cache_dir: str = None,
         **kwargs,
     ):
         """
         Initialize the sentiment analysis step.
 
-        :param model:           The name of the model to use, if not given, the default model will be used, has to be
-                                from the roberta model family.
-        :param tokenizer:       The name of the tokenizer to use, if not given, the default tokenizer will be used,
-                                has to be compatible with the model.
-        :param pipeline_kwargs: Additional keyword arguments to pass to the HuggingFace pipeline.
+        Concurrent events are micro-batched: queries are collected for up to `max_batch_latency_ms` milliseconds or
+        until `max_batch_size` queries arrived, and then classified together in a single forward pass.
+
+        :param model:                The name of the model to use, if not given, the default model will be used, has
+                                     to be from the roberta model family.
+        :param tokenizer:            The name of the tokenizer to use, if not given, the default tokenizer will be
+                                     used, has to be compatible with the model.
+        :param pipeline_kwargs:      Additional keyword arguments to pass to the HuggingFace pipeline.
+        :param max_batch_size:       The maximum number of queries to classify in a single forward pass. Also used as
+                                     the default `max_in_flight` of the step so a full batch can be collected.
+        :param max_batch_latency_ms: The maximum time in milliseconds a query waits for its batch to fill up.
+        :param backend:              The inference backend, one of:
+
+                                     * "pytorch" - The default transformers pipeline in full precision.
+                                     * "onnx" - The model is exported to ONNX (and quantized) once, cached on disk and
+                                       run with ONNX Runtime, which is considerably faster on CPU-only nodes. Requires
+                                       `optimum[onnxruntime]`.
+        :param onnx_quantization:    The dynamic int8 quantization target of the "onnx" backend, one of "avx2",
+                                     "avx512", "avx512_vnni" and "arm64". Pass None to run the exported model without
+                                     quantization.
+        :param onnx_cache_dir:       The directory to cache the exported ONNX models in. Default is
+                                     `~/.cache/genai_factory/onnx`.
         """
+        if backend not in self.BACKENDS:
+            raise ValueError(
+                f"Unsupported backend '{backend}', must be one of {self.BACKENDS}"
+            )
+        if (
+            onnx_quantization is not None
+            and onnx_quantization not in self.ONNX_QUANTIZATIONS
+        ):
+            raise ValueError(
+                f"Unsupported ONNX quantization '{onnx_quantization}', must be one of {self.ONNX_QUANTIZATIONS} or None"
+            )
+        kwargs.setdefault("max_in_flight", max_batch_size)
         super().__init__(**kwargs)
         self.tokenizer = tokenizer or self.DEFAULT_MODEL
         self.model = model or self.DEFAULT_MODEL
+        self.backend = backend
+        self.onnx_quantization = onnx_quantization
+        self.onnx_cache_dir = os.path.expanduser(
+            onnx_cache_dir or self.DEFAULT_ONNX_CACHE_DIR
+        )
         # Load the HuggingFace sentiment analysis pipeline
-        self.sentiment_classifier = pipeline(
-            "sentiment-analysis",
-            tokenizer=self.tokenizer,
-            model=self.model,
-            **pipeline_kwargs,
+        if self.backend == "onnx":
+            self.sentiment_classifier = pipeline(
+                "sentiment-analysis",
+                tokenizer=AutoTokenizer.from_pretrained(self.tokenizer),
+                model=self._load_onnx_model(),
+                **(pipeline_kwargs or {}),
+            )
+        else:
+            self.sentiment_classifier = pipeline(
+                "sentiment-analysis",
+                tokenizer=self.tokenizer,
+                model=self.model,
+                **(pipeline_kwargs or {}),
+            )
+        self._batcher = MicroBatcher(
+            batch_fn=self._classify,
+            max_batch_size=max_batch_size,
+            max_latency_ms=max_batch_latency_ms,
+            name=f"{self.name or 'sentiment'}-batcher",
+        )
+
+    def _load_onnx_model(self):
+        """
+        Load the ONNX Runtime model, exporting and quantizing it first if it is not cached on disk yet.
+
+        :return: The ONNX Runtime sequence classification model.
+        """
+        try:
+            from optimum.onnxruntime import (
+                ORTModelForSequenceClassification,
+                ORTQuantizer,
+            )
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        except ImportError as e:
+            raise ImportError(
+                "The 'onnx' backend requires optimum with ONNX Runtime, "
+                "install it with: pip install 'optimum[onnxruntime]'"
+            ) from e
+
+        variant = self.onnx_quantization or "fp32"
+        model_dir = Path(self.onnx_cache_dir) / self.model.replace("/", "--") / variant
+        file_name = "model_quantized.onnx" if self.onnx_quantization else "model.onnx"
+        if not (model_dir / file_name).exists():
+            logger.info(f"Exporting '{self.model}' to ONNX ({variant}) in {model_dir}")
+            model_dir.parent.mkdir(parents=True, exist_ok=True)
+            # Build in a temporary directory and move it into place, so an interrupted export is never cached:
+            build_dir = Path(tempfile.mkdtemp(dir=model_dir.parent))
+            try:
+                exported = ORTModelForSequenceClassification.from_pretrained(
+                    self.model, export=True
+                )
+                exported.save_pretrained(build_dir)
+                if self.onnx_quantization:
+                    quantization_config = getattr(
+                        AutoQuantizationConfig, self.onnx_quantization
+                    )(is_static=False, per_channel=False)
+                    ORTQuantizer.from_pretrained(exported).quantize(
+                        save_dir=build_dir, quantization_config=quantization_config
+                    )
+                shutil.rmtree(model_dir, ignore_errors=True)
+                os.replace(build_dir, model_dir)
+            finally:
+                shutil.rmtree(build_dir, ignore_errors=True)
+
+        return ORTModelForSequenceClassification.from_pretrained(
+            model_dir, file_name=file_name
         )
 
-    def _run(self, event):
+    @property
+    def batch_stats(self) -> dict:
+        """
+        The batch size histogram of the forward passes made so far (see `MicroBatcher.stats`).
+        """
+        return self._batcher.stats()
+
+    def _classify(self, queries: list) -> list:
+        """
+        Classify a batch of queries in a single forward pass.
+
+        :param queries: The queries to classify.
+
+        :return: A list of the sentiment results, one per query.
+        """
+        return self.sentiment_classifier(queries, batch_size=len(queries))
+
+    async def _run(self, event):
         """
         Run the sentiment analysis step.
 
@@ -59,10 +192,8 @@ class SentimentAnalysisStep(ChainRunner):
         :return: The processed event with the sentiment analysis result.
         """
         query = event.query
-        sentiment = self.sentiment_classifier(
-            query
-        )  # Is a list of dictionaries (in tested examples)
+        sentiment = await self._batcher.asubmit(query)
         return {
-            "answer": sentiment[0]["label"],
+            "answer": sentiment["label"],
             "sources": "",
         }  # TODO: Can only return string
@@ -11,10 +11,13 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import hashlib
 import importlib
+import json
 import os
 import pathlib
-from typing import Union
+import threading
+from typing import Optional, Union
 
 import yaml
 from pydantic import BaseModel
@@ -68,9 +71,43 @@ class WorkflowServerConfig(BaseModel):
     # TODO: KEEP DEFAULTS FOR CONVENIENCE
     chunk_size: int = 1024
     chunk_overlap: int = 20
+    chunking_engine: Optional[dict] = None
+    """
+    Keyword arguments for the parallel chunking engine (see `ChunkingEngine`), for example
+    `{"length_unit": "tokens", "processes": 8}`. The chunk size and overlap are taken from `chunk_size` and
+    `chunk_overlap`. None splits the documents in the ingesting thread with `RecursiveCharacterTextSplitter`.
+    """
+    ingestion_batch_size: int = 256
+    """
+    The maximal number of chunks held in memory during ingestion. Documents are loaded lazily and their chunks are
+    written to the vector store (and keyword index) in batches of this size, so memory does not grow with the corpus.
+    """
+    ingestion_workers: int = 2
+    """
+    The number of ingestion jobs the application runs concurrently (see `IngestionJobRunner`).
+    """
+    ingestion_progress_interval: float = 2.0
+    """
+    The minimal interval in seconds between ingestion job progress reports to the controller.
+    """
 
     # Embeddings
     embeddings: dict = {"class_name": "huggingface", "model_name": "all-MiniLM-L6-v2"}
+    embeddings_cache: Optional[dict] = {"max_size": 10000}
+    """
+    Keyword arguments for the embeddings cache (see `CachedEmbeddings`), for example
+    `{"max_size": 10000, "path": "/data/embeddings-cache.db"}`. The cached embeddings model is shared by all the
+    vector stores of the process. Only query embeddings are cached unless `"cache_documents": True` is given. None
+    disables the cache.
+    """
+    collection_embeddings: dict[str, dict] = {}
+    """
+    Embeddings arguments per collection (data source), overriding `embeddings`. Use it to post-process the embeddings
+    of a data source, for example `{"products": {"class_name": "huggingface", "model_name": "...", "truncate_dim":
+    256}}` (see `TruncatedEmbeddings`). The vectors' quantization is set with the data source's vector store arguments
+    (`dtype` of `LocalVectorStore`). Changing the embeddings of an ingested collection requires migrating it (see
+    `EmbeddingsMigration`).
+    """
 
     # Default LLM
     default_llm: dict = {
@@ -85,6 +122,25 @@ class WorkflowServerConfig(BaseModel):
         "connection_args": {"address": "localhost:19530"},
     }
 
+    # Keyword (BM25) index for hybrid retrieval
+    keyword_index_path: Optional[str] = None
+    """
+    Directory of the collections' keyword indexes. When set, ingested documents are indexed for keyword search as
+    well, to be used by hybrid retrieval (see `MultiRetriever`). Default: None (disabled).
+    """
+
+    keyword_index_kwargs: dict = {}
+    """
+    Keyword arguments for the keyword indexes (see `BM25Index`), for example `{"k1": 1.2, "b": 0.75}`.
+    """
+
+    collection_registry_path: Optional[str] = None
+    """
+    A JSON file that maps collections to the vector store collections and embeddings that hold them (see
+    `CollectionRegistry`). Required to migrate collections to new embeddings without downtime. Default: None (the
+    collections are used as is with `embeddings`).
+    """
+
     def default_collection(self):
         return self.default_vector_store.get("collection_name", "default")
 
@@ -117,47 +173,132 @@ class WorkflowServerConfig(BaseModel):
 embeddings_shortcuts = {
     "huggingface": "langchain_huggingface.embeddings.huggingface.HuggingFaceEmbeddings",
     "openai": "langchain_openai.embeddings.base.OpenAIEmbeddings",
+    "fake": "genai_factory.benchmarks.fakes.FakeEmbeddings",
 }
 
 vector_db_shortcuts = {
     "milvus": "langchain_community.vectorstores.Milvus",
     "chroma": "langchain_community.vectorstores.chroma.Chroma",
+    "local": "genai_factory.data.local_vector_store.LocalVectorStore",
+    "fake": "genai_factory.benchmarks.fakes.FakeVectorStore",
 }
 
 llm_shortcuts = {
     "chat": "langchain_openai.ChatOpenAI",
     "gpt": "langchain_community.chat_models.GPT",
+    "fake": "genai_factory.benchmarks.fakes.FakeChatModel",
 }
 
 
+# Cached embeddings models by their configuration, shared by all the vector stores of the process:
+_cached_embeddings = {}
+_cached_embeddings_lock = threading.Lock()
+
+
 def get_embedding_function(config: WorkflowServerConfig, embeddings_args: dict = None):
-    return get_object_from_dict(
-        embeddings_args or config.embeddings, embeddings_shortcuts
-    )
+    """
+    Get an embeddings model instance. Unless `embeddings_cache` is disabled in the config, the model is wrapped with a
+    `CachedEmbeddings` that is shared by all the callers with the same embeddings and cache configuration.
+
+    A `truncate_dim` key in the embeddings arguments keeps only the first dimensions of the (Matryoshka) embeddings,
+    see `TruncatedEmbeddings`. The full embeddings are cached, so collections truncated to different dimensions share
+    the cache.
+    """
+    embeddings_args = embeddings_args or config.embeddings
+    truncate_dim = None
+    if isinstance(embeddings_args, dict) and "truncate_dim" in embeddings_args:
+        embeddings_args = embeddings_args.copy()
+        truncate_dim = embeddings_args.pop("truncate_dim")
+    if not config.embeddings_cache or not isinstance(embeddings_args, dict):
+        embeddings = get_object_from_dict(embeddings_args, embeddings_shortcuts)
+    else:
+        from genai_factory.embeddings import CachedEmbeddings
+
+        key = json.dumps([embeddings_args, config.embeddings_cache], sort_keys=True)
+        with _cached_embeddings_lock:
+            if key not in _cached_embeddings:
+                # Models with the same name and different arguments (such as dimensions) are cached apart:
+                namespace = hashlib.sha256(
+                    json.dumps(embeddings_args, sort_keys=True).encode("utf-8")
+                ).hexdigest()[:16]
+                _cached_embeddings[key] = CachedEmbeddings(
+                    get_object_from_dict(embeddings_args, embeddings_shortcuts),
+                    namespace=namespace,
+                    **config.embeddings_cache,
+                )
+            embeddings = _cached_embeddings[key]
+    if truncate_dim:
+        from genai_factory.embeddings import TruncatedEmbeddings
+
+        embeddings = TruncatedEmbeddings(embeddings, truncate_dim)
+    return embeddings
 
 
 def get_llm(config: WorkflowServerConfig, llm_args: dict = None):
-    """Get a language model instance."""
-    return get_object_from_dict(llm_args or config.default_llm, llm_shortcuts)
+    """
+    Get a language model instance. A `rate_limit` key in the arguments wraps the model with a `RateLimitedLLM` (the
+    `get_rate_limiter` arguments, the limiter is named by the model's class and name by default), and a `batching` key
+    wraps it with a `BatchedLLM`.
+    """
+    llm_args = (llm_args or config.default_llm).copy()
+    batching = llm_args.pop("batching", None)
+    rate_limit = llm_args.pop("rate_limit", None)
+    if rate_limit:
+        llm_class = get_class_from_string(llm_args["class_name"], llm_shortcuts)
+        if "max_retries" in getattr(llm_class, "model_fields", {}):
+            # Rate limited calls are retried by the limiter, the model's own retries would only add load:
+            llm_args.setdefault("max_retries", 0)
+    llm = get_object_from_dict(llm_args, llm_shortcuts)
+    if rate_limit:
+        from genai_factory.rate_limiting import (
+            RateLimitedLLM,
+            get_llm_limiter_name,
+            get_rate_limiter,
+        )
+
+        rate_limit = {"name": get_llm_limiter_name(llm), **rate_limit}
+        completion_tokens = rate_limit.pop("completion_tokens", 256)
+        llm = RateLimitedLLM(llm, get_rate_limiter(**rate_limit), completion_tokens)
+    if batching:
+        from genai_factory.batching import BatchedLLM
+
+        llm = BatchedLLM(llm, **batching)
+    return llm
 
 
 def get_vector_db(
     config: WorkflowServerConfig,
     collection_name: str = None,
     vector_store_args: dict = None,
+    embeddings_args: dict = None,
+    resolve: bool = True,
 ):
     """Get a vector database instance.
 
+    When a collection registry is configured, the collection is resolved to the vector store collection that holds
+    it and is opened with the embeddings it was embedded with (see `CollectionRegistry`).
+
     Args:
         config: An AppConfig instance.
         collection_name: The name of the collection to use (if not default).
         vector_store_args: class_name and arguments to pass to the vector store class (None will use the config).
+        embeddings_args: The embeddings arguments to use (None will use the collection registry's, the collection's
+            `collection_embeddings` or the config's).
+        resolve: Whether to resolve the collection in the collection registry.
     """
-    embeddings = get_embedding_function(config=config)
     vector_store_args = vector_store_args or config.default_vector_store
     vector_store_args = vector_store_args.copy()
     if collection_name:
         vector_store_args["collection_name"] = collection_name
+    name = vector_store_args.get("collection_name", config.default_collection())
+    if resolve and config.collection_registry_path:
+        from genai_factory.data.collection_registry import get_collection_registry
+
+        resolved = get_collection_registry(config).resolve(name)
+        vector_store_args["collection_name"] = resolved["collection"]
+        embeddings_args = embeddings_args or resolved["embeddings"]
+    embeddings_args = embeddings_args or config.collection_embeddings.get(name)
+    embeddings = get_embedding_function(config=config, embeddings_args=embeddings_args)
     vector_store_args["embedding_function"] = embeddings
     return get_object_from_dict(vector_store_args, vector_db_shortcuts)
 
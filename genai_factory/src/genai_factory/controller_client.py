@@ -12,12 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Union
+from typing import List, Union
 
 import requests
 from mlrun.utils.helpers import dict_to_json
 
-from genai_factory.schemas import ChatSession, DataSource, Project, User, Workflow
+from genai_factory.schemas import (
+    ChatSession,
+    DataSource,
+    IngestionJob,
+    Project,
+    User,
+    Workflow,
+)
 from genai_factory.utils import logger
 
 
@@ -287,3 +294,50 @@ class ControllerClient:
         raw_response = response["data"]
         dict_response = dict(raw_response) if isinstance(raw_response, list) else raw_response
         return Workflow(**dict_response)
+
+    def get_ingestion_job(self, uid: str) -> IngestionJob:
+        """
+        Get an ingestion job from the database.
+
+        :param uid: The UID of the ingestion job to get.
+
+        :return: The ingestion job object.
+        """
+        response = self._send_request(
+            path=f"projects/{self._project_name}/jobs/{uid}", method="GET"
+        )
+        return IngestionJob(**response["data"])
+
+    def update_ingestion_job(self, job: IngestionJob) -> IngestionJob:
+        """
+        Update an ingestion job (its status and progress) in the database.
+
+        :param job: The ingestion job object to update.
+
+        :return: The updated ingestion job object, with the status set to cancelling if its cancellation was requested.
+        """
+        response = self._send_request(
+            path=f"projects/{self._project_name}/jobs/{job.uid}",
+            method="PUT",
+            data=job.to_dict(),
+        )
+        return IngestionJob(**response["data"])
+
+    def update_data_source_documents(
+        self, data_source_name: str, documents: List[dict]
+    ) -> List[dict]:
+        """
+        Update the extra data (for example, chunk statistics) of documents ingested into a data source, in bulk.
+
+        :param data_source_name: The name of the data source.
+        :param documents:        Dictionaries with the "document_id", "document_version" and "extra_data" (merged into
+                                 the existing extra data) of each document.
+
+        :return: The data source's documents associations.
+        """
+        response = self._send_request(
+            path=f"projects/{self._project_name}/data_sources/{data_source_name}/documents",
+            method="POST",
+            json=documents,
+        )
+        return response["data"]
@@ -0,0 +1,353 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from genai_factory.config import WorkflowServerConfig
+from genai_factory.utils import logger
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+# A chunk as (start, end) character offsets in its document's text:
+Span = Tuple[int, int]
+
+# Tokenizers by encoding name, loaded once per process (also in the pool's workers):
+_tokenizers = {}
+
+
+def _get_tokenizer(encoding: str):
+    if encoding not in _tokenizers:
+        try:
+            import tiktoken
+
+            _tokenizers[encoding] = tiktoken.get_encoding(encoding)
+        except Exception as e:
+            logger.debug(f"Using approximate token offsets ({e})")
+            _tokenizers[encoding] = None
+    return _tokenizers[encoding]
+
+
+def _token_offsets(text: str, encoding: str) -> List[int]:
+    """
+    Get the start character offset of every token of the text. Without `tiktoken`, a token is estimated as 4
+    characters.
+    """
+    tokenizer = _get_tokenizer(encoding)
+    if tokenizer is None:
+        return list(range(0, len(text), 4))
+    _, offsets = tokenizer.decode_with_offsets(
+        tokenizer.encode(text, disallowed_special=())
+    )
+    return offsets
+
+
+def split_spans(
+    text: str,
+    chunk_size: int,
+    chunk_overlap: int = 0,
+    separators: List[str] = None,
+    length_unit: str = "chars",
+    encoding: str = "cl100k_base",
+) -> List[Span]:
+    """
+    Split a text into chunks of up to `chunk_size` characters (or tokens), returning their offsets.
+
+    Every chunk is cut at the best separator in its second half: the first of `separators` that is found there, so
+    paragraphs are preferred over lines, sentences and words. When no separator is found in the second half the whole
+    window is searched, and only then the chunk is cut in the middle of a word. Consecutive chunks overlap by up to
+    `chunk_overlap` characters (or tokens), starting at a word boundary. Leading and trailing whitespace is not part of
+    the chunks.
+
+    :param text:          The text to split.
+    :param chunk_size:    The maximum size of a chunk.
+    :param chunk_overlap: The size of the overlap between consecutive chunks.
+    :param separators:    The separators to cut at, in order of preference.
+    :param length_unit:   The unit of the sizes: "chars" or "tokens".
+    :param encoding:      The tiktoken encoding to count tokens with (when `length_unit` is "tokens").
+
+    :return: The (start, end) offsets of the chunks.
+    """
+    separators = DEFAULT_SEPARATORS if separators is None else separators
+    if length_unit == "tokens":
+        offsets = _token_offsets(text, encoding)
+
+        def window_end(start: int) -> int:
+            index = bisect.bisect_left(offsets, start) + chunk_size
+            return offsets[index] if index < len(offsets) else len(text)
+
+        def overlap_start(end: int) -> int:
+            index = bisect.bisect_left(offsets, end) - chunk_overlap
+            return offsets[max(index, 0)]
+
+    elif length_unit == "chars":
+
+        def window_end(start: int) -> int:
+            return start + chunk_size
+
+        def overlap_start(end: int) -> int:
+            return end - chunk_overlap
+
+    else:
+        raise ValueError(f"Unsupported length unit '{length_unit}'")
+
+    spans = []
+    length = len(text)
+    position = 0
+    while position < length:
+        # Skip leading whitespace:
+        while position < length and text[position].isspace():
+            position += 1
+        if position == length:
+            break
+        limit = window_end(position)
+        if limit >= length:
+            end = length
+        else:
+            end = _find_cut(text, position, limit, separators)
+        # Drop trailing whitespace:
+        chunk_end = end
+        while chunk_end > position and text[chunk_end - 1].isspace():
+            chunk_end -= 1
+        spans.append((position, chunk_end))
+        if end >= length:
+            break
+        next_position = end
+        if chunk_overlap:
+            overlap = max(overlap_start(end), position + 1)
+            if overlap < end:
+                # Start the overlap at a word boundary:
+                boundary = text.find(" ", overlap, end)
+                next_position = boundary + 1 if boundary != -1 else end
+        position = max(next_position, position + 1)
+    return spans
+
+
+def _find_cut(text: str, start: int, limit: int, separators: List[str]) -> int:
+    """
+    Find the end offset of a chunk starting at `start` that ends no later than `limit`.
+    """
+    middle = start + (limit - start) // 2
+    for low in (middle, start + 1):
+        for separator in separators:
+            index = text.rfind(separator, low, limit)
+            if index != -1:
+                return index + len(separator)
+    return limit
+
+
+def _split_many(
+    texts: List[str],
+    chunk_size: int,
+    chunk_overlap: int,
+    separators: Optional[List[str]],
+    length_unit: str,
+    encoding: str,
+) -> List[List[Span]]:
+    # Module level so it can run in the process pool's workers:
+    return [
+        split_spans(
+            text,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=separators,
+            length_unit=length_unit,
+            encoding=encoding,
+        )
+        for text in texts
+    ]
+
+
+class ChunkingEngine:
+    """
+    Split documents into chunks in a pool of processes. Only the chunks' offsets come back from the workers, and the
+    chunk texts are sliced from the documents when they are needed.
+
+    Small inputs are split in the calling process, as sending them to the pool costs more than splitting them.
+
+    Example:
+        engine = ChunkingEngine(chunk_size=256, chunk_overlap=32, length_unit="tokens", processes=8)
+        for document, spans in engine.iter_spans(loader.lazy_load()):
+            chunks = [document.page_content[start:end] for start, end in spans]
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 1024,
+        chunk_overlap: int = 20,
+        length_unit: str = "chars",
+        encoding: str = "cl100k_base",
+        separators: List[str] = None,
+        processes: int = None,
+        window_size: int = 64,
+        min_parallel_chars: int = 200_000,
+    ):
+        """
+        Initialize the chunking engine.
+
+        :param chunk_size:         The maximum size of a chunk.
+        :param chunk_overlap:      The size of the overlap between consecutive chunks.
+        :param length_unit:        The unit of the sizes: "chars" or "tokens".
+        :param encoding:           The tiktoken encoding to count tokens with.
+        :param separators:         The separators to cut at, in order of preference.
+        :param processes:          The number of worker processes. Default is the number of CPUs, 0 or 1 to split in
+                                   the calling process.
+        :param window_size:        The number of documents read ahead from the documents iterator and split together.
+        :param min_parallel_chars: The minimal number of characters in a window to split it in the pool.
+        """
+        if length_unit not in ["chars", "tokens"]:
+            raise ValueError(f"Unsupported length unit '{length_unit}'")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length_unit = length_unit
+        self.encoding = encoding
+        self.separators = separators
+        self.processes = processes
+        self.window_size = window_size
+        self.min_parallel_chars = min_parallel_chars
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.processes is not None and self.processes <= 1:
+            return None
+        with self._executor_lock:
+            if self._executor is None:
+                # Not forked, as the server's threads (and the locks they hold) would be copied into the workers:
+                start_method = (
+                    "forkserver"
+                    if "forkserver" in multiprocessing.get_all_start_methods()
+                    else "spawn"
+                )
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context(start_method),
+                )
+        return self._executor
+
+    def split_spans(self, text: str) -> List[Span]:
+        """
+        Split a single text in the calling process.
+
+        :param text: The text to split.
+
+        :return: The (start, end) offsets of the chunks.
+        """
+        return _split_many([text], **self._split_kwargs())[0]
+
+    def split_texts(self, texts: List[str]) -> List[List[Span]]:
+        """
+        Split texts, in the pool when they are large enough.
+
+        :param texts: The texts to split.
+
+        :return: The chunks' offsets of every text.
+        """
+        executor = self._get_executor()
+        if (
+            executor is None
+            or sum(len(text) for text in texts) < self.min_parallel_chars
+        ):
+            return _split_many(texts, **self._split_kwargs())
+        # A few tasks per worker balance documents of different sizes:
+        tasks = max(executor._max_workers * 4, 1)
+        size = max(len(texts) // tasks, 1)
+        groups = [texts[i : i + size] for i in range(0, len(texts), size)]
+        futures = [
+            executor.submit(_split_many, group, **self._split_kwargs())
+            for group in groups
+        ]
+        return [spans for future in futures for spans in future.result()]
+
+    def iter_spans(
+        self, documents: Iterable[Document]
+    ) -> Iterator[Tuple[Document, List[Span]]]:
+        """
+        Split a stream of documents, reading `window_size` documents ahead.
+
+        :param documents: The documents to split (can be a lazy iterator).
+
+        :return: An iterator of (document, chunks' offsets) tuples, in the documents' order.
+        """
+        documents = iter(documents)
+        while window := list(islice(documents, self.window_size)):
+            spans = self.split_texts([document.page_content for document in window])
+            yield from zip(window, spans)
+
+    def split_documents(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """
+        Split documents into chunk documents, keeping each chunk's start offset in its `start_index` metadata.
+
+        :param documents: The documents to split.
+
+        :return: An iterator of the chunks.
+        """
+        for document, spans in self.iter_spans(documents):
+            for start, end in spans:
+                yield Document(
+                    page_content=document.page_content[start:end],
+                    metadata={**document.metadata, "start_index": start},
+                )
+
+    def close(self):
+        """
+        Shut down the worker processes.
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _split_kwargs(self) -> dict:
+        return {
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "separators": self.separators,
+            "length_unit": self.length_unit,
+            "encoding": self.encoding,
+        }
+
+
+# Chunking engines by configuration, shared so their worker processes are started once per process:
+_chunking_engines = {}
+_chunking_engines_lock = threading.Lock()
+
+
+def get_chunking_engine(config: WorkflowServerConfig) -> Optional[ChunkingEngine]:
+    """
+    Get the shared chunking engine of the configuration.
+
+    :param config: The workflows server configuration (`chunking_engine`, `chunk_size` and `chunk_overlap`).
+
+    :return: The chunking engine, or None if it is not configured.
+    """
+    if config.chunking_engine is None:
+        return None
+    engine_kwargs = {
+        "chunk_size": config.chunk_size,
+        "chunk_overlap": config.chunk_overlap,
+        **config.chunking_engine,
+    }
+    key = json.dumps(engine_kwargs, sort_keys=True)
+    with _chunking_engines_lock:
+        if key not in _chunking_engines:
+            _chunking_engines[key] = ChunkingEngine(**engine_kwargs)
+        return _chunking_engines[key]
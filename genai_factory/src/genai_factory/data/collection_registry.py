@@ -0,0 +1,165 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import copy
+import datetime
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from genai_factory.utils import file_lock, logger
+
+
+class CollectionRegistry:
+    """
+    Maps collection names (as used by the workflows and data sources) to the vector store collections that hold them
+    and the embeddings they were embedded with, so a collection can be re-embedded into a new collection and switched
+    to atomically (see `EmbeddingsMigration`).
+
+    The registry is a JSON file that is replaced atomically on every change, under a lock file so changes from other
+    processes are not lost. Readers (also in other processes) check its modification time on every lookup and pick up
+    a switch on their next query::
+
+        {
+            "collections": {"products": {"collection": "products__3f2a1b0c", "embeddings": {...}}},
+            "migrations": {"products": {"target": "products__3f2a1b0c", "embeddings": {...}, "state": "running"}}
+        }
+
+    Collections that are not in the registry are used as is, with the configured embeddings.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the registry.
+
+        :param path: The registry's JSON file, created on the first change.
+        """
+        self.path = Path(path)
+        self._data = {"collections": {}, "migrations": {}}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _refresh(self, force: bool = False):
+        if not self.path.exists():
+            return
+        mtime = self.path.stat().st_mtime_ns
+        if force or mtime != self._mtime:
+            with open(self.path, "r") as f:
+                self._data = json.load(f)
+            self._mtime = mtime
+
+    @contextlib.contextmanager
+    def _changing(self):
+        """
+        Lock the registry for a change (also against other processes) and read its latest state.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, file_lock(f"{self.path}.lock"):
+            self._refresh(force=True)
+            yield
+
+    def _write(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._data, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._mtime = self.path.stat().st_mtime_ns
+
+    def resolve(self, name: str) -> Dict[str, Optional[dict]]:
+        """
+        Get the vector store collection and embeddings of a collection.
+
+        :param name: The collection name.
+
+        :return: A dictionary with the "collection" name and "embeddings" arguments (None for the configured
+                 embeddings).
+        """
+        with self._lock:
+            self._refresh()
+            entry = self._data["collections"].get(name, {})
+        return {
+            "collection": entry.get("collection", name),
+            "embeddings": copy.deepcopy(entry.get("embeddings")),
+        }
+
+    def get_migration(self, name: str) -> Optional[dict]:
+        """
+        Get the state of the latest migration of a collection.
+
+        :param name: The collection name.
+
+        :return: The migration state or None if the collection was never migrated.
+        """
+        with self._lock:
+            self._refresh()
+            return copy.deepcopy(self._data["migrations"].get(name))
+
+    def update_migration(self, name: str, **state):
+        """
+        Update the state of a collection's migration.
+
+        :param name:  The collection name.
+        :param state: The state fields to update.
+        """
+        with self._changing():
+            self._data["migrations"].setdefault(name, {}).update(state)
+            self._write()
+
+    def switch(self, name: str, collection: str, embeddings: dict):
+        """
+        Switch a collection to a new vector store collection and embeddings, atomically.
+
+        :param name:       The collection name.
+        :param collection: The vector store collection to switch to.
+        :param embeddings: The embeddings arguments of the new collection.
+        """
+        with self._changing():
+            previous = self._data["collections"].get(name, {}).get("collection", name)
+            self._data["collections"][name] = {
+                "collection": collection,
+                "embeddings": embeddings,
+                "previous_collection": previous,
+                "switched": datetime.datetime.utcnow().isoformat(),
+            }
+            migration = self._data["migrations"].get(name)
+            if migration and migration.get("target") == collection:
+                migration["state"] = "completed"
+            self._write()
+        logger.info(f"Collection '{name}' switched to '{collection}'")
+
+
+# Registries by path, shared by all the users in the process:
+_registries: Dict[str, CollectionRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_collection_registry(config) -> Optional[CollectionRegistry]:
+    """
+    Get the collection registry, if one is configured (`collection_registry_path`).
+
+    :param config: The workflows server configuration.
+
+    :return: The shared collection registry or None.
+    """
+    if not config.collection_registry_path:
+        return None
+    with _registries_lock:
+        if config.collection_registry_path not in _registries:
+            _registries[config.collection_registry_path] = CollectionRegistry(
+                config.collection_registry_path
+            )
+        return _registries[config.collection_registry_path]
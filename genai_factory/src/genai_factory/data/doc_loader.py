@@ -12,8 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import time
 import uuid
+from itertools import count, islice
 from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Tuple
 
 from langchain_community.document_loaders import (
     CSVLoader,
@@ -25,9 +29,14 @@ from langchain_community.document_loaders import (
     UnstructuredWordDocumentLoader,
     WebBaseLoader,
 )
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from genai_factory.chains.context_packing import get_token_counter
 from genai_factory.config import WorkflowServerConfig, get_vector_db
+from genai_factory.data.chunking import get_chunking_engine
+from genai_factory.data.collection_registry import get_collection_registry
+from genai_factory.data.keyword_index import get_keyword_index
 from genai_factory.data.web_loader import SmartWebLoader
 from genai_factory.utils import logger
 
@@ -69,24 +78,97 @@ class DataLoader:
         data_loader.load(loader, metadata={"xx": "web"})
     """
 
-    def __init__(self, config: WorkflowServerConfig, vector_store=None):
-        self.vector_store = vector_store
+    def __init__(
+        self,
+        config: WorkflowServerConfig,
+        vector_store=None,
+        collection_name: str = None,
+        vector_store_args: dict = None,
+    ):
+        self.collection_name = collection_name or config.default_collection()
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=config.chunk_size, chunk_overlap=config.chunk_overlap
         )
+        # Splits the documents in worker processes when configured:
+        self.chunking_engine = get_chunking_engine(config)
+        self.batch_size = config.ingestion_batch_size
+        self._count_tokens, _ = get_token_counter()
+        # The collection's keyword index, when keyword indexing is enabled:
+        self.keyword_index = get_keyword_index(config, self.collection_name)
+        # While the collection is migrated to new embeddings, chunks are written to its new collection as well:
+        self._config = config
+        self._vector_store_args = vector_store_args
+        self._registry = get_collection_registry(config)
+        self._shadow = None
+        # A given vector store is used as is, otherwise the collection is resolved in the registry for every batch:
+        self.vector_store = vector_store
+        self._collection = None
+        self._resolve = vector_store is None
+        if self._resolve:
+            self._resolve_vector_store()
 
-    def load(self, loader, metadata: dict = None, version: int = None):
+    def load(
+        self,
+        loader,
+        metadata: dict = None,
+        version: int = None,
+        on_batch: Callable[[int], None] = None,
+        doc_uid: str = None,
+    ) -> dict:
         """Loads documents into the vector store.
 
+        Documents are loaded lazily (the loader's `lazy_load`) and their chunks are written in batches of
+        `ingestion_batch_size`, so only one batch of chunks is held in memory at a time.
+
         Args:
             loader: A document loader.
             metadata: A dictionary of metadata to attach to the documents.
             version: A version number for the documents.
+            on_batch: A callback called with the number of chunks after each batch is written.
+            doc_uid: The controller's document uid to mark the chunks with, so they can be garbage collected once the
+                document is deleted (a uid is generated per loaded document if None).
+
+        Returns:
+            The ingestion statistics: the number of chunks and their tokens, the time spent embedding and writing
+            them, and the SHA-256 hash of the loaded content.
         """
-        docs = loader.load()
+        if getattr(loader, "cache_scope", "") is None:
+            # Pages are skipped as unchanged (and their chunks replaced once changed) within the data source:
+            loader.cache_scope = self.collection_name
+        docs = loader.lazy_load() if hasattr(loader, "lazy_load") else loader.load()
         to_chunk = not hasattr(loader, "chunked")
-        for doc in docs:
-            self.ingest_document(doc, metadata, version, to_chunk=to_chunk)
+        stats = {"chunks": 0, "tokens": 0, "embedding_time_s": 0.0}
+        content_hash = hashlib.sha256()
+
+        def hashed(docs):
+            for doc in docs:
+                content_hash.update(doc.page_content.encode("utf-8"))
+                yield doc
+
+        # The chunks are numbered across all the loaded documents (for example, the pages of a PDF file):
+        chunk_numbers = count()
+        chunks = (
+            chunk
+            for doc, texts in self._split_documents(hashed(docs), to_chunk=to_chunk)
+            for chunk in self._iter_chunks(
+                doc,
+                texts,
+                metadata,
+                version,
+                doc_uid,
+                chunk_numbers,
+                keep_id=not to_chunk,
+            )
+        )
+        stats["embedding_time_s"] = self._write_batches(
+            self._counted(chunks, stats), on_batch=on_batch
+        )
+        # The previous chunks of pages that an incremental refresh loaded again are deleted once the new ones are in:
+        replaced_ids = getattr(loader, "replaced_ids", None)
+        if replaced_ids:
+            self._delete_chunks(replaced_ids)
+        stats["content_hash"] = content_hash.hexdigest()
+        return stats
 
     def ingest_document(
         self,
@@ -104,15 +186,57 @@ class DataLoader:
             version: A version number for the document.
             doc_uid: A unique identifier for the document (will be generated if None).
         """
+        for doc, texts in self._split_documents([doc], to_chunk=to_chunk):
+            self._write_batches(
+                self._iter_chunks(
+                    doc, texts, metadata, version, doc_uid, keep_id=not to_chunk
+                )
+            )
+
+    def _split_documents(
+        self, docs: Iterable[Document], to_chunk: bool = True
+    ) -> Iterator[Tuple[Document, Iterable[str]]]:
+        """Yield the documents with their chunk texts.
+
+        With a chunking engine, the documents are split in its worker processes and the chunk texts are sliced from
+        the document by their offsets only when they are consumed.
+        """
+        if not to_chunk:
+            for doc in docs:
+                yield doc, [doc.page_content]
+        elif self.chunking_engine is not None:
+            for doc, spans in self.chunking_engine.iter_spans(docs):
+                yield doc, (doc.page_content[start:end] for start, end in spans)
+        else:
+            for doc in docs:
+                yield doc, self.text_splitter.split_text(doc.page_content)
+
+    def _iter_chunks(
+        self,
+        doc,
+        texts: Iterable[str],
+        metadata: dict = None,
+        version: int = None,
+        doc_uid: str = None,
+        chunk_numbers: Iterator[int] = None,
+        keep_id: bool = False,
+    ):
+        """Yield the chunks of a document with their metadata.
+
+        The chunks are numbered by `chunk_numbers`, so the chunks of documents loaded under the same `doc_uid` do not
+        share numbers (from 0 if None). With `keep_id`, the document is already a chunk and keeps its id.
+        """
         if not doc_uid:
             doc_uid = uuid.uuid4().hex
-        if to_chunk:
-            chunks = self.text_splitter.split_documents([doc])
-        else:
-            chunks = [doc]
-        for i, chunk in enumerate(chunks):
-            if to_chunk:
-                chunk.metadata["chunk"] = i
+        if chunk_numbers is None:
+            chunk_numbers = count()
+        for text in texts:
+            chunk = Document(
+                id=doc.id if keep_id else None,
+                page_content=text,
+                metadata=dict(doc.metadata),
+            )
+            chunk.metadata["chunk"] = next(chunk_numbers)
             if metadata:
                 for key, value in metadata.items():
                     chunk.metadata[key] = value
@@ -122,7 +246,100 @@ class DataLoader:
             logger.debug(
                 f"Loading doc chunk:\n{chunk.page_content}\nMetadata: {chunk.metadata}"
             )
-        self.vector_store.add_documents(chunks)
+            yield chunk
+
+    def _counted(self, chunks: Iterable[Document], stats: dict):
+        """Count the chunks and their tokens into the statistics as they are consumed."""
+        for chunk in chunks:
+            stats["chunks"] += 1
+            stats["tokens"] += self._count_tokens(chunk.page_content)
+            yield chunk
+
+    def _write_batches(self, chunks, on_batch: Callable[[int], None] = None) -> float:
+        """Write the chunks to the vector store (and keyword index) in batches of `batch_size`.
+
+        Returns:
+            The time in seconds spent adding the chunks to the vector store (embedding and writing them).
+        """
+        chunks = iter(chunks)
+        write_time = 0.0
+        while batch := list(islice(chunks, self.batch_size)):
+            start = time.perf_counter()
+            # The migration is read before the collection, as the registry switches the collection and completes the
+            # migration together. A batch read during the switch is written to both collections:
+            shadow_vector_store = self._get_shadow_vector_store()
+            vector_store = self._resolve_vector_store()
+            if shadow_vector_store is None or self._shadow[0] == self._collection:
+                vector_store.add_documents(batch)
+            else:
+                # The same ids in both collections, so the migration does not copy the chunks again:
+                ids = [chunk.id or uuid.uuid4().hex for chunk in batch]
+                vector_store.add_documents(batch, ids=ids)
+                shadow_vector_store.add_documents(batch, ids=ids)
+            write_time += time.perf_counter() - start
+            if self.keyword_index is not None:
+                self.keyword_index.add_documents(batch)
+            if on_batch:
+                on_batch(len(batch))
+        return write_time
+
+    def _delete_chunks(self, ids: List[str]):
+        """Delete chunks by their ids from the vector store (and the new collection during a migration, where the
+        chunks have the same ids) and the keyword index."""
+        self._resolve_vector_store().delete(ids=ids)
+        shadow_vector_store = self._get_shadow_vector_store()
+        if shadow_vector_store is not None and self._shadow[0] != self._collection:
+            shadow_vector_store.delete(ids=ids)
+        if self.keyword_index is not None:
+            ids = set(ids)
+            self.keyword_index.delete_where(lambda document: document.id in ids)
+        logger.debug(f"Deleted {len(ids)} replaced chunks")
+
+    def _resolve_vector_store(self):
+        """Get the collection's vector store, reopening it when the collection was switched to a new vector store
+        collection in the collection registry (see `EmbeddingsMigration`)."""
+        if not self._resolve:
+            return self.vector_store
+        if self._registry is None:
+            if self.vector_store is None:
+                self.vector_store = get_vector_db(
+                    self._config,
+                    collection_name=self.collection_name,
+                    vector_store_args=self._vector_store_args,
+                )
+            return self.vector_store
+        resolved = self._registry.resolve(self.collection_name)
+        if resolved["collection"] != self._collection:
+            self.vector_store = get_vector_db(
+                self._config,
+                collection_name=resolved["collection"],
+                vector_store_args=self._vector_store_args,
+                embeddings_args=resolved["embeddings"]
+                or self._config.collection_embeddings.get(self.collection_name),
+                resolve=False,
+            )
+            self._collection = resolved["collection"]
+        return self.vector_store
+
+    def _get_shadow_vector_store(self):
+        """Get the collection's new collection while it is migrated to new embeddings (see `EmbeddingsMigration`)."""
+        if self._registry is None:
+            return None
+        migration = self._registry.get_migration(self.collection_name)
+        if not migration or migration.get("state") != "running":
+            return None
+        if self._shadow is None or self._shadow[0] != migration["target"]:
+            self._shadow = (
+                migration["target"],
+                get_vector_db(
+                    self._config,
+                    collection_name=migration["target"],
+                    vector_store_args=self._vector_store_args,
+                    embeddings_args=migration["embeddings"],
+                    resolve=False,
+                ),
+            )
+        return self._shadow[1]
 
 
 def get_data_loader(
@@ -131,9 +348,8 @@ def get_data_loader(
     database_kwargs: dict = None,
 ) -> DataLoader:
     """Get a data loader instance."""
-    vector_db = get_vector_db(
+    return DataLoader(
         config,
         collection_name=data_source_name,
         vector_store_args=database_kwargs,
     )
-    return DataLoader(config, vector_store=vector_db)
@@ -0,0 +1,239 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from genai_factory.data.keyword_index import BM25Index
+from genai_factory.utils import logger
+
+
+class LiveDocuments:
+    """
+    The (document uid, version) pairs that are still ingested into a data source, as recorded by the controller.
+
+    A chunk is live if its `doc_uid` is live with the chunk's `version`. Chunks without a version belong to any version
+    of their document, and chunks without a `doc_uid` were not ingested through the controller and are always live.
+    A chunk is tracked if its `doc_uid` is recorded at all (with any version).
+    """
+
+    def __init__(self, documents: Iterable[Tuple[str, Optional[str]]]):
+        self._versions: Dict[str, Set[str]] = {}
+        for uid, version in documents:
+            self._versions.setdefault(uid, set()).add(str(version or ""))
+
+    def __len__(self):
+        return len(self._versions)
+
+    def is_live(self, metadata: dict) -> bool:
+        doc_uid = metadata.get("doc_uid")
+        if not doc_uid:
+            return True
+        if doc_uid not in self._versions:
+            return False
+        version = metadata.get("version")
+        return not version or str(version) in self._versions[doc_uid]
+
+    def is_tracked(self, metadata: dict) -> bool:
+        return metadata.get("doc_uid") in self._versions
+
+
+def iter_chunks(
+    vector_store, batch_size: int = 1000, with_text: bool = False
+) -> Iterator[Tuple[str, dict, Optional[str]]]:
+    """
+    Iterate over all the chunks in a vector store, reading them in batches.
+
+    :param vector_store: The vector store (local, Milvus, Chroma or in-memory).
+    :param batch_size:   The number of chunks to read per request.
+    :param with_text:    Whether to read the chunks' texts as well (None is yielded otherwise).
+
+    :return: An iterator of (id, metadata, text) tuples.
+
+    :raises ValueError: If the vector store type is not supported.
+    """
+    if hasattr(vector_store, "iter_records"):
+        # Local vector store:
+        for id_, text, metadata in vector_store.iter_records():
+            yield id_, metadata, text if with_text else None
+    elif hasattr(vector_store, "col") and hasattr(vector_store, "_primary_field"):
+        # Milvus, only the needed fields are fetched:
+        if vector_store.col is None:
+            return
+        primary_field = vector_store._primary_field
+        if with_text:
+            # All the metadata fields are needed to copy the chunks:
+            output_fields = ["*"]
+        else:
+            output_fields = ["doc_uid", "version"]
+            if not getattr(vector_store, "enable_dynamic_field", False):
+                output_fields = [
+                    field for field in output_fields if field in vector_store.fields
+                ]
+        iterator = vector_store.col.query_iterator(
+            batch_size=batch_size,
+            expr=f"{primary_field} != ''"
+            if not vector_store.auto_id
+            else f"{primary_field} >= 0",
+            output_fields=output_fields,
+        )
+        try:
+            while batch := iterator.next():
+                for record in batch:
+                    id_ = record.pop(primary_field)
+                    record.pop(vector_store._vector_field, None)
+                    text = record.pop(vector_store._text_field, None)
+                    yield id_, record, text
+        finally:
+            iterator.close()
+    elif hasattr(vector_store, "_collection"):
+        # Chroma:
+        include = ["metadatas", "documents"] if with_text else ["metadatas"]
+        offset = 0
+        while True:
+            result = vector_store._collection.get(
+                include=include, limit=batch_size, offset=offset
+            )
+            if not result["ids"]:
+                return
+            texts = result["documents"] if with_text else [None] * len(result["ids"])
+            for id_, metadata, text in zip(result["ids"], result["metadatas"], texts):
+                yield id_, metadata or {}, text
+            offset += len(result["ids"])
+    elif isinstance(getattr(vector_store, "store", None), dict):
+        # In-memory vector stores:
+        for id_, record in list(vector_store.store.items()):
+            yield id_, record.get("metadata", {}), record.get("text")
+    else:
+        raise ValueError(
+            f"Scanning {type(vector_store).__name__} vector stores is not supported"
+        )
+
+
+def _compact(vector_store) -> Optional[int]:
+    """
+    Compact the vector store after deletions, when it supports it.
+    """
+    if hasattr(vector_store, "compact"):
+        return vector_store.compact()
+    if hasattr(vector_store, "col") and vector_store.col is not None:
+        # Milvus removes deleted entities from its segments only when they are compacted:
+        vector_store.col.compact()
+        vector_store.col.wait_for_compaction_completed()
+    return None
+
+
+def collect_garbage(
+    vector_store,
+    live_documents: Iterable[Tuple[str, Optional[str]]],
+    keyword_index: Optional[BM25Index] = None,
+    batch_size: int = 1000,
+    compact: bool = False,
+    dry_run: bool = False,
+    include_untracked: bool = False,
+    deleted_documents: Iterable[str] = None,
+) -> dict:
+    """
+    Delete the chunks of documents (or document versions) that are no longer ingested into a data source, from its
+    vector store and keyword index.
+
+    By default, the chunks of replaced versions of the live documents and the chunks of deleted documents (the
+    controller keeps the uids of deleted documents until their chunks are collected) are deleted. The chunks of
+    documents that are not recorded at all (untracked) are only counted, as they are most likely chunks ingested
+    before documents were tracked by the controller (with random document uids). Run with `dry_run=True` first to see
+    how many chunks would be deleted, and with `include_untracked=True` to delete the untracked ones too.
+
+    :param vector_store:      The data source's vector store (local, Milvus, Chroma or in-memory).
+    :param live_documents:    The (document uid, version) pairs that are still ingested into the data source.
+    :param keyword_index:     The data source's keyword index, if any.
+    :param batch_size:        The number of chunks to read and delete per request.
+    :param compact:           Whether to compact the vector store after the deletion (rebuilding the local vector
+                              store's graph or compacting the Milvus segments).
+    :param dry_run:           Only count the orphaned chunks without deleting them.
+    :param include_untracked: Whether to delete the chunks of untracked documents as well.
+    :param deleted_documents: The uids of the documents that were deleted from the data source.
+
+    :return: The collection statistics.
+
+    :raises ValueError: If there are no live documents, to avoid wiping a data source whose documents were not recorded.
+    """
+    start = time.monotonic()
+    live = LiveDocuments(live_documents)
+    deleted = set(deleted_documents or [])
+
+    def is_untracked(metadata: dict) -> bool:
+        return (
+            not live.is_live(metadata)
+            and not live.is_tracked(metadata)
+            and metadata["doc_uid"] not in deleted
+        )
+
+    def is_orphaned(metadata: dict) -> bool:
+        return not live.is_live(metadata) and (
+            include_untracked or not is_untracked(metadata)
+        )
+
+    scanned = untracked = tombstoned = 0
+    orphan_ids: List[str] = []
+    orphan_documents: Set[Tuple[str, str]] = set()
+    untracked_documents: Set[str] = set()
+    for id_, metadata, _ in iter_chunks(vector_store, batch_size):
+        scanned += 1
+        if is_untracked(metadata):
+            untracked += 1
+            untracked_documents.add(metadata["doc_uid"])
+        elif not live.is_live(metadata) and metadata["doc_uid"] in deleted:
+            tombstoned += 1
+        if is_orphaned(metadata):
+            orphan_ids.append(id_)
+            orphan_documents.add(
+                (metadata["doc_uid"], str(metadata.get("version") or ""))
+            )
+
+    stats = {
+        "live_documents": len(live),
+        "scanned_chunks": scanned,
+        "orphaned_chunks": len(orphan_ids),
+        "orphaned_documents": len(orphan_documents),
+        "untracked_chunks": untracked,
+        "untracked_documents": len(untracked_documents),
+        "tombstones": len(deleted),
+        "tombstoned_chunks": tombstoned,
+        "deleted_chunks": 0,
+        "deleted_keyword_chunks": 0,
+        "compacted": False,
+    }
+    if not len(live) and len(orphan_ids) > tombstoned and not dry_run:
+        # Most likely the documents of the data source were never recorded, rather than all deleted:
+        raise ValueError(
+            "No live documents are recorded for the data source, refusing to delete all of its chunks"
+        )
+    if dry_run:
+        stats["duration_s"] = round(time.monotonic() - start, 3)
+        return stats
+
+    for i in range(0, len(orphan_ids), batch_size):
+        vector_store.delete(ids=orphan_ids[i : i + batch_size])
+        stats["deleted_chunks"] += len(orphan_ids[i : i + batch_size])
+    if keyword_index is not None and (orphan_ids or compact):
+        stats["deleted_keyword_chunks"] = keyword_index.delete_where(
+            lambda document: is_orphaned(document.metadata)
+        )
+    if compact:
+        _compact(vector_store)
+        stats["compacted"] = True
+
+    stats["duration_s"] = round(time.monotonic() - start, 3)
+    logger.info(f"Garbage collection done: {stats}")
+    return stats
@@ -0,0 +1,416 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from genai_factory.utils import file_lock, logger
+
+# Words, numbers and compound tokens such as product codes ("XR-2000"), versions ("1.2.3") and identifiers:
+_TOKEN_PATTERN = re.compile(r"\w+(?:[-.:/]\w+)*")
+_PART_PATTERN = re.compile(r"[-.:/]")
+# The number of times a reader re-reads the manifest when a segment it lists was merged away meanwhile:
+_REFRESH_ATTEMPTS = 5
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase keyword tokens. Compound tokens are kept whole and their parts are added as well, so
+    "ERR-1234" matches both "err-1234" and "1234".
+
+    :param text: The text to tokenize.
+
+    :return: The list of tokens.
+    """
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = _PART_PATTERN.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class _Segment:
+    """
+    An immutable, memory-mapped part of the index:
+
+    * terms.json       - term to (offset, count) in the postings arrays.
+    * postings.npy     - the local document ids of every term's postings.
+    * frequencies.npy  - the term frequency of every posting.
+    * lengths.npy      - the number of tokens in every document.
+    * documents.bin    - the documents' JSON (id, content and metadata), one after the other.
+    * offsets.npy      - the start offset of every document in documents.bin (and the end of the last one).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path / "terms.json", "r") as f:
+            self.terms: Dict[str, Tuple[int, int]] = json.load(f)
+        self.postings = np.load(path / "postings.npy", mmap_mode="r")
+        self.frequencies = np.load(path / "frequencies.npy", mmap_mode="r")
+        self.lengths = np.load(path / "lengths.npy", mmap_mode="r")
+        self.offsets = np.load(path / "offsets.npy", mmap_mode="r")
+        self.documents = np.memmap(path / "documents.bin", dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def document_frequency(self, term: str) -> int:
+        return self.terms.get(term, (0, 0))[1]
+
+    def get_document(self, doc_id: int) -> Document:
+        start, end = int(self.offsets[doc_id]), int(self.offsets[doc_id + 1])
+        record = json.loads(self.documents[start:end].tobytes().decode("utf-8"))
+        return Document(
+            id=record.get("id"),
+            page_content=record["page_content"],
+            metadata=record["metadata"],
+        )
+
+    def iter_documents(self):
+        for doc_id in range(len(self)):
+            yield self.get_document(doc_id)
+
+    @staticmethod
+    def write(path: Path, documents: Iterable[Document]):
+        """
+        Write the documents as a new segment directory. The documents are streamed to disk, so only the postings are
+        held in memory.
+        """
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        offsets = [0]
+        path.mkdir(parents=True)
+        with open(path / "documents.bin", "wb") as f:
+            for doc_id, document in enumerate(documents):
+                tokens = tokenize(document.page_content)
+                lengths.append(len(tokens))
+                for term, frequency in Counter(tokens).items():
+                    postings.setdefault(term, []).append((doc_id, frequency))
+                record = json.dumps(
+                    {
+                        "id": document.id,
+                        "page_content": document.page_content,
+                        "metadata": document.metadata,
+                    },
+                    default=str,
+                ).encode("utf-8")
+                f.write(record)
+                offsets.append(offsets[-1] + len(record))
+
+        terms = {}
+        doc_ids, frequencies = [], []
+        for term in sorted(postings):
+            terms[term] = (len(doc_ids), len(postings[term]))
+            for doc_id, frequency in postings[term]:
+                doc_ids.append(doc_id)
+                frequencies.append(frequency)
+        with open(path / "terms.json", "w") as f:
+            json.dump(terms, f)
+        np.save(path / "postings.npy", np.array(doc_ids, dtype=np.int32))
+        np.save(path / "frequencies.npy", np.array(frequencies, dtype=np.int32))
+        np.save(path / "lengths.npy", np.array(lengths, dtype=np.int32))
+        np.save(path / "offsets.npy", np.array(offsets, dtype=np.int64))
+
+
+class BM25Index:
+    """
+    A local BM25 keyword index of a collection, kept next to the vector store to serve hybrid retrieval.
+
+    The index is made of immutable segments that are memory-mapped from disk. Every `add_documents` call writes a
+    new segment, and segments are merged by tiers: once there are `merge_factor` segments of about the same size
+    (the same power of `merge_factor` documents), they are merged into one segment of the next tier. Every document is
+    therefore rewritten about log(N) times, and there are at most `merge_factor` segments per tier. The list of live
+    segments is kept in a manifest that is replaced atomically, so readers (also in other processes) pick up new
+    documents on their next search. Writers hold a lock file, so several processes can add documents to the index.
+
+    Example:
+        index = BM25Index("/data/keyword-index/products")
+        index.add_documents(chunks)
+        results = index.search("error ERR-1234", k=10)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        k1: float = 1.2,
+        b: float = 0.75,
+        merge_factor: int = 10,
+    ):
+        """
+        Initialize the index.
+
+        :param path:         The directory of the index, created if it does not exist.
+        :param k1:           The BM25 term frequency saturation parameter.
+        :param b:            The BM25 document length normalization parameter.
+        :param merge_factor: The number of segments of the same tier that are merged together.
+        """
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        if merge_factor < 2:
+            raise ValueError(f"merge_factor must be at least 2 (got {merge_factor})")
+        self.merge_factor = merge_factor
+        self._segments: Dict[str, _Segment] = {}
+        self._manifest_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def _manifest_path(self) -> Path:
+        return self.path / "manifest.json"
+
+    @property
+    def _lock_path(self) -> Path:
+        return self.path / "index.lock"
+
+    def _read_manifest(self) -> dict:
+        if not self._manifest_path.exists():
+            return {"segments": [], "next_segment": 0}
+        with open(self._manifest_path, "r") as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: dict):
+        tmp_path = self.path / "manifest.json.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _refresh(self) -> List[_Segment]:
+        """
+        Open the segments listed in the manifest if it changed since the last time it was read.
+        """
+        if not self._manifest_path.exists():
+            return []
+        mtime = self._manifest_path.stat().st_mtime_ns
+        if mtime != self._manifest_mtime:
+            for attempt in range(_REFRESH_ATTEMPTS):
+                names = self._read_manifest()["segments"]
+                try:
+                    self._segments = {
+                        name: self._segments.get(name) or _Segment(self.path / name)
+                        for name in names
+                    }
+                    break
+                except FileNotFoundError:
+                    # A writer merged the segments and replaced the manifest after we read it, read it again:
+                    if attempt == _REFRESH_ATTEMPTS - 1:
+                        raise
+                    mtime = self._manifest_path.stat().st_mtime_ns
+            self._manifest_mtime = mtime
+        return list(self._segments.values())
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(segment) for segment in self._refresh())
+
+    def add_documents(self, documents: List[Document]):
+        """
+        Index the documents as a new segment.
+
+        :param documents: The documents (chunks) to index.
+        """
+        if not documents:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._lock, file_lock(self._lock_path):
+            manifest = self._read_manifest()
+            name = self._new_segment_name(manifest)
+            _Segment.write(self.path / name, documents)
+            manifest["segments"].append(name)
+            manifest["next_segment"] += 1
+            stale_names = self._merge_tiers(manifest)
+            self._write_manifest(manifest)
+            self._remove_segments(stale_names)
+
+    def delete_where(self, predicate: Callable[[Document], bool]) -> int:
+        """
+        Delete the documents that match a predicate, rewriting the index as a single segment without them.
+
+        :param predicate: A function of a document that returns True if the document should be deleted.
+
+        :return: The number of deleted documents.
+        """
+        deleted = 0
+
+        def keep(document: Document) -> bool:
+            nonlocal deleted
+            if predicate(document):
+                deleted += 1
+                return False
+            return True
+
+        if not self.path.exists():
+            return 0
+        with self._lock, file_lock(self._lock_path):
+            manifest = self._read_manifest()
+            if not manifest["segments"]:
+                return 0
+            stale_names = self._merge(manifest, manifest["segments"], keep=keep)
+            self._write_manifest(manifest)
+            self._remove_segments(stale_names)
+        return deleted
+
+    def _tier(self, name: str) -> int:
+        size = len(np.load(self.path / name / "lengths.npy", mmap_mode="r"))
+        return int(math.log(max(size, 1), self.merge_factor))
+
+    def _new_segment_name(self, manifest: dict) -> str:
+        name = f"segment-{manifest['next_segment']:08d}"
+        # A leftover of a writer that crashed before replacing the manifest, no reader ever opened it:
+        shutil.rmtree(self.path / name, ignore_errors=True)
+        return name
+
+    def _remove_segments(self, names: List[str]):
+        # Called only after the manifest that no longer lists them was written. Readers that still hold the old
+        # segments keep their memory maps valid after the files are removed:
+        for name in names:
+            shutil.rmtree(self.path / name, ignore_errors=True)
+
+    def _merge_tiers(self, manifest: dict) -> List[str]:
+        """
+        Merge the segments of the lowest tier that has `merge_factor` segments, until no tier has that many.
+
+        :return: The names of the merged segments, to remove once the manifest is written.
+        """
+        stale_names = []
+        while True:
+            tiers: Dict[int, List[str]] = {}
+            for name in manifest["segments"]:
+                tiers.setdefault(self._tier(name), []).append(name)
+            full = [
+                names
+                for _, names in sorted(tiers.items())
+                if len(names) >= self.merge_factor
+            ]
+            if not full:
+                return stale_names
+            stale_names.extend(self._merge(manifest, full[0]))
+
+    def _merge(
+        self,
+        manifest: dict,
+        old_names: List[str],
+        keep: Callable[[Document], bool] = None,
+    ) -> List[str]:
+        """
+        Merge segments of the manifest into a single new segment (updating the manifest in place), keeping only the
+        documents `keep` returns True for when it is given. The old segments are not removed, as the manifest on disk
+        still lists them.
+
+        :return: The names of the merged segments.
+        """
+        segments = [_Segment(self.path / name) for name in old_names]
+        name = self._new_segment_name(manifest)
+        documents = (
+            document for segment in segments for document in segment.iter_documents()
+        )
+        _Segment.write(
+            self.path / name,
+            filter(keep, documents) if keep else documents,
+        )
+        manifest["segments"] = [
+            *(other for other in manifest["segments"] if other not in old_names),
+            name,
+        ]
+        manifest["next_segment"] += 1
+        logger.debug(
+            f"Merged {len(old_names)} keyword index segments into '{name}' "
+            f"({sum(len(segment) for segment in segments)} documents)"
+        )
+        return list(old_names)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[Document, float]]:
+        """
+        Search the index with BM25 scoring.
+
+        :param query: The query text.
+        :param k:     The number of results to return.
+
+        :return: A list of (document, score) tuples, best first.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            segments = self._refresh()
+        if not terms or not segments:
+            return []
+
+        # Collection wide statistics:
+        num_documents = sum(len(segment) for segment in segments)
+        if not num_documents:
+            return []
+        average_length = (
+            sum(float(segment.lengths.sum()) for segment in segments) / num_documents
+        )
+        idf = {}
+        for term in terms:
+            df = sum(segment.document_frequency(term) for segment in segments)
+            if df:
+                idf[term] = math.log(1 + (num_documents - df + 0.5) / (df + 0.5))
+
+        candidates = []
+        for segment in segments:
+            scores = np.zeros(len(segment), dtype=np.float32)
+            norms = self.k1 * (
+                1 - self.b + self.b * np.asarray(segment.lengths) / average_length
+            )
+            for term, term_idf in idf.items():
+                if term not in segment.terms:
+                    continue
+                offset, count = segment.terms[term]
+                doc_ids = np.asarray(segment.postings[offset : offset + count])
+                frequencies = np.asarray(
+                    segment.frequencies[offset : offset + count], dtype=np.float32
+                )
+                scores[doc_ids] += (
+                    term_idf
+                    * frequencies
+                    * (self.k1 + 1)
+                    / (frequencies + norms[doc_ids])
+                )
+            matched = np.flatnonzero(scores)
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k)[:k]]
+            candidates.extend((float(scores[i]), segment, int(i)) for i in matched)
+
+        top = heapq.nlargest(k, candidates, key=lambda candidate: candidate[0])
+        return [(segment.get_document(doc_id), score) for score, segment, doc_id in top]
+
+
+def get_keyword_index(config, collection_name: str) -> Optional[BM25Index]:
+    """
+    Get the keyword index of a collection, if keyword indexing is enabled (`keyword_index_path` is configured).
+
+    :param config:          The workflows server configuration.
+    :param collection_name: The name of the collection.
+
+    :return: The collection's keyword index or None.
+    """
+    if not config.keyword_index_path:
+        return None
+    return BM25Index(
+        os.path.join(config.keyword_index_path, collection_name),
+        **config.keyword_index_kwargs,
+    )
@@ -0,0 +1,894 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import heapq
+import json
+import math
+import os
+import pickle
+import random
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from genai_factory.utils import file_lock, logger
+
+DTYPES = ["float32", "float16", "int8", "binary"]
+
+# The number of set bits of every byte, for hamming distances between packed binary vectors:
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint16)
+
+# The graph log size below which the graph is not snapshotted:
+_MIN_SNAPSHOT_BYTES = 1 << 20
+
+
+def match_filter(metadata: dict, filter: Optional[dict]) -> bool:
+    """
+    Check whether a document's metadata matches a filter. The filter is a dictionary of metadata keys to values (the
+    same dictionaries `fix_milvus_filter_arg` turns into Milvus expressions). A list, tuple or set value matches any
+    of its items.
+
+    :param metadata: The document's metadata.
+    :param filter:   The filter to match.
+
+    :return: True if all the filter's conditions match.
+    """
+    if not filter:
+        return True
+    for key, value in filter.items():
+        if isinstance(value, (list, tuple, set)):
+            if metadata.get(key) not in value:
+                return False
+        elif metadata.get(key) != value:
+            return False
+    return True
+
+
+class _VectorStorage:
+    """
+    Growable storage of normalized vectors, kept as float32, float16, int8 (with a per-vector scale) or binary (the
+    sign of every dimension, packed to bits). Binary vectors are searched by their hamming distance and are kept with
+    int8 copies that are only read to rescore the search candidates. When a path is given the vectors
+    are memory-mapped from files, otherwise they are kept in memory.
+    """
+
+    def __init__(self, dim: int, dtype: str, path: Optional[Path], count: int = 0):
+        self.dim = dim
+        self.dtype = dtype
+        self.width = (dim + 7) // 8 if dtype == "binary" else dim
+        self.path = path
+        self.count = count
+        self.capacity = 0
+        self.data = None
+        self.scales = None
+        self.rescore = None
+        self._grow(max(count, 1024))
+
+    def _open(self, name: str, dtype, shape: tuple):
+        if self.path is None:
+            array = np.zeros(shape, dtype=dtype)
+            if self.capacity:
+                old = getattr(self, name)
+                array[: len(old)] = old
+            return array
+        file_path = self.path / f"{name}.bin"
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(file_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(file_path, dtype=dtype, mode="r+", shape=shape)
+
+    def _grow(self, capacity: int):
+        if self.data is not None:
+            self.flush()
+        if self.dtype == "binary":
+            storage_dtype = np.uint8
+        elif self.dtype == "int8":
+            storage_dtype = np.int8
+        else:
+            storage_dtype = np.dtype(self.dtype)
+        self.data = self._open("data", storage_dtype, (capacity, self.width))
+        if self.dtype in ["int8", "binary"]:
+            self.scales = self._open("scales", np.float32, (capacity,))
+        if self.dtype == "binary":
+            self.rescore = self._open("rescore", np.int8, (capacity, self.dim))
+        self.capacity = capacity
+
+    def append(self, vectors: np.ndarray):
+        needed = self.count + len(vectors)
+        if needed > self.capacity:
+            self._grow(max(needed, 2 * self.capacity))
+        rows = slice(self.count, needed)
+        if self.dtype in ["int8", "binary"]:
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales[rows] = scales
+            if self.dtype == "binary":
+                self.data[rows] = np.packbits(vectors > 0, axis=1)
+                self.rescore[rows] = quantized
+            else:
+                self.data[rows] = quantized
+        else:
+            self.data[rows] = vectors
+        self.count = needed
+
+    @property
+    def bytes_per_vector(self) -> int:
+        """
+        The bytes stored per vector, including the scales and the int8 copies of binary vectors.
+        """
+        size = self.width * self.data.dtype.itemsize
+        if self.scales is not None:
+            size += self.scales.dtype.itemsize
+        if self.rescore is not None:
+            size += self.dim * self.rescore.dtype.itemsize
+        return size
+
+    @property
+    def searched_bytes_per_vector(self) -> int:
+        """
+        The bytes per vector that every search reads (the int8 copies and scales of binary vectors are only read to
+        rescore the candidates).
+        """
+        if self.dtype == "binary":
+            return self.width
+        return self.bytes_per_vector
+
+    def get(self, ids) -> np.ndarray:
+        data = self.rescore if self.dtype == "binary" else self.data
+        vectors = np.asarray(data[ids], dtype=np.float32)
+        if self.dtype in ["int8", "binary"]:
+            vectors *= np.asarray(self.scales[ids])[..., None]
+        return vectors
+
+    def distances(self, ids, query: np.ndarray) -> np.ndarray:
+        """
+        Get the cosine distances between the query and the vectors. Binary vectors are compared with the binarized
+        query by their hamming distance (scaled to the cosine distance of the binarized vectors).
+        """
+        if self.dtype == "binary":
+            query_bits = np.packbits(query > 0, axis=-1)
+            hamming = _POPCOUNT[np.bitwise_xor(self.data[ids], query_bits)].sum(axis=-1)
+            return 2 * hamming / self.dim
+        return 1 - self.get(ids) @ query
+
+    def flush(self):
+        if self.path is not None:
+            self.data.flush()
+            if self.scales is not None:
+                self.scales.flush()
+            if self.rescore is not None:
+                self.rescore.flush()
+
+
+class _HNSW:
+    """
+    A hierarchical navigable small world graph over the vectors of a `_VectorStorage`, using cosine distance (the
+    vectors are normalized).
+    """
+
+    def __init__(self, M: int = 16, ef_construction: int = 100, seed: int = 0):
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.level_factor = 1 / math.log(M)
+        self.levels: List[int] = []
+        self.neighbors: List[List[List[int]]] = []
+        self.entry_point = -1
+        self.max_level = -1
+        self._random = random.Random(seed)
+        # The nodes whose neighbors changed since the last `changes` call:
+        self._dirty = set()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_random")
+        state.pop("_dirty", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._random = random.Random(len(self.levels))
+        self._dirty = set()
+
+    def changes(self, first: int) -> dict:
+        """
+        Get the changes since the last call, as a record to `apply` to a copy of the graph that has `first` nodes.
+        """
+        record = {
+            "first": first,
+            "levels": self.levels[first:],
+            "neighbors": {node: self.neighbors[node] for node in self._dirty},
+            "entry_point": self.entry_point,
+            "max_level": self.max_level,
+        }
+        self._dirty = set()
+        return record
+
+    def apply(self, record: dict):
+        """
+        Apply the changes of another copy of the graph (see `changes`).
+        """
+        del self.levels[record["first"] :], self.neighbors[record["first"] :]
+        self.levels.extend(record["levels"])
+        self.neighbors.extend(
+            [[] for _ in range(level + 1)] for level in record["levels"]
+        )
+        for node, neighbors in record["neighbors"].items():
+            self.neighbors[node] = neighbors
+        self.entry_point = record["entry_point"]
+        self.max_level = record["max_level"]
+
+    @staticmethod
+    def _distances(storage: _VectorStorage, query: np.ndarray, ids: List[int]):
+        return storage.distances(ids, query)
+
+    def _search_layer(
+        self,
+        storage: _VectorStorage,
+        query: np.ndarray,
+        entry_points: List[Tuple[float, int]],
+        ef: int,
+        level: int,
+    ) -> List[Tuple[float, int]]:
+        visited = {node for _, node in entry_points}
+        candidates = list(entry_points)
+        heapq.heapify(candidates)
+        results = [(-distance, node) for distance, node in entry_points]
+        heapq.heapify(results)
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if distance > -results[0][0] and len(results) >= ef:
+                break
+            unvisited = [n for n in self.neighbors[node][level] if n not in visited]
+            if not unvisited:
+                continue
+            visited.update(unvisited)
+            for neighbor_distance, neighbor in zip(
+                self._distances(storage, query, unvisited), unvisited
+            ):
+                neighbor_distance = float(neighbor_distance)
+                if len(results) < ef or neighbor_distance < -results[0][0]:
+                    heapq.heappush(candidates, (neighbor_distance, neighbor))
+                    heapq.heappush(results, (-neighbor_distance, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-distance, node) for distance, node in results)
+
+    def _prune(self, storage: _VectorStorage, node: int, level: int):
+        max_neighbors = self.M0 if level == 0 else self.M
+        neighbors = self.neighbors[node][level]
+        if len(neighbors) <= max_neighbors:
+            return
+        distances = self._distances(storage, storage.get(node), neighbors)
+        keep = np.argsort(distances)[:max_neighbors]
+        self.neighbors[node][level] = [neighbors[i] for i in keep]
+
+    def add(self, storage: _VectorStorage, node: int):
+        level = int(-math.log(1 - self._random.random()) * self.level_factor)
+        self.levels.append(level)
+        self.neighbors.append([[] for _ in range(level + 1)])
+        self._dirty.add(node)
+        if self.entry_point < 0:
+            self.entry_point, self.max_level = node, level
+            return
+
+        query = storage.get(node)
+        entry_points = [
+            (
+                float(self._distances(storage, query, [self.entry_point])[0]),
+                self.entry_point,
+            )
+        ]
+        for layer in range(self.max_level, level, -1):
+            entry_points = self._search_layer(storage, query, entry_points, 1, layer)
+        for layer in range(min(level, self.max_level), -1, -1):
+            entry_points = self._search_layer(
+                storage, query, entry_points, self.ef_construction, layer
+            )
+            max_neighbors = self.M0 if layer == 0 else self.M
+            selected = [neighbor for _, neighbor in entry_points[:max_neighbors]]
+            self.neighbors[node][layer] = selected
+            self._dirty.update(selected)
+            for neighbor in selected:
+                self.neighbors[neighbor][layer].append(node)
+                self._prune(storage, neighbor, layer)
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def search(
+        self, storage: _VectorStorage, query: np.ndarray, k: int, ef: int
+    ) -> List[Tuple[float, int]]:
+        if self.entry_point < 0:
+            return []
+        entry_points = [
+            (
+                float(self._distances(storage, query, [self.entry_point])[0]),
+                self.entry_point,
+            )
+        ]
+        for layer in range(self.max_level, 0, -1):
+            entry_points = self._search_layer(storage, query, entry_points, 1, layer)
+        return self._search_layer(storage, query, entry_points, max(ef, k), 0)[:k]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    An embedded vector store: vectors are kept quantized (float16, int8 or binary) in memory-mapped files and searched
+    with an HNSW graph in the serving process, with no network hops. Collections smaller than `exact_search_threshold`
+    are searched exactly. Suited for small and medium collections, local development and tests (without a
+    `persist_directory` the collection lives in memory).
+
+    Binary vectors take 1 bit per dimension (32 times less than float32) and are searched by their hamming distance.
+    As it ranks coarsely, `rescore_multiplier` times more candidates are fetched and rescored with int8 copies of their
+    vectors, which are memory-mapped and only read for the candidates. The copies take more space than the bits (more
+    than int8 vectors in total), so binary vectors save memory only with a `persist_directory`. Measure the recall of
+    each dtype with `python -m genai_factory.benchmarks.embeddings_recall`.
+
+    Configure it with::
+
+        default_vector_store:
+          class_name: local
+          collection_name: default
+          persist_directory: /data/vector-store
+          dtype: int8
+
+    Search filters are metadata dictionaries, for example `{"source": "manual.pdf", "version": [1, 2]}`.
+
+    Several instances (also in other processes) may use the same collection: writers hold a lock file, and every
+    instance picks up the documents the others wrote on its next operation, reading only what changed. The graph is
+    saved incrementally, with a log of the changed nodes that is folded into a snapshot once it outgrows it. The HNSW
+    graph is built in pure Python (a few hundred vectors per second) and held in memory by every instance, so the store
+    is meant for collections of up to a few hundred thousand chunks, use Milvus beyond that.
+    """
+
+    def __init__(
+        self,
+        embedding_function: Embeddings,
+        collection_name: str = "default",
+        persist_directory: Optional[str] = None,
+        dtype: str = "float16",
+        M: int = 16,
+        ef_construction: int = 100,
+        ef_search: int = 64,
+        exact_search_threshold: int = 2000,
+        rescore_multiplier: int = 4,
+        **kwargs,
+    ):
+        """
+        Initialize the local vector store, loading the collection if it exists.
+
+        :param embedding_function:     The embeddings to use.
+        :param collection_name:        The name of the collection.
+        :param persist_directory:      The directory to keep the collections in. Default is None (in memory).
+        :param dtype:                  The vectors' storage type, one of "float32", "float16", "int8" and "binary".
+        :param M:                      The number of neighbors of each node in the HNSW graph (twice that on the
+                                       bottom layer).
+        :param ef_construction:        The size of the candidates list when adding vectors to the graph.
+        :param ef_search:              The size of the candidates list when searching the graph.
+        :param exact_search_threshold: The collection size below which searches are exact.
+        :param rescore_multiplier:     With binary vectors, the number of candidates fetched per result to rescore.
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES} (got '{dtype}')")
+        self.embedding_function = embedding_function
+        self.collection_name = collection_name
+        self.dtype = dtype
+        self.ef_search = ef_search
+        self.exact_search_threshold = exact_search_threshold
+        self.rescore_multiplier = rescore_multiplier
+        self.path = (
+            Path(persist_directory) / collection_name if persist_directory else None
+        )
+
+        self._M = M
+        self._ef_construction = ef_construction
+        self._lock = threading.RLock()
+        self._reset()
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._refresh()
+
+    def _reset(self):
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        self._id_to_node: Dict[str, int] = {}
+        self._deleted = set()
+        self._storage: Optional[_VectorStorage] = None
+        self._graph = _HNSW(M=self._M, ef_construction=self._ef_construction)
+        # The persisted state this instance is in sync with:
+        self._meta_stamp = None
+        self._generation = 0
+        self._documents_bytes = 0
+        self._graph_snapshot: Optional[int] = None
+        self._graph_snapshot_bytes = 0
+        self._graph_log_bytes = 0
+        self._graph_nodes = 0
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._ids) - len(self._deleted)
+
+    @property
+    def vectors_size_bytes(self) -> int:
+        """
+        The size of the stored vectors in bytes, including the int8 rescoring copies of binary vectors (and the
+        vectors of deleted documents until compacted).
+        """
+        if self._storage is None:
+            return 0
+        return self._storage.count * self._storage.bytes_per_vector
+
+    @property
+    def resident_vectors_size_bytes(self) -> int:
+        """
+        The size in bytes of the stored vectors that stay in memory: all of them without a `persist_directory`,
+        otherwise the memory-mapped vectors that every search reads (the rescoring copies of binary vectors are only
+        paged in for the candidates).
+        """
+        if self._storage is None:
+            return 0
+        if self.path is None:
+            return self.vectors_size_bytes
+        return self._storage.count * self._storage.searched_bytes_per_vector
+
+    def _meta_stamp_now(self) -> Optional[tuple]:
+        try:
+            stat = (self.path / "meta.json").stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self):
+        """
+        Pick up the documents that other instances (also in other processes) wrote since the collection was last read.
+        """
+        if self.path is None or self._meta_stamp_now() in [None, self._meta_stamp]:
+            return
+        with file_lock(self.path / "write.lock"):
+            self._sync()
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """
+        Lock the collection for writing, across threads and processes, and bring it up to date first.
+        """
+        with self._lock:
+            if self.path is None:
+                yield
+                return
+            with file_lock(self.path / "write.lock"):
+                self._sync()
+                yield
+
+    def _sync(self):
+        """
+        Bring the collection up to date with the files, reading only what was written since the last sync (unless the
+        collection was compacted). Requires the write lock.
+        """
+        stamp = self._meta_stamp_now()
+        if stamp is None or stamp == self._meta_stamp:
+            return
+        with open(self.path / "meta.json", "r") as f:
+            meta = json.load(f)
+        if meta.get("generation", 0) != self._generation:
+            # Compacted, all the files were rewritten:
+            self._reset()
+            self._generation = meta.get("generation", 0)
+        if meta["dtype"] != self.dtype:
+            logger.warning(
+                f"Collection '{self.collection_name}' is stored as {meta['dtype']}, ignoring dtype '{self.dtype}'"
+            )
+            self.dtype = meta["dtype"]
+
+        count = meta["count"]
+        if count > len(self._ids):
+            with open(self.path / "documents.jsonl", "rb") as f:
+                f.seek(self._documents_bytes)
+                for _ in range(count - len(self._ids)):
+                    record = json.loads(f.readline())
+                    self._id_to_node[record["id"]] = len(self._ids)
+                    self._ids.append(record["id"])
+                    self._texts.append(record["text"])
+                    self._metadatas.append(record["metadata"])
+                self._documents_bytes = f.tell()
+            self._storage = _VectorStorage(meta["dim"], self.dtype, self.path, count)
+        for node in set(meta["deleted"]) - self._deleted:
+            if self._id_to_node.get(self._ids[node]) == node:
+                del self._id_to_node[self._ids[node]]
+            self._deleted.add(node)
+
+        graph = meta.get("graph")
+        if graph is None:
+            # Written before the graph was saved incrementally:
+            graph_path = self.path / "hnsw.pkl"
+            if graph_path.exists() and not self._graph.levels:
+                with open(graph_path, "rb") as f:
+                    self._graph = pickle.load(f)
+        else:
+            if graph["snapshot"] != self._graph_snapshot:
+                snapshot_path = self.path / f"hnsw-{graph['snapshot']:06d}.pkl"
+                with open(snapshot_path, "rb") as f:
+                    self._graph = pickle.load(f)
+                self._graph_snapshot = graph["snapshot"]
+                self._graph_snapshot_bytes = snapshot_path.stat().st_size
+                self._graph_log_bytes = 0
+            if graph["log_bytes"] > self._graph_log_bytes:
+                log_path = self.path / f"hnsw-{graph['snapshot']:06d}.log"
+                with open(log_path, "rb") as f:
+                    f.seek(self._graph_log_bytes)
+                    while f.tell() < graph["log_bytes"]:
+                        self._graph.apply(pickle.load(f))
+                self._graph_log_bytes = graph["log_bytes"]
+        self._graph_nodes = len(self._graph.levels)
+        self._meta_stamp = stamp
+        if self._graph_nodes < count:
+            # Add the vectors that were written after the graph was last saved:
+            for node in range(self._graph_nodes, count):
+                self._graph.add(self._storage, node)
+            self._save()
+
+    def _save(self, snapshot: bool = False):
+        """
+        Persist the changes: the new nodes and changed neighbors of the graph are appended to the graph log, which is
+        folded into a new graph snapshot once it is larger than the last snapshot (so saving is amortized O(1) per
+        vector). Requires the write lock.
+
+        :param snapshot: Whether to write a graph snapshot even if the log is small.
+        """
+        self._storage.flush()
+        old_snapshot = self._graph_snapshot
+        if (
+            snapshot
+            or old_snapshot is None
+            or self._graph_log_bytes
+            > max(self._graph_snapshot_bytes, _MIN_SNAPSHOT_BYTES)
+        ):
+            self._graph_snapshot = (old_snapshot or 0) + 1
+            snapshot_path = self.path / f"hnsw-{self._graph_snapshot:06d}.pkl"
+            # The snapshot includes all the changes:
+            self._graph.changes(len(self._graph.levels))
+            with open(snapshot_path, "wb") as f:
+                pickle.dump(self._graph, f)
+            self._graph_snapshot_bytes = snapshot_path.stat().st_size
+            self._graph_log_bytes = 0
+        else:
+            with open(self.path / f"hnsw-{self._graph_snapshot:06d}.log", "ab") as f:
+                # Drop what a writer that failed before updating the metadata appended:
+                f.truncate(self._graph_log_bytes)
+                pickle.dump(self._graph.changes(self._graph_nodes), f)
+                self._graph_log_bytes = f.tell()
+        self._graph_nodes = len(self._graph.levels)
+
+        with open(self.path / "meta.json.tmp", "w") as f:
+            json.dump(
+                {
+                    "dim": self._storage.dim,
+                    "dtype": self.dtype,
+                    "count": len(self._ids),
+                    "deleted": sorted(self._deleted),
+                    "generation": self._generation,
+                    "documents_bytes": self._documents_bytes,
+                    "graph": {
+                        "snapshot": self._graph_snapshot,
+                        "log_bytes": self._graph_log_bytes,
+                    },
+                },
+                f,
+            )
+        os.replace(self.path / "meta.json.tmp", self.path / "meta.json")
+        self._meta_stamp = self._meta_stamp_now()
+        if old_snapshot != self._graph_snapshot:
+            # Other instances read the new snapshot on their next sync (under the write lock):
+            stale = ["hnsw.pkl"]
+            if old_snapshot is not None:
+                stale += [
+                    f"hnsw-{old_snapshot:06d}.pkl",
+                    f"hnsw-{old_snapshot:06d}.log",
+                ]
+            for name in stale:
+                (self.path / name).unlink(missing_ok=True)
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        vectors = self._normalize(self.embedding_function.embed_documents(texts))
+        with self._writing():
+            # Re-added ids replace their previous version:
+            self._delete_nodes(ids)
+            if self._storage is None:
+                self._storage = _VectorStorage(vectors.shape[1], self.dtype, self.path)
+            first_node = len(self._ids)
+            self._storage.append(vectors)
+            records = []
+            for i, (id_, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                self._id_to_node[id_] = first_node + i
+                self._ids.append(id_)
+                self._texts.append(text)
+                self._metadatas.append(metadata)
+                records.append(
+                    json.dumps(
+                        {"id": id_, "text": text, "metadata": metadata}, default=str
+                    )
+                )
+            for node in range(first_node, len(self._ids)):
+                self._graph.add(self._storage, node)
+            if self.path is not None:
+                with open(self.path / "documents.jsonl", "ab") as f:
+                    # Drop what a writer that failed before updating the metadata appended:
+                    f.truncate(self._documents_bytes)
+                    f.write(("\n".join(records) + "\n").encode("utf-8"))
+                    self._documents_bytes = f.tell()
+                self._save()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """
+        Delete documents by their ids. Deleted vectors stay in the graph (to keep it connected) but are never returned.
+
+        :param ids: The ids of the documents to delete.
+
+        :return: True if any document was deleted.
+        """
+        with self._writing():
+            deleted = self._delete_nodes(ids or [])
+            if deleted and self.path is not None:
+                self._save()
+        return deleted
+
+    def _delete_nodes(self, ids: Iterable[str]) -> bool:
+        nodes = {self._id_to_node.pop(id_) for id_ in ids if id_ in self._id_to_node}
+        self._deleted.update(nodes)
+        return bool(nodes)
+
+    def iter_records(self) -> Iterable[Tuple[str, str, dict]]:
+        """
+        Iterate over the (id, text, metadata) of the live documents.
+        """
+        with self._lock:
+            self._refresh()
+            live = [
+                (self._ids[node], self._texts[node], self._metadatas[node])
+                for node in range(len(self._ids))
+                if node not in self._deleted
+            ]
+        return iter(live)
+
+    def compact(self) -> int:
+        """
+        Rebuild the collection without its deleted documents: the vectors are rewritten and the HNSW graph is rebuilt,
+        so deleted vectors no longer take space or slow down graph searches.
+
+        :return: The number of removed documents.
+        """
+        with self._writing():
+            removed = len(self._deleted)
+            if not removed:
+                return 0
+            live = [node for node in range(len(self._ids)) if node not in self._deleted]
+            ids = [self._ids[node] for node in live]
+            texts = [self._texts[node] for node in live]
+            metadatas = [self._metadatas[node] for node in live]
+            vectors = self._storage.get(live) if live else None
+            dim = self._storage.dim
+
+            if self.path is not None:
+                # Write the new files next to the old ones and replace them once complete:
+                tmp_path = self.path / "compact.tmp"
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                tmp_path.mkdir()
+                storage = _VectorStorage(dim, self.dtype, tmp_path)
+                if vectors is not None:
+                    storage.append(vectors)
+                storage.flush()
+                with open(tmp_path / "documents.jsonl", "wb") as f:
+                    for id_, text, metadata in zip(ids, texts, metadatas):
+                        record = json.dumps(
+                            {"id": id_, "text": text, "metadata": metadata},
+                            default=str,
+                        )
+                        f.write((record + "\n").encode("utf-8"))
+                    self._documents_bytes = f.tell()
+                del storage
+                for name in [
+                    "data.bin",
+                    "scales.bin",
+                    "rescore.bin",
+                    "documents.jsonl",
+                ]:
+                    if (tmp_path / name).exists():
+                        os.replace(tmp_path / name, self.path / name)
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                self._storage = _VectorStorage(dim, self.dtype, self.path, len(ids))
+            else:
+                self._storage = _VectorStorage(dim, self.dtype, None)
+                if vectors is not None:
+                    self._storage.append(vectors)
+
+            self._ids, self._texts, self._metadatas = ids, texts, metadatas
+            self._id_to_node = {id_: node for node, id_ in enumerate(ids)}
+            self._deleted = set()
+            self._graph = _HNSW(M=self._M, ef_construction=self._ef_construction)
+            for node in range(len(ids)):
+                self._graph.add(self._storage, node)
+            if self.path is not None:
+                # Other instances reload the whole collection when they see the new generation:
+                self._generation += 1
+                self._save(snapshot=True)
+        logger.debug(
+            f"Compacted collection '{self.collection_name}', removed {removed} deleted documents"
+        )
+        return removed
+
+    def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
+        with self._lock:
+            self._refresh()
+            return [
+                self._document(self._id_to_node[id_])
+                for id_ in ids
+                if id_ in self._id_to_node
+            ]
+
+    def _document(self, node: int) -> Document:
+        return Document(
+            id=self._ids[node],
+            page_content=self._texts[node],
+            metadata=dict(self._metadatas[node]),
+        )
+
+    def _search(
+        self, query: np.ndarray, k: int, filter: Optional[dict]
+    ) -> List[Tuple[float, int]]:
+        """
+        Search the nearest live nodes that match the filter, returning (distance, node) tuples.
+        """
+        if self.dtype != "binary":
+            return self._search_candidates(query, k, filter)
+        # Rescore the hamming distance candidates with their int8 vectors:
+        candidates = self._search_candidates(query, k * self.rescore_multiplier, filter)
+        if not candidates:
+            return []
+        nodes = [node for _, node in candidates]
+        distances = 1 - self._storage.get(nodes) @ query
+        top = np.argsort(distances, kind="stable")[:k]
+        return [(float(distances[i]), nodes[i]) for i in top]
+
+    def _search_candidates(
+        self, query: np.ndarray, k: int, filter: Optional[dict]
+    ) -> List[Tuple[float, int]]:
+        count = len(self._ids)
+
+        def matches(node: int) -> bool:
+            return node not in self._deleted and match_filter(
+                self._metadatas[node], filter
+            )
+
+        if count > self.exact_search_threshold:
+            ef = max(self.ef_search, k)
+            while True:
+                hits = self._graph.search(self._storage, query, ef, ef)
+                results = [hit for hit in hits if matches(hit[1])]
+                if len(results) >= k or len(hits) < ef:
+                    return results[:k]
+                if ef >= count or (filter and ef >= 4 * self.ef_search):
+                    # A selective filter, search the matching nodes exactly:
+                    break
+                ef *= 2
+
+        nodes = [node for node in range(count) if matches(node)]
+        if not nodes:
+            return []
+        distances = self._storage.distances(nodes, query)
+        top = np.argsort(distances, kind="stable")[:k]
+        return [(float(distances[i]), nodes[i]) for i in top]
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+        **kwargs,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Search the documents nearest to an embedding.
+
+        :param embedding: The embedding to search with.
+        :param k:         The number of documents to return.
+        :param filter:    A metadata filter, see `match_filter`.
+
+        :return: A list of (document, cosine distance) tuples, nearest first.
+        """
+        with self._lock:
+            self._refresh()
+            if self._storage is None:
+                return []
+            query = self._normalize(embedding)
+            return [
+                (self._document(node), distance)
+                for distance, node in self._search(query, k, filter)
+            ]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            document
+            for document, _ in self.similarity_search_with_score_by_vector(
+                embedding, k, **kwargs
+            )
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(
+            self.embedding_function.embed_query(query), k, **kwargs
+        )
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            document
+            for document, _ in self.similarity_search_with_score(query, k, **kwargs)
+        ]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(embedding_function=embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -0,0 +1,218 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import hashlib
+import json
+import threading
+import time
+from typing import List, Optional
+
+from genai_factory.config import WorkflowServerConfig, get_vector_db
+from genai_factory.data.collection_registry import get_collection_registry
+from genai_factory.data.garbage_collection import iter_chunks
+from genai_factory.utils import logger
+
+
+class _Throttle:
+    """
+    Limit a rate of items per second, sleeping when it is exceeded.
+    """
+
+    def __init__(self, rate: Optional[float]):
+        self.rate = rate
+        self._start = time.monotonic()
+        self._count = 0
+
+    def wait(self, count: int):
+        self._count += count
+        if not self.rate:
+            return
+        ahead = self._count / self.rate - (time.monotonic() - self._start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+class EmbeddingsMigration:
+    """
+    Re-embed a collection with new embeddings into a shadow collection, and switch the collection to it once it is
+    complete. Queries keep using the current collection (and embeddings) while the migration runs, and switch to the
+    new one atomically with the collection registry (see `CollectionRegistry`), so there is no downtime.
+
+    The chunks are read from the current collection in batches, embedded in batches and written at up to
+    `max_chunks_per_second`, to leave capacity for the serving traffic. Chunks ingested while the migration runs are
+    written to both collections. The old collection is kept after the switch (its name is kept in the registry as
+    `previous_collection`) and can be dropped once the new one is verified.
+
+    Example:
+        migration = EmbeddingsMigration(config, "products", {"class_name": "huggingface", "model_name": "bge-small-en"})
+        migration.start()
+        ...
+        registry.get_migration("products")  # {"state": "running", "copied": 12800, ...}
+    """
+
+    def __init__(
+        self,
+        config: WorkflowServerConfig,
+        collection_name: str,
+        embeddings: dict,
+        vector_store_args: dict = None,
+        batch_size: int = 256,
+        max_chunks_per_second: Optional[float] = None,
+        progress_interval: float = 2.0,
+    ):
+        """
+        Initialize the migration.
+
+        :param config:                The workflows server configuration (`collection_registry_path` is required).
+        :param collection_name:       The collection to migrate.
+        :param embeddings:            The new embeddings arguments (as `WorkflowServerConfig.embeddings`).
+        :param vector_store_args:     The vector store arguments of the collection (None will use the config).
+        :param batch_size:            The number of chunks to read, embed and write together.
+        :param max_chunks_per_second: The maximal rate of chunks written to the new collection. Default is None (no
+                                      limit).
+        :param progress_interval:     The minimal interval in seconds between progress updates in the registry.
+
+        :raises ValueError: If no collection registry is configured.
+        """
+        self.registry = get_collection_registry(config)
+        if self.registry is None:
+            raise ValueError(
+                "Migrating collections requires `collection_registry_path` in the configuration"
+            )
+        self.config = config
+        self.collection_name = collection_name
+        self.embeddings = embeddings
+        self.vector_store_args = vector_store_args
+        self.batch_size = batch_size
+        self.max_chunks_per_second = max_chunks_per_second
+        self.progress_interval = progress_interval
+        digest = hashlib.sha256(
+            json.dumps(embeddings, sort_keys=True).encode()
+        ).hexdigest()
+        self.target_collection = f"{collection_name}__{digest[:8]}"
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> threading.Thread:
+        """
+        Run the migration in a background thread.
+
+        :return: The migration's thread.
+        """
+        self._thread = threading.Thread(
+            target=self.run, name=f"migrate-{self.collection_name}", daemon=True
+        )
+        self._thread.start()
+        return self._thread
+
+    def cancel(self):
+        """
+        Stop the migration after the batch it is writing. The collection is not switched.
+        """
+        self._stop.set()
+
+    def run(self) -> dict:
+        """
+        Run the migration: copy the collection's chunks to the new collection and switch to it.
+
+        :return: The final migration state.
+        """
+        current = self.registry.resolve(self.collection_name)["collection"]
+        if current == self.target_collection:
+            raise ValueError(
+                f"Collection '{self.collection_name}' is already embedded with these embeddings"
+            )
+        self.registry.update_migration(
+            self.collection_name,
+            source=current,
+            target=self.target_collection,
+            embeddings=self.embeddings,
+            state="running",
+            copied=0,
+            chunks_per_second=None,
+            started=datetime.datetime.utcnow().isoformat(),
+            finished=None,
+            error=None,
+        )
+        logger.info(
+            f"Migrating collection '{self.collection_name}' from '{current}' to '{self.target_collection}'"
+        )
+        start = time.monotonic()
+        copied = 0
+        try:
+            source = get_vector_db(
+                self.config, self.collection_name, self.vector_store_args
+            )
+            target = get_vector_db(
+                self.config,
+                self.target_collection,
+                self.vector_store_args,
+                embeddings_args=self.embeddings,
+                resolve=False,
+            )
+            throttle = _Throttle(self.max_chunks_per_second)
+            last_report = time.monotonic()
+            ids: List[str] = []
+            texts: List[str] = []
+            metadatas: List[dict] = []
+            chunks = iter_chunks(source, self.batch_size, with_text=True)
+            for id_, metadata, text in chunks:
+                ids.append(id_)
+                texts.append(text)
+                metadatas.append(metadata)
+                if len(ids) < self.batch_size:
+                    continue
+                # The ids are kept, so chunks that are also written by ingestions are not duplicated:
+                target.add_texts(texts, metadatas, ids=ids)
+                copied += len(ids)
+                ids, texts, metadatas = [], [], []
+                throttle.wait(self.batch_size)
+                if self._stop.is_set():
+                    raise InterruptedError("The migration was cancelled")
+                if time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    self.registry.update_migration(
+                        self.collection_name,
+                        copied=copied,
+                        chunks_per_second=round(copied / (last_report - start), 2),
+                    )
+            if ids:
+                target.add_texts(texts, metadatas, ids=ids)
+                copied += len(ids)
+        except Exception as e:
+            state = "cancelled" if isinstance(e, InterruptedError) else "failed"
+            logger.error(
+                f"Migration of collection '{self.collection_name}' {state}: {e}"
+            )
+            self.registry.update_migration(
+                self.collection_name,
+                state=state,
+                copied=copied,
+                error=str(e),
+                finished=datetime.datetime.utcnow().isoformat(),
+            )
+            return self.registry.get_migration(self.collection_name)
+
+        elapsed = time.monotonic() - start
+        self.registry.update_migration(
+            self.collection_name,
+            copied=copied,
+            chunks_per_second=round(copied / elapsed, 2) if elapsed else None,
+            finished=datetime.datetime.utcnow().isoformat(),
+        )
+        self.registry.switch(
+            self.collection_name, self.target_collection, self.embeddings
+        )
+        return self.registry.get_migration(self.collection_name)
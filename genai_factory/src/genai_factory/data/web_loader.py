@@ -12,29 +12,171 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import json
+import os
+import queue
+import threading
+import uuid
+from typing import Dict, List, Optional
 from urllib.parse import urlparse
 
 import requests
 from bs4 import BeautifulSoup
 from langchain_core.documents import Document
 
+from genai_factory.utils import logger
+
+# Marks the end of an asynchronous crawl in the pages queue:
+_DONE = object()
+
+
+class _ValidatorsCache:
+    """
+    The ETag and Last-Modified headers of crawled pages and the ids of the chunks loaded from them, by scope and url,
+    persisted in a JSON file between runs so unchanged pages can be skipped with conditional requests and the previous
+    chunks of changed pages can be replaced. A scope is where the pages were loaded into (such as a data source), so
+    pages loaded in one scope are not skipped in another.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._validators: Dict[str, Dict[str, dict]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                # Files written before the headers were scoped are not used:
+                self._validators = json.load(f).get("scopes", {})
+
+    def request_headers(self, scope: str, url: str) -> dict:
+        validators = self._validators.get(scope, {}).get(url, {})
+        headers = {}
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last_modified" in validators:
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    def chunk_ids(self, scope: str, url: str) -> List[str]:
+        return self._validators.get(scope, {}).get(url, {}).get("chunk_ids", [])
+
+    def update(self, scope: str, url: str, response_headers, chunk_ids: List[str]):
+        validators = {}
+        if response_headers.get("ETag"):
+            validators["etag"] = response_headers["ETag"]
+        if response_headers.get("Last-Modified"):
+            validators["last_modified"] = response_headers["Last-Modified"]
+        if chunk_ids:
+            validators["chunk_ids"] = chunk_ids
+        with self._lock:
+            if validators:
+                self._validators.setdefault(scope, {})[url] = validators
+            else:
+                self._validators.get(scope, {}).pop(url, None)
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with self._lock:
+            with open(tmp_path, "w") as f:
+                json.dump({"scopes": self._validators}, f)
+        os.replace(tmp_path, self.path)
+
 
 class SmartWebLoader:
+    """
+    Load FAQ pages (accordion titles and answers) as chunked documents.
+
+    Pages are fetched with a shared connection pool. With `crawl_async=True` they are fetched concurrently with
+    `aiohttp` (up to `concurrency` requests, and `per_host_concurrency` per host) and parsed as they arrive. When a
+    `cache_path` is given, the ETag and Last-Modified headers of the pages and the ids of their chunks are kept in it
+    by `cache_scope`. An `incremental` refresh skips the pages that did not change since they were last loaded in the
+    same scope, and lists the previous chunks of the changed pages in `replaced_ids`, to delete once the new chunks are
+    written (`DataLoader.load` does it).
+
+    Example:
+        loader = SmartWebLoader(
+            urls,
+            crawl_async=True,
+            cache_path="/data/crawl-cache.json",
+            cache_scope="faq",
+            incremental=True,
+            parser="lxml",
+        )
+        for chunk in loader.lazy_load():
+            ...
+    """
+
     chunked = True
 
-    def __init__(self, urls: list, **kwargs):
+    def __init__(
+        self,
+        urls: list,
+        crawl_async: bool = False,
+        concurrency: int = 32,
+        per_host_concurrency: int = 8,
+        timeout: float = 30.0,
+        cache_path: Optional[str] = None,
+        cache_scope: Optional[str] = None,
+        incremental: bool = False,
+        parser: str = "html.parser",
+        **kwargs,
+    ):
+        """
+        Initialize the loader.
+
+        :param urls:                 The urls of the pages to load.
+        :param crawl_async:          Whether to fetch the pages concurrently with `aiohttp`.
+        :param concurrency:          The maximum number of concurrent requests in async mode.
+        :param per_host_concurrency: The maximum number of concurrent requests to a single host in async mode.
+        :param timeout:              The timeout of each request in seconds.
+        :param cache_path:           A JSON file to keep the pages' ETag and Last-Modified headers in between runs.
+                                     Default is None (no headers are kept).
+        :param cache_scope:          The scope of the kept headers and chunk ids, such as the data source the pages are
+                                     ingested into. Default is None (`DataLoader.load` sets it to the collection).
+        :param incremental:          Whether to skip the pages that did not change since they were last loaded in the
+                                     same scope, and replace the previous chunks of the changed ones. The chunks of
+                                     skipped pages are not loaded again, so only use it to refresh pages whose previous
+                                     chunks are kept. Default is False (all the pages are loaded, and their headers and
+                                     chunk ids are kept for a later incremental refresh).
+        :param parser:               The BeautifulSoup parser, "lxml" is considerably faster than the default
+                                     "html.parser" (requires the `lxml` package).
+        """
         if isinstance(urls, str):
             urls = [urls]
         self.urls = urls
+        self.crawl_async = crawl_async
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.timeout = timeout
+        self.parser = parser
+        self.cache_scope = cache_scope
+        self.incremental = incremental
+        # The ids of the previous chunks of the pages an incremental refresh loaded again:
+        self.replaced_ids: List[str] = []
+        self._cache = _ValidatorsCache(cache_path)
+        if parser == "lxml":
+            try:
+                import lxml  # noqa: F401
+            except ImportError:
+                logger.warning(
+                    "The `lxml` package is not installed, using the 'html.parser' parser"
+                )
+                self.parser = "html.parser"
 
-    def _parse_page(self, url: str) -> Document:
+    def _request_headers(self, url: str) -> dict:
+        if not self.incremental:
+            return {}
+        return self._cache.request_headers(self.cache_scope or "", url)
+
+    def _parse_page(self, url: str, content: bytes) -> List[Document]:
         # Get url parts:
         parsed_url = urlparse(url)
         url_parts = parsed_url.path.rsplit("/", 4)
 
-        # Get html from web url:
-        page = requests.get(url)
-        soup = BeautifulSoup(page.content, "html.parser")
+        soup = BeautifulSoup(content, self.parser)
 
         # Get titles:
         titles_span = soup.find_all("span", class_="cmp-accordion__title")
@@ -67,8 +209,134 @@ class SmartWebLoader:
 
         return chunks
 
-    def load(self):
-        docs = []
+    def _fetch_pages(self):
+        """
+        Fetch the pages one by one with a shared session, yielding (url, content, headers) of the changed pages.
+        """
+        with requests.Session() as session:
+            for url in self.urls:
+                try:
+                    response = session.get(
+                        url,
+                        headers=self._request_headers(url),
+                        timeout=self.timeout,
+                    )
+                except requests.RequestException as e:
+                    logger.warning(f"Failed to fetch '{url}': {e}")
+                    continue
+                if response.status_code == 304:
+                    logger.debug(f"Skipping unchanged page '{url}'")
+                    continue
+                if response.status_code >= 400:
+                    logger.warning(
+                        f"Failed to fetch '{url}': HTTP {response.status_code}"
+                    )
+                    continue
+                yield url, response.content, response.headers
+
+    async def _crawl(self, pages: queue.Queue, stopped: threading.Event):
+        """
+        Fetch the pages concurrently, putting (url, content, headers) of the changed pages in the queue. Stops taking
+        new urls once `stopped` is set.
+        """
+        try:
+            import aiohttp
+        except ImportError as e:
+            raise ImportError(
+                "Async crawling requires the `aiohttp` package, install it with `pip install aiohttp`"
+            ) from e
+
+        urls = asyncio.Queue()
         for url in self.urls:
-            docs.extend(self._parse_page(url))
-        return docs
+            urls.put_nowait(url)
+        host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+        async def fetch(session, url: str) -> Optional[tuple]:
+            host = urlparse(url).netloc
+            semaphore = host_semaphores.setdefault(
+                host, asyncio.Semaphore(self.per_host_concurrency)
+            )
+            async with semaphore:
+                async with session.get(
+                    url, headers=self._request_headers(url)
+                ) as response:
+                    if response.status == 304:
+                        logger.debug(f"Skipping unchanged page '{url}'")
+                        return None
+                    if response.status >= 400:
+                        logger.warning(
+                            f"Failed to fetch '{url}': HTTP {response.status}"
+                        )
+                        return None
+                    return url, await response.read(), response.headers
+
+        async def worker(session):
+            while not urls.empty() and not stopped.is_set():
+                url = urls.get_nowait()
+                try:
+                    page = await fetch(session, url)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning(f"Failed to fetch '{url}': {e}")
+                    continue
+                if page:
+                    # Blocks while the consumer is behind, bounding the pages held in memory:
+                    await asyncio.to_thread(pages.put, page)
+
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency, limit_per_host=self.per_host_concurrency
+        )
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+        ) as session:
+            await asyncio.gather(
+                *[worker(session) for _ in range(min(self.concurrency, len(self.urls)))]
+            )
+
+    def _fetch_pages_async(self):
+        """
+        Run the async crawl in a background thread (so it works also when the caller runs an event loop), yielding
+        (url, content, headers) of the changed pages as they arrive.
+        """
+        pages = queue.Queue(maxsize=self.concurrency * 2)
+        stopped = threading.Event()
+        errors = []
+
+        def crawl():
+            try:
+                asyncio.run(self._crawl(pages, stopped))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                pages.put(_DONE)
+
+        thread = threading.Thread(target=crawl, daemon=True)
+        thread.start()
+        try:
+            while (page := pages.get()) is not _DONE:
+                yield page
+        finally:
+            # When the consumer stops early, let the crawl finish its in-flight requests and drain the queue:
+            stopped.set()
+            while page is not _DONE:
+                page = pages.get()
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def lazy_load(self):
+        scope = self.cache_scope or ""
+        self.replaced_ids = []
+        pages = self._fetch_pages_async() if self.crawl_async else self._fetch_pages()
+        for url, content, headers in pages:
+            chunks = self._parse_page(url, content)
+            for chunk in chunks:
+                chunk.id = uuid.uuid4().hex
+            yield from chunks
+            if self.incremental:
+                self.replaced_ids.extend(self._cache.chunk_ids(scope, url))
+            self._cache.update(scope, url, headers, [chunk.id for chunk in chunks])
+        # Saved only once all the pages were consumed, so pages of a failed run are loaded again on the next one:
+        self._cache.save()
+
+    def load(self):
+        return list(self.lazy_load())
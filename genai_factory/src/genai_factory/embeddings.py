@@ -0,0 +1,260 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from genai_factory.telemetry import record_cache_lookup
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text for embedding cache keys: unicode normalization (NFC) and collapsed whitespace.
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wrap an embeddings model with a bounded in-memory LRU cache and an optional on-disk (SQLite) cache, keyed by the
+    model name, the model's arguments (`namespace`) and the normalized text. Only cache misses are sent to the
+    model, so repeated queries (and the same refined query embedded by several steps) are embedded once. Vectors are
+    kept as float32 arrays (4 bytes per dimension). Document embeddings are mostly computed once per ingestion and
+    would only evict the queries from the cache, so they are cached only when `cache_documents` is set (typically
+    together with a `path`, so re-ingesting unchanged documents does not embed them again).
+
+    Hits and misses are exported as the `genai_factory_cache_requests_total{cache="embeddings"}` metric and are
+    available from `stats`.
+
+    Example:
+        embeddings = CachedEmbeddings(HuggingFaceEmbeddings(), max_size=10000, path="/data/embeddings-cache.db")
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_size: int = 10000,
+        path: Optional[str] = None,
+        model_name: Optional[str] = None,
+        namespace: Optional[str] = None,
+        cache_documents: bool = False,
+    ):
+        """
+        Initialize the embeddings cache.
+
+        :param embeddings: The embeddings model to cache.
+        :param max_size:   The maximum number of embeddings to keep in memory.
+        :param path:       A SQLite file to persist the embeddings in between runs. Default is None (memory only).
+        :param model_name: The model name for the cache keys. Default is the model's `model_name` or `model`
+                           attribute, or its class name.
+        :param namespace:  An identifier of the model's arguments (such as a hash of them), so models with the same
+                           name but different outputs (dimensions, normalization) do not share cached vectors.
+        :param cache_documents: Whether to cache the `embed_documents` results too. Default is False (queries only).
+        """
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.model_name = (
+            model_name
+            or getattr(embeddings, "model_name", None)
+            or getattr(embeddings, "model", None)
+            or type(embeddings).__name__
+        )
+        self.namespace = namespace or ""
+        self.cache_documents = cache_documents
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+            )
+            self._db.commit()
+
+    def __getattr__(self, name: str):
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def _key(self, text: str, kind: str) -> str:
+        # Queries and documents are cached apart, as some models embed them differently (instructions, prefixes):
+        return hashlib.sha256(
+            f"{self.model_name}\0{self.namespace}\0{kind}\0{normalize_text(text)}".encode(
+                "utf-8"
+            )
+        ).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    found[key] = self._cache[key]
+            missing = [key for key in keys if key not in found]
+            if self._db is not None and missing:
+                placeholders = ",".join("?" * len(missing))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    missing,
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+                    self._put(key, found[key])
+        return found
+
+    def _put(self, key: str, vector: np.ndarray):
+        self._cache[key] = vector
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def _store(self, vectors: Dict[str, List[float]]):
+        with self._lock:
+            arrays = {
+                key: np.asarray(vector, dtype=np.float32)
+                for key, vector in vectors.items()
+            }
+            for key, array in arrays.items():
+                self._put(key, array)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, array.tobytes()) for key, array in arrays.items()],
+                )
+                self._db.commit()
+
+    def _record(self, hits: int, misses: int):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+        record_cache_lookup("embeddings", hit=True, count=hits)
+        record_cache_lookup("embeddings", hit=False, count=misses)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not self.cache_documents:
+            return self.embeddings.embed_documents(texts)
+        keys = [self._key(text, "document") for text in texts]
+        found = {
+            key: vector.tolist()
+            for key, vector in self._lookup(list(dict.fromkeys(keys))).items()
+        }
+        # Embed every missing text once, even if it repeats in the batch:
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        self._record(hits=len(texts) - len(missing), misses=len(missing))
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), vectors))
+            self._store(new_vectors)
+            found.update(new_vectors)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text, "query")
+        found = self._lookup([key])
+        self._record(hits=len(found), misses=1 - len(found))
+        if found:
+            return found[key].tolist()
+        vector = self.embeddings.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def stats(self) -> dict:
+        """
+        Get the cache statistics.
+
+        :return: A dictionary with the number of hits, misses, the hit ratio and the number of cached embeddings in
+                 memory.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self._cache),
+            }
+
+
+def truncate_embeddings(vectors, dimensions: Optional[int]) -> np.ndarray:
+    """
+    Truncate embeddings to their first dimensions and normalize them again (Matryoshka representation).
+
+    :param vectors:    The embeddings, a vector or a list of vectors.
+    :param dimensions: The number of dimensions to keep (None keeps all of them).
+
+    :return: The truncated and normalized embeddings.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)[..., :dimensions]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class TruncatedEmbeddings(Embeddings):
+    """
+    Wrap an embeddings model trained with Matryoshka representation learning (for example `nomic-embed-text-v1.5`,
+    `mxbai-embed-large-v1` or OpenAI's `text-embedding-3-*`), keeping only the first dimensions of its embeddings.
+    The leading dimensions of such models carry most of the information, so the vectors shrink (and search faster)
+    at a small loss of recall. Measure it with `python -m genai_factory.benchmarks.embeddings_recall`.
+
+    Enable it with `truncate_dim` in the embeddings configuration::
+
+        embeddings:
+          class_name: huggingface
+          model_name: nomic-ai/nomic-embed-text-v1.5
+          truncate_dim: 256
+    """
+
+    def __init__(self, embeddings: Embeddings, dimensions: int):
+        """
+        Initialize the truncated embeddings.
+
+        :param embeddings: The embeddings model to truncate.
+        :param dimensions: The number of dimensions to keep.
+        """
+        if dimensions <= 0:
+            raise ValueError(f"dimensions must be positive (got {dimensions})")
+        self.embeddings = embeddings
+        self.dimensions = dimensions
+
+    def __getattr__(self, name: str):
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.embeddings.embed_documents(texts)
+        if not vectors:
+            return []
+        return truncate_embeddings(vectors, self.dimensions).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return truncate_embeddings(
+            self.embeddings.embed_query(text), self.dimensions
+        ).tolist()
@@ -0,0 +1,267 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import hashlib
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
+
+from genai_factory.config import WorkflowServerConfig
+from genai_factory.controller_client import ControllerClient
+from genai_factory.data.doc_loader import get_data_loader, get_loader_obj
+from genai_factory.schemas import IngestionJob, JobStatus
+from genai_factory.utils import logger
+
+# The maximum number of errors kept in a job (the rest are only counted):
+MAX_JOB_ERRORS = 100
+
+
+class JobCancelledError(Exception):
+    """
+    Raised inside a running job once its cancellation was requested.
+    """
+
+    pass
+
+
+class _JobProgress:
+    """
+    The progress of a running job, reported to the controller at most every `interval` seconds.
+    """
+
+    def __init__(
+        self, job: IngestionJob, controller_client: ControllerClient, interval: float
+    ):
+        self.job = job
+        self._client = controller_client
+        self._interval = interval
+        self._start = time.monotonic()
+        self._last_report = 0.0
+
+    def add_chunks(self, count: int):
+        self.job.chunks += count
+        self.report()
+
+    def add_error(self, error: str):
+        if len(self.job.errors) < MAX_JOB_ERRORS:
+            self.job.errors.append(error)
+
+    def report(self, force: bool = False):
+        """
+        Report the progress to the controller.
+
+        :raises JobCancelledError: If the job's cancellation was requested.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_report < self._interval:
+            return
+        self._last_report = now
+        elapsed = now - self._start
+        self.job.chunks_per_second = (
+            round(self.job.chunks / elapsed, 2) if elapsed else None
+        )
+        try:
+            status = self._client.update_ingestion_job(self.job).status
+        except Exception as e:
+            # A temporarily unreachable controller should not fail the ingestion:
+            logger.warning(f"Failed to report the progress of job {self.job.uid}: {e}")
+            return
+        if status == JobStatus.CANCELLING and not self.job.status.is_terminal():
+            raise JobCancelledError(f"Job {self.job.uid} was cancelled")
+
+
+class IngestionJobRunner:
+    """
+    Run ingestion jobs on a pool of worker threads. Each job loads its files one after the other and reports its
+    progress (files, chunks, errors and throughput) to the controller, where it is persisted and can be queried. A job
+    whose cancellation was requested in the controller stops after the chunks batch it is writing.
+
+    Example:
+        runner = IngestionJobRunner(config, controller_client)
+        runner.submit(job_id, "my-data-source", loader="web", paths=["https://milvus.io/docs/overview.md"])
+    """
+
+    def __init__(
+        self,
+        config: WorkflowServerConfig,
+        controller_client: ControllerClient,
+    ):
+        """
+        Initialize the runner.
+
+        :param config:            The workflows server configuration (`ingestion_workers` and
+                                  `ingestion_progress_interval` configure the runner).
+        :param controller_client: The controller client to report the jobs' progress with.
+        """
+        self._config = config
+        self._client = controller_client
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.ingestion_workers, thread_name_prefix="ingestion"
+        )
+
+    def submit(
+        self,
+        job_id: str,
+        data_source_name: str,
+        loader: str,
+        paths: List[str],
+        database_kwargs: dict = None,
+        metadata: dict = None,
+        version: str = None,
+        doc_uid: str = None,
+    ) -> Future:
+        """
+        Submit an ingestion job to run in the background.
+
+        :param job_id:           The UID of the job in the controller.
+        :param data_source_name: The name of the data source to ingest into.
+        :param loader:           The data loader type to use.
+        :param paths:            The paths of the documents to ingest.
+        :param database_kwargs:  The vector store arguments of the data source.
+        :param metadata:         The metadata to attach to the documents.
+        :param version:          The version of the documents.
+        :param doc_uid:          The controller's document uid to mark the chunks with.
+
+        :return: The job's future.
+        """
+        logger.debug(f"Submitting ingestion job {job_id} ({len(paths)} files)")
+        return self._executor.submit(
+            self._run,
+            job_id,
+            data_source_name,
+            loader,
+            paths,
+            database_kwargs,
+            metadata,
+            version,
+            doc_uid,
+        )
+
+    def _run(
+        self,
+        job_id: str,
+        data_source_name: str,
+        loader: str,
+        paths: List[str],
+        database_kwargs: dict,
+        metadata: dict,
+        version: str,
+        doc_uid: str,
+    ):
+        job = progress = None
+        stats = {"chunks": 0, "tokens": 0, "embedding_time_s": 0.0}
+        content_hash = hashlib.sha256()
+        try:
+            job = self._client.get_ingestion_job(job_id)
+            progress = _JobProgress(
+                job, self._client, self._config.ingestion_progress_interval
+            )
+            job.status = JobStatus.RUNNING
+            job.started = datetime.datetime.utcnow().isoformat()
+            job.total_files = len(paths)
+            progress.report(force=True)
+            data_loader = get_data_loader(
+                config=self._config,
+                data_source_name=data_source_name,
+                database_kwargs=database_kwargs,
+            )
+            for path in paths:
+                try:
+                    loader_obj = get_loader_obj(path, loader_type=loader)
+                    file_stats = data_loader.load(
+                        loader_obj,
+                        metadata=metadata,
+                        version=version,
+                        on_batch=progress.add_chunks,
+                        doc_uid=doc_uid,
+                    )
+                    for key in ["chunks", "tokens", "embedding_time_s"]:
+                        stats[key] += file_stats[key]
+                    content_hash.update(file_stats["content_hash"].encode())
+                    job.processed_files += 1
+                except JobCancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Job {job_id} failed to ingest '{path}': {e}")
+                    job.failed_files += 1
+                    progress.add_error(f"{path}: {e}")
+                progress.report()
+            job.status = (
+                JobStatus.FAILED
+                if paths and job.failed_files == len(paths)
+                else JobStatus.COMPLETED
+            )
+        except JobCancelledError:
+            job.status = JobStatus.CANCELLED
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            if progress is None:
+                # Failed before the job started (for example, the controller was unreachable):
+                self._fail_job(job_id, str(e))
+                return
+            job.status = JobStatus.FAILED
+            progress.add_error(str(e))
+        finally:
+            if progress is not None:
+                job.finished = datetime.datetime.utcnow().isoformat()
+                progress.report(force=True)
+        if doc_uid and job.processed_files:
+            stats["embedding_time_s"] = round(stats["embedding_time_s"], 3)
+            stats["content_hash"] = content_hash.hexdigest()
+            self._report_document_stats(data_source_name, doc_uid, version, job, stats)
+        logger.info(
+            f"Job {job_id} {job.status.value}: {job.processed_files}/{job.total_files} files, {job.chunks} chunks"
+        )
+
+    def _fail_job(self, job_id: str, error: str):
+        """
+        Mark a job that failed before it started as failed, so it is not left pending.
+        """
+        try:
+            job = self._client.get_ingestion_job(job_id)
+            job.status = JobStatus.FAILED
+            job.finished = datetime.datetime.utcnow().isoformat()
+            job.errors.append(error)
+            self._client.update_ingestion_job(job)
+        except Exception as e:
+            logger.error(f"Failed to mark job {job_id} as failed: {e}")
+
+    def _report_document_stats(
+        self,
+        data_source_name: str,
+        doc_uid: str,
+        version: str,
+        job: IngestionJob,
+        stats: dict,
+    ):
+        """
+        Record the chunk statistics of the ingested document in the controller (in the document's association with
+        the data source).
+        """
+        stats["job_id"] = job.uid
+        stats["ingested"] = job.finished
+        try:
+            self._client.update_data_source_documents(
+                data_source_name,
+                [
+                    {
+                        "document_id": doc_uid,
+                        "document_version": version or "",
+                        "extra_data": stats,
+                    }
+                ],
+            )
+        except Exception as e:
+            logger.warning(f"Failed to record the statistics of job {job.uid}: {e}")
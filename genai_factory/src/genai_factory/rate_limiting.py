@@ -0,0 +1,487 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from genai_factory.telemetry import (
+    RATE_LIMIT_CONCURRENCY,
+    RATE_LIMIT_WAIT,
+    RATE_LIMITED_REQUESTS,
+)
+from genai_factory.utils import logger
+
+# The longest a waiting caller sleeps before checking again for a free slot:
+_POLL_INTERVAL = 0.05
+
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at a rate per minute, holding at most `burst_seconds` worth of tokens.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Get the seconds until the bucket holds the amount (0 if it does now).
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(amount - self.tokens, 0.0) / self.rate
+
+    def take(self, amount: float):
+        """
+        Take tokens from the bucket. The bucket may go negative, when more tokens were used than estimated.
+        """
+        self._refill()
+        self.tokens -= amount
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    Check whether an error is a provider rate limit (HTTP 429) error, such as `openai.RateLimitError`.
+    """
+    if type(error).__name__ == "RateLimitError":
+        return True
+    status_code = getattr(error, "status_code", None) or getattr(
+        getattr(error, "response", None), "status_code", None
+    )
+    return status_code == 429
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Limit the requests sent to an LLM provider to its rate limits, queueing the callers instead of failing them.
+
+    A request waits until the request bucket (`requests_per_minute`) and the token bucket (`tokens_per_minute`, taken
+    by the estimated tokens of the request and corrected by the actual usage once it is known) allow it, and until
+    there is a free concurrency slot. The concurrency limit adapts to the provider (additive increase, multiplicative
+    decrease): it grows by one slot per round of successful requests and is halved on every rate limit (429) response,
+    or reduced when requests are slower than `latency_target_s`. Rate limited requests are retried after the
+    provider's `Retry-After` (or an exponential backoff), and all the callers pause until then, so a burst does not
+    turn into a cascade of retries.
+
+    Limiters are shared by name in the process (see `get_rate_limiter`), so every client of the same provider account
+    and model counts against the same limits.
+
+    The limiter is exported as the `genai_factory_rate_limit*` metrics.
+    """
+
+    def __init__(
+        self,
+        name: str = "default",
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: int = 32,
+        min_concurrency: int = 1,
+        latency_target_s: Optional[float] = None,
+        burst_seconds: float = 10.0,
+        max_retries: int = 6,
+        backoff_s: float = 1.0,
+        max_backoff_s: float = 60.0,
+        max_wait_s: Optional[float] = None,
+    ):
+        """
+        Initialize the rate limiter.
+
+        :param name:                The name of the limiter, used for logs and metrics.
+        :param requests_per_minute: The provider's requests per minute limit. Default is None (no limit).
+        :param tokens_per_minute:   The provider's tokens per minute limit. Default is None (no limit).
+        :param max_concurrency:     The maximum number of concurrent requests (the concurrency starts there).
+        :param min_concurrency:     The minimum number of concurrent requests the limit is reduced to.
+        :param latency_target_s:    A request latency above which the concurrency is reduced. Default is None (only
+                                    rate limit responses reduce it).
+        :param burst_seconds:       The seconds of requests and tokens that may be sent in a burst.
+        :param max_retries:         The maximum number of retries of a rate limited request.
+        :param backoff_s:           The first backoff of a rate limited request without `Retry-After`, doubled on
+                                    every retry.
+        :param max_backoff_s:       The maximum backoff of a rate limited request.
+        :param max_wait_s:          The maximum time in seconds a request waits to be sent. Default is None (wait as
+                                    long as needed).
+        """
+        if min_concurrency < 1 or max_concurrency < min_concurrency:
+            raise ValueError(
+                f"Expected 1 <= min_concurrency <= max_concurrency (got {min_concurrency} and {max_concurrency})"
+            )
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target_s = latency_target_s
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.max_wait_s = max_wait_s
+        self.concurrency = float(max_concurrency)
+        self._requests = (
+            TokenBucket(requests_per_minute, burst_seconds)
+            if requests_per_minute
+            else None
+        )
+        self._tokens = (
+            TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        )
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._lock = threading.Condition()
+        RATE_LIMIT_CONCURRENCY.labels(limiter=name).set(self.concurrency)
+
+    def stats(self) -> dict:
+        """
+        Get the current limiter state.
+
+        :return: A dictionary with the concurrency limit, the requests in flight and the seconds left to pause.
+        """
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "in_flight": self._in_flight,
+                "paused_s": max(self._paused_until - time.monotonic(), 0.0),
+            }
+
+    def _try_acquire(self, tokens: float) -> float:
+        """
+        Take a slot and the request's tokens if they are available.
+
+        :return: 0 if the request may be sent, otherwise the seconds to wait before trying again.
+        """
+        with self._lock:
+            wait = self._paused_until - time.monotonic()
+            if self._in_flight >= int(self.concurrency):
+                wait = max(wait, _POLL_INTERVAL)
+            if self._requests is not None:
+                wait = max(wait, self._requests.wait_time(1))
+            if self._tokens is not None and tokens:
+                wait = max(wait, self._tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            self._in_flight += 1
+            if self._requests is not None:
+                self._requests.take(1)
+            if self._tokens is not None:
+                self._tokens.take(tokens)
+            return 0.0
+
+    def _check_wait(self, start: float, wait: float) -> float:
+        if (
+            self.max_wait_s is not None
+            and time.monotonic() - start + wait > self.max_wait_s
+        ):
+            raise TimeoutError(
+                f"Rate limiter '{self.name}' could not send the request within {self.max_wait_s} seconds"
+            )
+        return min(wait, 1.0)
+
+    def acquire(self, tokens: float = 0):
+        """
+        Wait until the request may be sent, blocking the calling thread.
+
+        :param tokens: The estimated tokens of the request.
+        """
+        start = time.monotonic()
+        while wait := self._try_acquire(tokens):
+            wait = self._check_wait(start, wait)
+            with self._lock:
+                # Woken up early when a slot is released:
+                self._lock.wait(wait)
+        RATE_LIMIT_WAIT.labels(limiter=self.name).observe(time.monotonic() - start)
+
+    async def aacquire(self, tokens: float = 0):
+        """
+        Wait until the request may be sent, without blocking the event loop.
+
+        :param tokens: The estimated tokens of the request.
+        """
+        start = time.monotonic()
+        while wait := self._try_acquire(tokens):
+            await asyncio.sleep(min(self._check_wait(start, wait), _POLL_INTERVAL * 4))
+        RATE_LIMIT_WAIT.labels(limiter=self.name).observe(time.monotonic() - start)
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        rate_limited: bool = False,
+        retry_after: Optional[float] = None,
+        estimated_tokens: float = 0,
+        used_tokens: Optional[float] = None,
+    ):
+        """
+        Release the request's slot and adapt the concurrency limit to its outcome.
+
+        :param latency:          The request's latency in seconds, if it completed.
+        :param rate_limited:     Whether the provider rejected the request with a rate limit error.
+        :param retry_after:      The seconds the provider asked to wait before retrying.
+        :param estimated_tokens: The tokens taken for the request.
+        :param used_tokens:      The tokens the request actually used, if known.
+        """
+        with self._lock:
+            self._in_flight -= 1
+            if rate_limited:
+                self.concurrency = max(self.concurrency / 2, self.min_concurrency)
+                if retry_after:
+                    self._paused_until = max(
+                        self._paused_until, time.monotonic() + retry_after
+                    )
+                RATE_LIMITED_REQUESTS.labels(limiter=self.name).inc()
+            elif latency is not None:
+                if self.latency_target_s and latency > self.latency_target_s:
+                    self.concurrency = max(self.concurrency * 0.9, self.min_concurrency)
+                else:
+                    # About one more slot per round of requests at the current concurrency:
+                    self.concurrency = min(
+                        self.concurrency + 1 / self.concurrency, self.max_concurrency
+                    )
+            if self._tokens is not None and used_tokens is not None:
+                # Correct the estimate with the actual usage:
+                self._tokens.take(used_tokens - estimated_tokens)
+            RATE_LIMIT_CONCURRENCY.labels(limiter=self.name).set(self.concurrency)
+            self._lock.notify_all()
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        retry_after = _retry_after(error)
+        backoff = min(self.backoff_s * 2**attempt, self.max_backoff_s)
+        if retry_after is not None:
+            backoff = max(backoff, retry_after)
+        logger.warning(
+            f"Rate limiter '{self.name}': rate limited by the provider, retrying in {backoff:.1f} seconds"
+        )
+        return backoff
+
+    def call(
+        self,
+        fn: Callable[[], Any],
+        tokens: float = 0,
+        usage: Callable[[Any], Optional[float]] = None,
+    ):
+        """
+        Call a function that sends a request, once the limits allow it, retrying it while it is rate limited.
+
+        :param fn:     The function to call.
+        :param tokens: The estimated tokens of the request.
+        :param usage:  A function that gets the actual tokens used from the function's result.
+
+        :return: The function's result.
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            start = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    self.release(estimated_tokens=tokens, used_tokens=0)
+                    raise
+                backoff = self._backoff(attempt, e)
+                self.release(rate_limited=True, retry_after=backoff)
+                attempt += 1
+                continue
+            self.release(
+                latency=time.monotonic() - start,
+                estimated_tokens=tokens,
+                used_tokens=usage(result) if usage else None,
+            )
+            return result
+
+    async def acall(
+        self,
+        fn: Callable[[], Any],
+        tokens: float = 0,
+        usage: Callable[[Any], Optional[float]] = None,
+    ):
+        """
+        Await a coroutine function that sends a request, see `call`.
+        """
+        attempt = 0
+        while True:
+            await self.aacquire(tokens)
+            start = time.monotonic()
+            try:
+                result = await fn()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    self.release(estimated_tokens=tokens, used_tokens=0)
+                    raise
+                backoff = self._backoff(attempt, e)
+                self.release(rate_limited=True, retry_after=backoff)
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled, the request may or may not have been sent:
+                self.release()
+                raise
+            self.release(
+                latency=time.monotonic() - start,
+                estimated_tokens=tokens,
+                used_tokens=usage(result) if usage else None,
+            )
+            return result
+
+
+# Rate limiters by name (with the arguments they were created with), shared by all the clients of the process:
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_kwargs: Dict[str, dict] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str = "default", **kwargs) -> RateLimiter:
+    """
+    Get the shared rate limiter of a name, creating it with the given arguments on first use. Later calls get the
+    existing limiter, and a warning is logged if they give different arguments (which are ignored).
+
+    :param name:   The name of the limiter, usually the provider account and model the limits apply to.
+    :param kwargs: The `RateLimiter` arguments.
+
+    :return: The shared rate limiter.
+    """
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            _rate_limiters[name] = RateLimiter(name=name, **kwargs)
+            _rate_limiters_kwargs[name] = kwargs
+        elif kwargs and kwargs != _rate_limiters_kwargs[name]:
+            logger.warning(
+                f"Rate limiter '{name}' was created with {_rate_limiters_kwargs[name]}, ignoring {kwargs} "
+                f"(give differently limited clients different limiter names)"
+            )
+        return _rate_limiters[name]
+
+
+def get_llm_limiter_name(llm) -> str:
+    """
+    Get the default rate limiter name of a language model, its class and model name (for example
+    "ChatOpenAI:gpt-4o-mini"), so all the clients of the same model share a limiter.
+
+    :param llm: The language model.
+
+    :return: The rate limiter name.
+    """
+    name = type(llm).__name__
+    model_name = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+    return f"{name}:{model_name}" if model_name else name
+
+
+def _input_text(input) -> str:
+    if isinstance(input, str):
+        return input
+    if hasattr(input, "to_string"):
+        # A prompt value:
+        return input.to_string()
+    if isinstance(input, (list, tuple)):
+        return "\n".join(str(getattr(message, "content", message)) for message in input)
+    return str(input)
+
+
+def _used_tokens(output) -> Optional[float]:
+    usage = getattr(output, "usage_metadata", None)
+    if usage and usage.get("total_tokens"):
+        return usage["total_tokens"]
+    token_usage = (getattr(output, "response_metadata", None) or {}).get(
+        "token_usage"
+    ) or {}
+    return token_usage.get("total_tokens")
+
+
+class RateLimitedLLM(Runnable):
+    """
+    Wrap a language model so its calls go through a shared `RateLimiter`. The tokens of a call are estimated from the
+    prompt and `completion_tokens`, and corrected by the usage the model reports.
+
+    It can be set through the LLM configuration with a `rate_limit` key (the `RateLimiter` arguments)::
+
+        default_llm:
+          class_name: langchain_openai.ChatOpenAI
+          model_name: gpt-4o-mini
+          rate_limit:
+            name: openai-gpt-4o-mini
+            requests_per_minute: 500
+            tokens_per_minute: 200000
+
+    The model's own retries should be disabled (`get_llm` sets `max_retries` to 0 when the model supports it), so
+    rate limited calls are only retried by the limiter. Attributes that are not part of the `Runnable` interface are
+    taken from the wrapped model.
+    """
+
+    def __init__(
+        self,
+        llm: Runnable,
+        rate_limiter: RateLimiter,
+        completion_tokens: int = 256,
+    ):
+        """
+        Initialize the rate limited LLM.
+
+        :param llm:               The language model to wrap.
+        :param rate_limiter:      The rate limiter to send the calls through.
+        :param completion_tokens: The estimated completion tokens of a call.
+        """
+        # Imported here to avoid a circular import (the chains import the config):
+        from genai_factory.chains.context_packing import get_token_counter
+
+        self.llm = llm
+        self.rate_limiter = rate_limiter
+        self.completion_tokens = completion_tokens
+        self._count_tokens, _ = get_token_counter()
+
+    def __getattr__(self, name: str):
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    @property
+    def InputType(self):
+        return self.llm.InputType
+
+    @property
+    def OutputType(self):
+        return self.llm.OutputType
+
+    def _estimate_tokens(self, input) -> int:
+        return self._count_tokens(_input_text(input)) + self.completion_tokens
+
+    def invoke(self, input, config: Optional[RunnableConfig] = None, **kwargs):
+        return self.rate_limiter.call(
+            lambda: self.llm.invoke(input, config, **kwargs),
+            tokens=self._estimate_tokens(input),
+            usage=_used_tokens,
+        )
+
+    async def ainvoke(self, input, config: Optional[RunnableConfig] = None, **kwargs):
+        return await self.rate_limiter.acall(
+            lambda: self.llm.ainvoke(input, config, **kwargs),
+            tokens=self._estimate_tokens(input),
+            usage=_used_tokens,
+        )
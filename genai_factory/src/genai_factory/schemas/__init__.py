@@ -22,6 +22,7 @@ from genai_factory.schemas.base import (
 from genai_factory.schemas.data_source import DataSource, DataSourceType
 from genai_factory.schemas.dataset import Dataset
 from genai_factory.schemas.document import Document
+from genai_factory.schemas.job import IngestionJob, JobStatus
 from genai_factory.schemas.model import Model, ModelType
 from genai_factory.schemas.project import Project
 from genai_factory.schemas.prompt_template import PromptTemplate
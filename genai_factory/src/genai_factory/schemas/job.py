@@ -0,0 +1,50 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from enum import Enum
+from typing import List, Optional
+
+from genai_factory.schemas.base import BaseWithOwner
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    CANCELLING = "cancelling"
+    CANCELLED = "cancelled"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+    def is_terminal(self) -> bool:
+        return self in [JobStatus.CANCELLED, JobStatus.COMPLETED, JobStatus.FAILED]
+
+
+class IngestionJob(BaseWithOwner):
+    _extra_fields = ["errors"]
+    _top_level_fields = ["data_source_id", "status"]
+
+    project_id: str
+    data_source_id: str
+    status: JobStatus = JobStatus.PENDING
+    loader: Optional[str] = None
+    paths: List[str] = []
+    document_ids: List[str] = []
+    total_files: int = 0
+    processed_files: int = 0
+    failed_files: int = 0
+    chunks: int = 0
+    chunks_per_second: Optional[float] = None
+    errors: List[str] = []
+    started: Optional[str] = None
+    finished: Optional[str] = None
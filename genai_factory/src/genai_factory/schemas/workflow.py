@@ -50,6 +50,7 @@ class WorkflowEvent:
         session_name=None,
         db_session=None,
         workflow_id=None,
+        trace_context=None,
         **kwargs,
     ):
         self.username = username
@@ -64,6 +65,9 @@ class WorkflowEvent:
         self.state = {}
         self.conversation: Conversation = Conversation()
         self.workflow_id = workflow_id
+        # Carrier of the workflow's tracing span context:
+        self.trace_context = trace_context
+        self.step_latencies = {}  # Step name to its latency in seconds
 
         self.db_session = db_session  # SQL db session (from FastAPI)
 
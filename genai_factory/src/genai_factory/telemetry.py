@@ -0,0 +1,353 @@
+# Copyright 2023 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Workflows instrumentation: OpenTelemetry spans per workflow, step and LangChain run, and Prometheus metrics that
+# are served by the workflows server under `/metrics`. Spans are no-ops unless an OpenTelemetry SDK is configured
+# in the process (for example, by running the server with `opentelemetry-instrument`).
+
+import contextlib
+import contextvars
+import time
+from typing import Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from opentelemetry import propagate, trace
+from opentelemetry.trace import Status, StatusCode
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+tracer = trace.get_tracer("genai-factory")
+
+# The name of the step currently running, used to label the metrics of nested LangChain runs:
+_current_step = contextvars.ContextVar("genai_factory_current_step", default="")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_SIZE_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+WORKFLOW_LATENCY = Histogram(
+    "genai_factory_workflow_latency_seconds",
+    "Latency of a workflow run.",
+    ["workflow"],
+    buckets=_LATENCY_BUCKETS,
+)
+STEP_LATENCY = Histogram(
+    "genai_factory_step_latency_seconds",
+    "Latency of a single workflow step.",
+    ["workflow", "step"],
+    buckets=_LATENCY_BUCKETS,
+)
+STEP_ERRORS = Counter(
+    "genai_factory_step_errors_total",
+    "Number of workflow step failures.",
+    ["workflow", "step"],
+)
+LLM_LATENCY = Histogram(
+    "genai_factory_llm_latency_seconds",
+    "Latency of LLM calls.",
+    ["step"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "genai_factory_llm_tokens_total",
+    "Number of LLM tokens used, by kind (prompt or completion).",
+    ["step", "kind"],
+)
+RETRIEVAL_LATENCY = Histogram(
+    "genai_factory_retrieval_latency_seconds",
+    "Latency of document retrievals.",
+    ["step"],
+    buckets=_LATENCY_BUCKETS,
+)
+RETRIEVAL_DOCUMENTS = Histogram(
+    "genai_factory_retrieval_documents",
+    "Number of documents returned by a retrieval (k).",
+    ["step"],
+    buckets=_SIZE_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "genai_factory_cache_requests_total",
+    "Number of cache lookups, by result (hit or miss).",
+    ["cache", "result"],
+)
+BATCH_SIZE = Histogram(
+    "genai_factory_batch_size",
+    "Number of items processed together by a micro batcher.",
+    ["batcher"],
+    buckets=_SIZE_BUCKETS,
+)
+
+ADMISSION_REQUESTS = Counter(
+    "genai_factory_admission_requests_total",
+    "Number of workflow requests by admission result (admitted, queue_full, timeout or shed).",
+    ["workflow", "lane", "result"],
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "genai_factory_admission_queue_wait_seconds",
+    "Time workflow requests waited in the admission queue.",
+    ["workflow", "lane"],
+    buckets=_LATENCY_BUCKETS,
+)
+ADMISSION_QUEUED = Gauge(
+    "genai_factory_admission_queued",
+    "Number of workflow requests waiting in the admission queue.",
+    ["workflow", "lane"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "genai_factory_admission_in_flight",
+    "Number of workflow requests running.",
+    ["workflow"],
+)
+
+RATE_LIMIT_WAIT = Histogram(
+    "genai_factory_rate_limit_wait_seconds",
+    "Time LLM provider requests waited for the rate limiter.",
+    ["limiter"],
+    buckets=_LATENCY_BUCKETS,
+)
+RATE_LIMIT_CONCURRENCY = Gauge(
+    "genai_factory_rate_limit_concurrency",
+    "Adaptive concurrency limit of LLM provider requests.",
+    ["limiter"],
+)
+RATE_LIMITED_REQUESTS = Counter(
+    "genai_factory_rate_limited_requests_total",
+    "Number of LLM provider requests rejected with a rate limit (429) error.",
+    ["limiter"],
+)
+
+
+def record_cache_lookup(cache: str, hit: bool, count: int = 1):
+    """
+    Record cache lookups.
+
+    :param cache: The name of the cache.
+    :param hit:   Whether the lookups were hits.
+    :param count: The number of lookups to record.
+    """
+    if count:
+        CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc(count)
+
+
+def inject_trace_context() -> dict:
+    """
+    Serialize the current span context, so it can be carried by an event into the workflow graph.
+
+    :return: The trace context carrier dictionary.
+    """
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+@contextlib.contextmanager
+def workflow_span(workflow: str):
+    """
+    Trace and time a workflow run.
+
+    :param workflow: The workflow name.
+    """
+    start = time.perf_counter()
+    try:
+        with tracer.start_as_current_span(
+            f"workflow {workflow}", attributes={"genai_factory.workflow": workflow}
+        ) as span:
+            yield span
+    finally:
+        # Failed runs are timed as well:
+        WORKFLOW_LATENCY.labels(workflow=workflow).observe(time.perf_counter() - start)
+
+
+@contextlib.contextmanager
+def step_span(
+    step: str,
+    workflow: str = "",
+    trace_context: Optional[dict] = None,
+    timings: Optional[dict] = None,
+):
+    """
+    Trace and time a workflow step. The span is a child of the workflow span carried in `trace_context` (if any).
+
+    :param step:          The step name.
+    :param workflow:      The workflow name.
+    :param trace_context: The trace context carrier of the event (see `inject_trace_context`).
+    :param timings:       A dictionary to record the step's latency in seconds to, under the step's name.
+    """
+    parent = propagate.extract(trace_context) if trace_context else None
+    token = _current_step.set(step)
+    start = time.perf_counter()
+    try:
+        with tracer.start_as_current_span(
+            f"step {step}",
+            context=parent,
+            attributes={"genai_factory.workflow": workflow, "genai_factory.step": step},
+        ) as span:
+            yield span
+    except BaseException:
+        STEP_ERRORS.labels(workflow=workflow, step=step).inc()
+        raise
+    finally:
+        latency = time.perf_counter() - start
+        STEP_LATENCY.labels(workflow=workflow, step=step).observe(latency)
+        if timings is not None:
+            timings[step] = latency
+        _current_step.reset(token)
+
+
+def metrics_response():
+    """
+    Render the Prometheus metrics of this process as a FastAPI response.
+    """
+    from fastapi import Response
+
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback handler that opens a span per nested LLM, retriever and chain run and records token usage,
+    LLM latency, retrieval latency and the number of retrieved documents.
+    """
+
+    def __init__(self):
+        self._runs: Dict[UUID, tuple] = {}
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], name: str, kind: str):
+        parent = self._runs.get(parent_run_id)
+        context = trace.set_span_in_context(parent[0]) if parent else None
+        span = tracer.start_span(
+            name,
+            context=context,
+            attributes={
+                "genai_factory.step": _current_step.get(),
+                "langchain.run_type": kind,
+            },
+        )
+        self._runs[run_id] = (span, time.perf_counter())
+
+    def _end(self, run_id: UUID, error: BaseException = None) -> tuple:
+        span, start = self._runs.pop(run_id, (None, None))
+        if span is None:
+            return None, 0.0
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(Status(StatusCode.ERROR, str(error)))
+        span.end()
+        return span, time.perf_counter() - start
+
+    @staticmethod
+    def _run_name(serialized: Optional[dict], default: str) -> str:
+        serialized = serialized or {}
+        return serialized.get("name") or (serialized.get("id") or [default])[-1]
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs
+    ):
+        self._start(
+            run_id,
+            parent_run_id,
+            f"chain {self._run_name(serialized, 'chain')}",
+            "chain",
+        )
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_llm_start(
+        self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs
+    ):
+        self._start(
+            run_id, parent_run_id, f"llm {self._run_name(serialized, 'llm')}", "llm"
+        )
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, parent_run_id=None, **kwargs
+    ):
+        self._start(
+            run_id,
+            parent_run_id,
+            f"llm {self._run_name(serialized, 'chat_model')}",
+            "llm",
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span, latency = self._end(run_id)
+        step = _current_step.get()
+        LLM_LATENCY.labels(step=step).observe(latency)
+        prompt_tokens, completion_tokens = self._token_usage(response)
+        if prompt_tokens:
+            LLM_TOKENS.labels(step=step, kind="prompt").inc(prompt_tokens)
+        if completion_tokens:
+            LLM_TOKENS.labels(step=step, kind="completion").inc(completion_tokens)
+        if span is not None:
+            span.set_attribute("llm.prompt_tokens", prompt_tokens)
+            span.set_attribute("llm.completion_tokens", completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_retriever_start(
+        self, serialized, query, *, run_id, parent_run_id=None, **kwargs
+    ):
+        self._start(
+            run_id,
+            parent_run_id,
+            f"retriever {self._run_name(serialized, 'retriever')}",
+            "retriever",
+        )
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        span, latency = self._end(run_id)
+        step = _current_step.get()
+        RETRIEVAL_LATENCY.labels(step=step).observe(latency)
+        RETRIEVAL_DOCUMENTS.labels(step=step).observe(len(documents))
+        if span is not None:
+            span.set_attribute("retrieval.k", len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    @staticmethod
+    def _token_usage(response) -> tuple:
+        """
+        Get the prompt and completion token counts of an LLM result, from the provider's `token_usage` report or from
+        the messages' usage metadata.
+        """
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                metadata = (
+                    getattr(
+                        getattr(generation, "message", None), "usage_metadata", None
+                    )
+                    or {}
+                )
+                prompt_tokens += metadata.get("input_tokens", 0)
+                completion_tokens += metadata.get("output_tokens", 0)
+        return prompt_tokens, completion_tokens
+
+
+# A shared handler to pass as a LangChain callback from the steps:
+telemetry_callback = TelemetryCallbackHandler()
@@ -12,8 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
 import logging
+import os
+from typing import Union
 
 # Initialize the GenAI Factory logger:
 logger = logging.getLogger("genai-factory")
 logger.addHandler(logging.StreamHandler())
+
+
+@contextlib.contextmanager
+def file_lock(path: Union[str, os.PathLike]):
+    """
+    Hold an exclusive lock on a lock file, to serialize writers of the same files across processes. The lock file is
+    created if it does not exist, and the lock is released when the block exits (or the process dies).
+
+    :param path: The lock file path.
+    """
+    import fcntl
+
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
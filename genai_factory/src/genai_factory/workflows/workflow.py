@@ -13,17 +13,21 @@
 # limitations under the License.
 
 import os
-from typing import List, Union
+from typing import List, Optional, Union
 
 import mlrun.serving as mlrun_serving
 from mlrun.serving.states import RootFlowStep
 from mlrun.utils import get_caller_globals
 
+from genai_factory.admission import AdmissionController
+from genai_factory.chains.base import ChainRunner
+from genai_factory.chains.parallel import DagSteps
 from genai_factory.config import WorkflowServerConfig
 from genai_factory.controller_client import ControllerClient
 from genai_factory.schemas import APIDictResponse, WorkflowType
 from genai_factory.schemas import Workflow as WorkflowSchema
 from genai_factory.sessions import SessionStore
+from genai_factory.telemetry import inject_trace_context, workflow_span
 
 
 class Workflow:
@@ -59,6 +63,7 @@ class Workflow:
         # Prepare future instances:
         self._graph = None
         self._server = None
+        self._admission = None
 
     def to_schema(self) -> WorkflowSchema:
         return WorkflowSchema(
@@ -85,6 +90,12 @@ class Workflow:
     def build(self, config: WorkflowServerConfig, session_store: SessionStore):
         self._config = config
         self._session_store = session_store
+        admission_kwargs = self.get_config().get("admission")
+        self._admission = (
+            AdmissionController(self._name, **admission_kwargs)
+            if admission_kwargs
+            else None
+        )
         steps_config = self._config.workflows_kwargs.get(self._name, {}).get(
             "steps", {}
         )
@@ -93,26 +104,162 @@ class Workflow:
             return
         if isinstance(self._skeleton, list):
             self._graph = mlrun_serving.states.RootFlowStep()
-            last_step = self._graph
-            for step in self._skeleton:
-                if isinstance(step, dict):
-                    step_name = step.get("name", step["class_name"])
-                    if step_name in getattr(steps_config, "steps", {}):
-                        step.update(steps_config["steps"][step_name])
-                    last_step = last_step.to(**step)
-                else:
-                    step_name = step.name
-                    if step_name in getattr(steps_config, "steps", {}):
-                        step.class_args = steps_config["steps"][step_name]
-                    last_step = last_step.to(step)
+            if any(
+                isinstance(step, dict) and ("after" in step or "step" in step)
+                for step in self._skeleton
+            ):
+                last_step = self._build_dag(steps_config)
+            else:
+                last_step = self._graph
+                for step in self._skeleton:
+                    last_step = last_step.to(**self._configure_step(step, steps_config))
             last_step.respond()
             return
 
         # Skeleton is a graph dictionary:
         self._graph = mlrun_serving.states.RootFlowStep.from_dict(self._skeleton)
         for step in self._graph:
-            if step.name in getattr(steps_config, "steps", {}):
-                step.class_args = steps_config["steps"][step.name]
+            if step.name in steps_config:
+                step.class_args = {
+                    **(step.class_args or {}),
+                    **steps_config[step.name],
+                }
+
+    @staticmethod
+    def _configure_step(step, steps_config: dict) -> dict:
+        """
+        Apply the step's configuration to a skeleton step, returning the arguments to add it to the graph with.
+        """
+        if isinstance(step, dict):
+            step_name = step.get("name", step["class_name"])
+            if step_name in steps_config:
+                step.update(steps_config[step_name])
+            return step
+        # The step is already initialized, so set its configured arguments as attributes:
+        for key, value in steps_config.get(step.name, {}).items():
+            setattr(step, key, value)
+        return {"class_name": step}
+
+    def _build_dag(self, steps_config: dict):
+        """
+        Build a skeleton with `after` dependencies. Every step comes after the steps named in its `after` list (an empty
+        list starts it with the workflow), or after the previous step if it has none. Initialized steps are given as
+        `{"step": <step>, "after": [...]}`::
+
+            [
+                SessionLoader(),
+                {"step": RefineQuery(name="refine")},
+                {"class_name": "my_module.IntentClassifier", "name": "intent", "after": ["SessionLoader"]},
+                {"class_name": "genai_factory.chains.retrieval.MultiRetriever", "after": ["refine"]},
+                {"step": HistorySaver(), "after": ["intent", "MultiRetriever"]},
+            ]
+
+        The steps that all the branches pass through (above, the session loader and the history saver) are added to
+        the graph as they are, and the steps between them run concurrently by their dependencies in a `DagSteps` step,
+        which joins their results.
+
+        :return: The last step of the graph.
+        """
+        names, steps, dependencies = [], [], []
+        for step in self._skeleton:
+            if isinstance(step, dict) and "step" in step:
+                after, step = step.get("after"), step["step"]
+                name = step.name
+            elif isinstance(step, dict):
+                step = dict(step)
+                after = step.pop("after", None)
+                # Named by the class without its module, like `DagSteps` names its steps:
+                name = step.setdefault("name", step["class_name"].rsplit(".", 1)[-1])
+            else:
+                after, name = None, step.name
+            if after is None:
+                after = names[-1:]
+            for dependency in after:
+                if dependency not in names:
+                    raise ValueError(
+                        f"Step '{name}' must come after '{dependency}' in the workflow skeleton"
+                    )
+            if name in names:
+                raise ValueError(f"The step name '{name}' is not unique")
+            names.append(name)
+            steps.append(step)
+            dependencies.append(after)
+
+        # The transitive dependencies of every step:
+        ancestors: List[set] = []
+        for after in dependencies:
+            step_ancestors = {names.index(dependency) for dependency in after}
+            for dependency in after:
+                step_ancestors |= ancestors[names.index(dependency)]
+            ancestors.append(step_ancestors)
+
+        last_step = self._graph
+        branches: List[int] = []
+        for i, step in enumerate(steps):
+            # A step that comes after all the previous steps and before all the next ones stays in the graph:
+            if len(ancestors[i]) == i and all(
+                i in ancestors[j] for j in range(i + 1, len(steps))
+            ):
+                if branches:
+                    last_step = last_step.to(
+                        **self._configure_dag_steps(
+                            branches, names, steps, dependencies, steps_config
+                        )
+                    )
+                    branches = []
+                last_step = last_step.to(**self._configure_step(step, steps_config))
+            else:
+                branches.append(i)
+        if branches:
+            last_step = last_step.to(
+                **self._configure_dag_steps(
+                    branches, names, steps, dependencies, steps_config
+                )
+            )
+        return last_step
+
+    def _configure_dag_steps(
+        self,
+        branches: List[int],
+        names: List[str],
+        steps: list,
+        dependencies: List[List[str]],
+        steps_config: dict,
+    ) -> dict:
+        """
+        Create the `DagSteps` step that runs the given steps of a DAG skeleton concurrently.
+        """
+        branch_names = [names[i] for i in branches]
+        inner_steps = []
+        inner_dependencies = {}
+        for i in branches:
+            self._configure_step(steps[i], steps_config)
+            if isinstance(steps[i], dict):
+                # Initialized by `DagSteps` with the graph's namespace, like the other steps:
+                inner_steps.append({**steps[i], "name": names[i]})
+            elif isinstance(steps[i], ChainRunner):
+                inner_steps.append(steps[i])
+            else:
+                raise ValueError(
+                    f"Step '{names[i]}' runs concurrently with other steps, so it must be a ChainRunner "
+                    f"(got {type(steps[i]).__name__})"
+                )
+            inner_dependencies[names[i]] = [
+                name for name in dependencies[i] if name in branch_names
+            ]
+        dag_steps = DagSteps(
+            steps=inner_steps,
+            dependencies=inner_dependencies,
+            name="+".join(branch_names),
+        )
+        return self._configure_step(dag_steps, steps_config)
+
+    @property
+    def admission(self) -> Optional[AdmissionController]:
+        """
+        The workflow's admission controller, if admission is configured (`workflows_kwargs[name]["admission"]`).
+        """
+        return self._admission
 
     @property
     def server(self) -> mlrun_serving.GraphServer:
@@ -144,21 +291,40 @@ class Workflow:
             context._config = self._config
         if getattr(context, "session_store", None) is None:
             context.session_store = self._session_store
+        context.workflow_name = self._name
 
     async def run(self, event, db_session=None):
         # todo: pass sql db_session to steps via context or event
         server = self.server
-        try:
-            resp = await server.test("", body=event)
-        except Exception as e:
-            server.wait_for_completion()
-            raise e
+        with workflow_span(self._name):
+            if isinstance(event, dict):
+                # Copied, to not modify the caller's event:
+                event = {**event, "trace_context": inject_trace_context()}
+            try:
+                resp = await server.test("", body=event)
+            except Exception as e:
+                server.wait_for_completion()
+                raise e
+
+        if resp.results.get("stop"):
+            # A step (usually a guardrail) rejected the request, answer with its error message:
+            return APIDictResponse(
+                success=True,
+                data={
+                    "answer": resp.results.get("error_message", ""),
+                    "sources": [],
+                    "returned_state": {
+                        "stopped": True,
+                        "step_latencies": resp.step_latencies,
+                    },
+                },
+            )
 
         return APIDictResponse(
             success=True,
             data={
                 "answer": resp.results["answer"],
                 "sources": resp.results.get("sources", []),
-                "returned_state": {},
+                "returned_state": {"step_latencies": resp.step_latencies},
             },
         )
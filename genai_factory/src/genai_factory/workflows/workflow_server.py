@@ -20,6 +20,7 @@ from genai_factory.config import WorkflowServerConfig
 from genai_factory.controller_client import ControllerClient
 from genai_factory.schemas import WorkflowType
 from genai_factory.sessions import SessionStore
+from genai_factory.telemetry import metrics_response
 from genai_factory.utils import logger
 from genai_factory.workflows import Workflow
 
@@ -30,6 +31,7 @@ class WorkflowServer:
         self._controller_client = None
         self._session_store = None
         self._workflows: dict[str, Workflow] = {}
+        self._ingestion_jobs = None
 
     @property
     def config(self) -> WorkflowServerConfig:
@@ -41,6 +43,17 @@ class WorkflowServer:
             self._set_controller_client()
         return self._controller_client
 
+    @property
+    def ingestion_jobs(self):
+        if not self._ingestion_jobs:
+            # Imported here to keep the document loaders out of the package import:
+            from genai_factory.ingestion_jobs import IngestionJobRunner
+
+            self._ingestion_jobs = IngestionJobRunner(
+                config=self._config, controller_client=self.controller_client
+            )
+        return self._ingestion_jobs
+
     def _set_controller_client(self):
         self._controller_client = ControllerClient(
             controller_url=self._config.controller_url,
@@ -82,13 +95,23 @@ class WorkflowServer:
             labels=labels,
         )
 
-    async def run_workflow(self, name: str, event):
+    async def run_workflow(self, name: str, event, is_admin: bool = False):
         # Get the workflow object:
         if name not in self._workflows:
             raise ValueError(f"workflow {name} not found")
-
-        # Run the workflow:
-        return await self._workflows[name].run(event)
+        workflow = self._workflows[name]
+
+        # Run the workflow, waiting for a slot when admission is configured (raises `AdmissionRejected`):
+        if workflow.admission is None:
+            return await workflow.run(event)
+        username = (
+            event.get("username")
+            if isinstance(event, dict)
+            else getattr(event, "username", None)
+        )
+        lane = workflow.admission.lane_of(username, is_admin)
+        async with workflow.admission.admit(lane):
+            return await workflow.run(event)
 
     def _build(self):
         logger.info("Building workflows")
@@ -142,6 +165,11 @@ class WorkflowServer:
             allow_headers=["*"],
         )
 
+        # Expose the in-process Prometheus metrics:
+        app.add_api_route(
+            "/metrics", metrics_response, methods=["GET"], include_in_schema=False
+        )
+
         extra = app.extra or {}
         extra["app_server"] = self
         app.extra = extra